@@ -0,0 +1,46 @@
+"""Add PBX subscription tracking columns
+
+Revision ID: 8c1f4e7a2d90
+Revises: 369b2a62c500
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8c1f4e7a2d90"
+down_revision: Union[str, Sequence[str], None] = "369b2a62c500"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "subscriptions",
+        sa.Column("pbx_subscription_id", sa.String(), nullable=True),
+    )
+    op.add_column(
+        "subscriptions",
+        sa.Column("pbx_expires_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index(
+        op.f("ix_subscriptions_pbx_subscription_id"),
+        "subscriptions",
+        ["pbx_subscription_id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        op.f("ix_subscriptions_pbx_subscription_id"), table_name="subscriptions"
+    )
+    op.drop_column("subscriptions", "pbx_expires_at")
+    op.drop_column("subscriptions", "pbx_subscription_id")
@@ -0,0 +1,40 @@
+"""Add indexes for paginated subscription listing
+
+Revision ID: a7d3f9c2e614
+Revises: f3c8e2a9b417
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a7d3f9c2e614"
+down_revision: Union[str, Sequence[str], None] = "f3c8e2a9b417"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        "ix_subscriptions_domain_id",
+        "subscriptions",
+        ["api_server", "domain", "id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_subscriptions_domain_user",
+        "subscriptions",
+        ["api_server", "domain", "user", "id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_subscriptions_domain_user", table_name="subscriptions")
+    op.drop_index("ix_subscriptions_domain_id", table_name="subscriptions")
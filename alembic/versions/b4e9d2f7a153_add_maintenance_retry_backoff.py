@@ -0,0 +1,41 @@
+"""Add maintenance retry backoff columns
+
+Revision ID: b4e9d2f7a153
+Revises: a7d3f9c2e614
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b4e9d2f7a153"
+down_revision: Union[str, Sequence[str], None] = "a7d3f9c2e614"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in ("subscriptions", "oauth_credentials"):
+        op.add_column(
+            table,
+            sa.Column(
+                "attempt_count", sa.Integer(), server_default="0", nullable=False
+            ),
+        )
+        op.add_column(
+            table,
+            sa.Column("next_attempt_at", sa.DateTime(timezone=True), nullable=True),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ("oauth_credentials", "subscriptions"):
+        op.drop_column(table, "next_attempt_at")
+        op.drop_column(table, "attempt_count")
@@ -0,0 +1,150 @@
+"""Add reconciliation_runs and drift_reports tables
+
+Revision ID: b7e3d52a9c14
+Revises: 8c1f4e7a2d90
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b7e3d52a9c14"
+down_revision: Union[str, Sequence[str], None] = "8c1f4e7a2d90"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "reconciliation_runs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("api_server", sa.String(), nullable=False),
+        sa.Column("domain", sa.String(), nullable=False),
+        sa.Column("trigger", sa.String(), nullable=False),
+        sa.Column("auto_repair", sa.Boolean(), server_default="false", nullable=True),
+        sa.Column("status", sa.String(), server_default="running", nullable=True),
+        sa.Column("db_count", sa.Integer(), server_default="0", nullable=True),
+        sa.Column("pbx_count", sa.Integer(), server_default="0", nullable=True),
+        sa.Column("missing_count", sa.Integer(), server_default="0", nullable=True),
+        sa.Column("unmanaged_count", sa.Integer(), server_default="0", nullable=True),
+        sa.Column(
+            "expiry_drift_count", sa.Integer(), server_default="0", nullable=True
+        ),
+        sa.Column(
+            "post_url_drift_count", sa.Integer(), server_default="0", nullable=True
+        ),
+        sa.Column("repaired_count", sa.Integer(), server_default="0", nullable=True),
+        sa.Column("message", sa.Text(), nullable=True),
+        sa.Column(
+            "started_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_reconciliation_runs_api_server"),
+        "reconciliation_runs",
+        ["api_server"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_reconciliation_runs_domain"),
+        "reconciliation_runs",
+        ["domain"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_reconciliation_runs_id"), "reconciliation_runs", ["id"], unique=False
+    )
+    op.create_index(
+        op.f("ix_reconciliation_runs_started_at"),
+        "reconciliation_runs",
+        ["started_at"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_reconciliation_runs_status"),
+        "reconciliation_runs",
+        ["status"],
+        unique=False,
+    )
+
+    op.create_table(
+        "drift_reports",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("run_id", sa.Integer(), nullable=False),
+        sa.Column("api_server", sa.String(), nullable=False),
+        sa.Column("domain", sa.String(), nullable=False),
+        sa.Column("user", sa.String(), nullable=False),
+        sa.Column("subscription_model", sa.String(), nullable=False),
+        sa.Column("post_url", sa.String(), nullable=False),
+        sa.Column("drift_type", sa.String(), nullable=False),
+        sa.Column("subscription_id", sa.Integer(), nullable=True),
+        sa.Column("pbx_subscription_id", sa.String(), nullable=True),
+        sa.Column("db_expires_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("pbx_expires_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("pbx_post_url", sa.String(), nullable=True),
+        sa.Column("repaired", sa.Boolean(), server_default="false", nullable=True),
+        sa.Column("details", sa.Text(), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.ForeignKeyConstraint(
+            ["run_id"], ["reconciliation_runs.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_drift_reports_api_server"),
+        "drift_reports",
+        ["api_server"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_drift_reports_domain"), "drift_reports", ["domain"], unique=False
+    )
+    op.create_index(
+        op.f("ix_drift_reports_drift_type"),
+        "drift_reports",
+        ["drift_type"],
+        unique=False,
+    )
+    op.create_index(op.f("ix_drift_reports_id"), "drift_reports", ["id"], unique=False)
+    op.create_index(
+        op.f("ix_drift_reports_run_id"), "drift_reports", ["run_id"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_drift_reports_run_id"), table_name="drift_reports")
+    op.drop_index(op.f("ix_drift_reports_id"), table_name="drift_reports")
+    op.drop_index(op.f("ix_drift_reports_drift_type"), table_name="drift_reports")
+    op.drop_index(op.f("ix_drift_reports_domain"), table_name="drift_reports")
+    op.drop_index(op.f("ix_drift_reports_api_server"), table_name="drift_reports")
+    op.drop_table("drift_reports")
+
+    op.drop_index(
+        op.f("ix_reconciliation_runs_status"), table_name="reconciliation_runs"
+    )
+    op.drop_index(
+        op.f("ix_reconciliation_runs_started_at"), table_name="reconciliation_runs"
+    )
+    op.drop_index(op.f("ix_reconciliation_runs_id"), table_name="reconciliation_runs")
+    op.drop_index(
+        op.f("ix_reconciliation_runs_domain"), table_name="reconciliation_runs"
+    )
+    op.drop_index(
+        op.f("ix_reconciliation_runs_api_server"), table_name="reconciliation_runs"
+    )
+    op.drop_table("reconciliation_runs")
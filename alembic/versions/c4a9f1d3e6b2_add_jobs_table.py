@@ -0,0 +1,65 @@
+"""Add jobs table
+
+Revision ID: c4a9f1d3e6b2
+Revises: b7e3d52a9c14
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c4a9f1d3e6b2"
+down_revision: Union[str, Sequence[str], None] = "b7e3d52a9c14"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "jobs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("api_server", sa.String(), nullable=False),
+        sa.Column("domain", sa.String(), nullable=False),
+        sa.Column("user", sa.String(), nullable=True),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), server_default="queued", nullable=True),
+        sa.Column("params", sa.JSON(), nullable=True),
+        sa.Column("result", sa.JSON(), nullable=True),
+        sa.Column("message", sa.Text(), nullable=True),
+        sa.Column("token", sa.Text(), nullable=True),
+        sa.Column("progress_current", sa.Integer(), server_default="0", nullable=True),
+        sa.Column("progress_total", sa.Integer(), nullable=True),
+        sa.Column(
+            "cancel_requested", sa.Boolean(), server_default="false", nullable=True
+        ),
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=True),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("heartbeat_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_jobs_api_server"), "jobs", ["api_server"], unique=False)
+    op.create_index(op.f("ix_jobs_domain"), "jobs", ["domain"], unique=False)
+    op.create_index(op.f("ix_jobs_id"), "jobs", ["id"], unique=False)
+    op.create_index(op.f("ix_jobs_kind"), "jobs", ["kind"], unique=False)
+    op.create_index(op.f("ix_jobs_status"), "jobs", ["status"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_jobs_status"), table_name="jobs")
+    op.drop_index(op.f("ix_jobs_kind"), table_name="jobs")
+    op.drop_index(op.f("ix_jobs_id"), table_name="jobs")
+    op.drop_index(op.f("ix_jobs_domain"), table_name="jobs")
+    op.drop_index(op.f("ix_jobs_api_server"), table_name="jobs")
+    op.drop_table("jobs")
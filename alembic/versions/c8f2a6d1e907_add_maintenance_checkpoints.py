@@ -0,0 +1,40 @@
+"""Add maintenance checkpoints table
+
+Revision ID: c8f2a6d1e907
+Revises: b4e9d2f7a153
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c8f2a6d1e907"
+down_revision: Union[str, Sequence[str], None] = "b4e9d2f7a153"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "maintenance_checkpoints",
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("position", sa.JSON(), nullable=True),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.PrimaryKeyConstraint("name"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("maintenance_checkpoints")
@@ -0,0 +1,81 @@
+"""Add change_version cursor to subscriptions
+
+Revision ID: d2f8a6c1b953
+Revises: c4a9f1d3e6b2
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d2f8a6c1b953"
+down_revision: Union[str, Sequence[str], None] = "c4a9f1d3e6b2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE SEQUENCE subscriptions_change_seq")
+    # Volatile defaults: existing rows each receive their own initial version
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "change_version",
+            sa.BigInteger(),
+            server_default=sa.text("nextval('subscriptions_change_seq')"),
+            nullable=False,
+        ),
+    )
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "change_xid",
+            sa.BigInteger(),
+            server_default=sa.text("(pg_current_xact_id()::text::bigint)"),
+            nullable=False,
+        ),
+    )
+    op.create_index(
+        "ix_subscriptions_domain_change_version",
+        "subscriptions",
+        ["api_server", "domain", "change_version"],
+        unique=False,
+    )
+
+    # Every UPDATE, whether ORM, bulk statement or upsert, moves the row forward
+    op.execute(
+        """
+        CREATE FUNCTION subscriptions_bump_change_version() RETURNS trigger AS $$
+        BEGIN
+            NEW.change_version := nextval('subscriptions_change_seq');
+            NEW.change_xid := pg_current_xact_id()::text::bigint;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER subscriptions_change_version
+        BEFORE UPDATE ON subscriptions
+        FOR EACH ROW
+        WHEN (OLD.* IS DISTINCT FROM NEW.*)
+        EXECUTE FUNCTION subscriptions_bump_change_version()
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS subscriptions_change_version ON subscriptions")
+    op.execute("DROP FUNCTION IF EXISTS subscriptions_bump_change_version()")
+    op.drop_index("ix_subscriptions_domain_change_version", table_name="subscriptions")
+    op.drop_column("subscriptions", "change_xid")
+    op.drop_column("subscriptions", "change_version")
+    op.execute("DROP SEQUENCE IF EXISTS subscriptions_change_seq")
@@ -0,0 +1,146 @@
+"""Add commit-ordered domain version to domain_health
+
+Revision ID: d9a3b6e4f215
+Revises: c8f2a6d1e907
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d9a3b6e4f215"
+down_revision: Union[str, Sequence[str], None] = "c8f2a6d1e907"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DELTA_COLUMNS = """
+    coalesce(sum(sign) FILTER (WHERE status = 'active'), 0) AS a,
+    coalesce(sum(sign) FILTER (
+        WHERE status = 'active' AND maintenance_status = 'failed'
+    ), 0) AS f,
+    coalesce(sum(sign) FILTER (WHERE status = 'expired'), 0) AS e,
+    coalesce(sum(sign) FILTER (WHERE status = 'archived'), 0) AS r
+"""
+
+# Updates count only rows that really changed: the change_version trigger
+# moves a row's version exactly when one of its columns differs
+VERSIONED_FUNCTION = f"""
+    CREATE OR REPLACE FUNCTION domain_health_apply_delta() RETURNS trigger AS $$
+    DECLARE
+        source text;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            source := 'SELECT 1 AS sign, * FROM new_rows';
+        ELSIF TG_OP = 'DELETE' THEN
+            source := 'SELECT -1 AS sign, * FROM old_rows';
+        ELSE
+            source := 'SELECT 1 AS sign, n.* FROM new_rows n JOIN old_rows o USING (id)
+                       WHERE n.change_version <> o.change_version
+                       UNION ALL
+                       SELECT -1 AS sign, o.* FROM old_rows o JOIN new_rows n USING (id)
+                       WHERE n.change_version <> o.change_version';
+        END IF;
+
+        EXECUTE format(
+            $sql$
+            INSERT INTO domain_health AS h (
+                api_server, domain, active_count, failed_count,
+                expired_count, archived_count, version
+            )
+            SELECT delta.*, nextval('subscriptions_change_seq') FROM (
+                SELECT api_server, domain, {DELTA_COLUMNS}
+                FROM (%s) AS changed
+                GROUP BY api_server, domain
+            ) AS delta
+            ORDER BY api_server, domain
+            ON CONFLICT (api_server, domain) DO UPDATE SET
+                active_count = h.active_count + EXCLUDED.active_count,
+                failed_count = h.failed_count + EXCLUDED.failed_count,
+                expired_count = h.expired_count + EXCLUDED.expired_count,
+                archived_count = h.archived_count + EXCLUDED.archived_count,
+                version = nextval('subscriptions_change_seq'),
+                updated_at = now()
+            $sql$,
+            source
+        );
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+COUNTS_ONLY_FUNCTION = f"""
+    CREATE OR REPLACE FUNCTION domain_health_apply_delta() RETURNS trigger AS $$
+    DECLARE
+        source text;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            source := 'SELECT 1 AS sign, * FROM new_rows';
+        ELSIF TG_OP = 'DELETE' THEN
+            source := 'SELECT -1 AS sign, * FROM old_rows';
+        ELSE
+            source := 'SELECT 1 AS sign, * FROM new_rows
+                       UNION ALL SELECT -1 AS sign, * FROM old_rows';
+        END IF;
+
+        EXECUTE format(
+            $sql$
+            INSERT INTO domain_health AS h (
+                api_server, domain, active_count, failed_count,
+                expired_count, archived_count
+            )
+            SELECT * FROM (
+                SELECT api_server, domain, {DELTA_COLUMNS}
+                FROM (%s) AS changed
+                GROUP BY api_server, domain
+            ) AS delta
+            WHERE a <> 0 OR f <> 0 OR e <> 0 OR r <> 0
+            ORDER BY api_server, domain
+            ON CONFLICT (api_server, domain) DO UPDATE SET
+                active_count = h.active_count + EXCLUDED.active_count,
+                failed_count = h.failed_count + EXCLUDED.failed_count,
+                expired_count = h.expired_count + EXCLUDED.expired_count,
+                archived_count = h.archived_count + EXCLUDED.archived_count,
+                updated_at = now()
+            $sql$,
+            source
+        );
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # subscriptions.change_version is drawn when a row is written, so a late
+    # commit can land below the domain's max and leave it unchanged. The
+    # trigger now also stamps the domain_health row with a fresh version on
+    # every write. Writers to a domain queue on that row lock, so the stored
+    # version changes with every commit, in commit order.
+    op.add_column(
+        "domain_health",
+        sa.Column("version", sa.BigInteger(), server_default="0", nullable=False),
+    )
+    # Start from the old validator so current ETags stay valid; domains
+    # whose rows never moved a count get their summary row now
+    op.execute(
+        """
+        INSERT INTO domain_health (api_server, domain, version)
+        SELECT api_server, domain, max(change_version)
+        FROM subscriptions
+        GROUP BY api_server, domain
+        ON CONFLICT (api_server, domain) DO UPDATE SET version = EXCLUDED.version
+        """
+    )
+    op.execute(VERSIONED_FUNCTION)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(COUNTS_ONLY_FUNCTION)
+    op.drop_column("domain_health", "version")
@@ -0,0 +1,75 @@
+"""Publish domain change notifications via NOTIFY
+
+Revision ID: e5b1c7d4a820
+Revises: d2f8a6c1b953
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e5b1c7d4a820"
+down_revision: Union[str, Sequence[str], None] = "d2f8a6c1b953"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("subscriptions", "oauth_credentials")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Payload is per table and domain only: Postgres folds identical
+    # notifications within a transaction, so a bulk write sends one message
+    op.execute(
+        """
+        CREATE FUNCTION notify_domain_change() RETURNS trigger AS $$
+        DECLARE
+            changed RECORD;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                changed := OLD;
+            ELSE
+                changed := NEW;
+            END IF;
+            PERFORM pg_notify(
+                'ns_domain_changes',
+                json_build_object(
+                    't', TG_TABLE_NAME,
+                    'a', changed.api_server,
+                    'd', changed.domain
+                )::text
+            );
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    for table in TABLES:
+        op.execute(
+            f"""
+            CREATE TRIGGER {table}_notify_write
+            AFTER INSERT OR DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION notify_domain_change()
+            """
+        )
+        op.execute(
+            f"""
+            CREATE TRIGGER {table}_notify_update
+            AFTER UPDATE ON {table}
+            FOR EACH ROW
+            WHEN (OLD.* IS DISTINCT FROM NEW.*)
+            EXECUTE FUNCTION notify_domain_change()
+            """
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_notify_update ON {table}")
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_notify_write ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS notify_domain_change()")
@@ -0,0 +1,150 @@
+"""Add incrementally maintained domain_health summary
+
+Revision ID: f3c8e2a9b417
+Revises: e5b1c7d4a820
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f3c8e2a9b417"
+down_revision: Union[str, Sequence[str], None] = "e5b1c7d4a820"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COUNT_COLUMNS = """
+    count(*) FILTER (WHERE status = 'active') AS active_count,
+    count(*) FILTER (
+        WHERE status = 'active' AND maintenance_status = 'failed'
+    ) AS failed_count,
+    count(*) FILTER (WHERE status = 'expired') AS expired_count,
+    count(*) FILTER (WHERE status = 'archived') AS archived_count
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "domain_health",
+        sa.Column("api_server", sa.String(), nullable=False),
+        sa.Column("domain", sa.String(), nullable=False),
+        sa.Column("active_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("failed_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("expired_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("archived_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column(
+            "expiring_soon_count", sa.Integer(), server_default="0", nullable=False
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("recounted_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("api_server", "domain"),
+    )
+
+    # One upsert per touched domain per statement, from the transition tables.
+    # Rows whose counted columns did not change net to zero and are skipped,
+    # so routine maintenance bookkeeping never locks the summary row.
+    op.execute(
+        """
+        CREATE FUNCTION domain_health_apply_delta() RETURNS trigger AS $$
+        DECLARE
+            source text;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                source := 'SELECT 1 AS sign, * FROM new_rows';
+            ELSIF TG_OP = 'DELETE' THEN
+                source := 'SELECT -1 AS sign, * FROM old_rows';
+            ELSE
+                source := 'SELECT 1 AS sign, * FROM new_rows
+                           UNION ALL SELECT -1 AS sign, * FROM old_rows';
+            END IF;
+
+            EXECUTE format(
+                $sql$
+                INSERT INTO domain_health AS h (
+                    api_server, domain, active_count, failed_count,
+                    expired_count, archived_count
+                )
+                SELECT * FROM (
+                    SELECT api_server, domain,
+                        coalesce(sum(sign) FILTER (WHERE status = 'active'), 0) AS a,
+                        coalesce(sum(sign) FILTER (
+                            WHERE status = 'active' AND maintenance_status = 'failed'
+                        ), 0) AS f,
+                        coalesce(sum(sign) FILTER (WHERE status = 'expired'), 0) AS e,
+                        coalesce(sum(sign) FILTER (WHERE status = 'archived'), 0) AS r
+                    FROM (%s) AS changed
+                    GROUP BY api_server, domain
+                ) AS delta
+                WHERE a <> 0 OR f <> 0 OR e <> 0 OR r <> 0
+                ORDER BY api_server, domain
+                ON CONFLICT (api_server, domain) DO UPDATE SET
+                    active_count = h.active_count + EXCLUDED.active_count,
+                    failed_count = h.failed_count + EXCLUDED.failed_count,
+                    expired_count = h.expired_count + EXCLUDED.expired_count,
+                    archived_count = h.archived_count + EXCLUDED.archived_count,
+                    updated_at = now()
+                $sql$,
+                source
+            );
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER subscriptions_health_insert
+        AFTER INSERT ON subscriptions
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION domain_health_apply_delta()
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER subscriptions_health_update
+        AFTER UPDATE ON subscriptions
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION domain_health_apply_delta()
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER subscriptions_health_delete
+        AFTER DELETE ON subscriptions
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION domain_health_apply_delta()
+        """
+    )
+
+    op.execute(
+        f"""
+        INSERT INTO domain_health (
+            api_server, domain, active_count, failed_count,
+            expired_count, archived_count, recounted_at
+        )
+        SELECT api_server, domain, {COUNT_COLUMNS}, now()
+        FROM subscriptions
+        GROUP BY api_server, domain
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for op_name in ("insert", "update", "delete"):
+        op.execute(
+            f"DROP TRIGGER IF EXISTS subscriptions_health_{op_name} ON subscriptions"
+        )
+    op.execute("DROP FUNCTION IF EXISTS domain_health_apply_delta()")
+    op.drop_table("domain_health")
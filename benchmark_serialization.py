@@ -0,0 +1,137 @@
+import logging
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from models import NSUser, Subscription
+from schemas import SubscriptionResponse
+from serialization import FastJSONResponse, list_adapter, subscription_dict
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger("benchmark-serialization")
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+ROW_COUNTS = (1_000, 10_000)
+ROUNDS = 7
+
+
+def make_subscriptions(count: int) -> List[Subscription]:
+    # Transient ORM rows shaped like a busy domain; no database needed
+    now = datetime.now(timezone.utc)
+    return [
+        Subscription(
+            id=i,
+            api_server="https://api.example.com",
+            domain="bench.example.com",
+            user=str(100 + i % 500),
+            subscription_model="call",
+            post_url=f"https://hooks.example.com/ns/{i}",
+            description="Benchmark subscription",
+            status="active",
+            expires_at=now,
+            created_at=now,
+            updated_at=now,
+            pbx_subscription_id=f"sub-{i}",
+            pbx_expires_at=now,
+            maintenance_status="ok",
+            last_maintenance_attempt=now,
+        )
+        for i in range(count)
+    ]
+
+
+def make_users(count: int) -> List[dict]:
+    # Raw PBX payload, as the client receives it
+    return [
+        {
+            "user": str(100 + i),
+            "domain": "bench.example.com",
+            "name-first-name": f"First{i}",
+            "name-last-name": f"Last{i}",
+            "email-address": f"user{i}@example.com",
+        }
+        for i in range(count)
+    ]
+
+
+def build_app(subscriptions: List[Subscription], users: List[dict]) -> FastAPI:
+    app = FastAPI()
+
+    # Previous path: validate each row, then FastAPI validates the result
+    # against response_model again before encoding
+    @app.get("/subs/response-model", response_model=List[SubscriptionResponse])
+    async def subs_response_model():
+        return [SubscriptionResponse.model_validate(s) for s in subscriptions]
+
+    # One pre-built TypeAdapter call each way; still validates every row
+    @app.get("/subs/type-adapter", response_model=List[SubscriptionResponse])
+    async def subs_type_adapter():
+        adapter = list_adapter(SubscriptionResponse)
+        items = adapter.validate_python(subscriptions, from_attributes=True)
+        return FastJSONResponse(adapter.dump_json(items))
+
+    # Path used by /subscriptions/list: rows to dicts, no validation
+    @app.get("/subs/fast", response_model=List[SubscriptionResponse])
+    async def subs_fast():
+        return FastJSONResponse([subscription_dict(s) for s in subscriptions])
+
+    @app.get("/users/response-model", response_model=List[NSUser])
+    async def users_response_model():
+        return [NSUser.model_validate(u) for u in users]
+
+    # Path used by /users/search
+    @app.get("/users/type-adapter", response_model=List[NSUser])
+    async def users_type_adapter():
+        adapter = list_adapter(NSUser)
+        return FastJSONResponse(
+            adapter.dump_json(adapter.validate_python(users), by_alias=True)
+        )
+
+    return app
+
+
+def measure(request: Callable[[], bytes]) -> Dict[str, float]:
+    request()  # warm-up
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        request()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median": statistics.median(timings), "best": min(timings)}
+
+
+def main():
+    for count in ROW_COUNTS:
+        app = build_app(make_subscriptions(count), make_users(count))
+        with TestClient(app) as client:
+            bodies = {}
+            logger.info(f"\n{count} rows ({ROUNDS} rounds, ms)")
+            for route in (
+                "/subs/response-model",
+                "/subs/type-adapter",
+                "/subs/fast",
+                "/users/response-model",
+                "/users/type-adapter",
+            ):
+
+                def request() -> bytes:
+                    response = client.get(route)
+                    response.raise_for_status()
+                    return response.content
+
+                result = measure(request)
+                bodies[route] = request()
+                logger.info(
+                    f"  {route:24} median {result['median']:8.1f}  best {result['best']:8.1f}"
+                )
+
+            # Every path must put the same bytes on the wire
+            assert len({bodies[r] for r in bodies if r.startswith("/subs")}) == 1
+            assert len({bodies[r] for r in bodies if r.startswith("/users")}) == 1
+
+
+if __name__ == "__main__":
+    main()
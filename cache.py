@@ -0,0 +1,139 @@
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar
+from sqlalchemy import event
+from sqlalchemy.orm import Session, ORMExecuteState
+from models import Subscription, OAuthCredential
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+DomainKey = Tuple[str, str]
+
+# Entries are only trusted while the LISTEN/NOTIFY listener is connected;
+# without it another process could change a domain unnoticed
+notifications_live = False
+
+
+def set_notifications_live(live: bool) -> None:
+    global notifications_live
+    if live != notifications_live:
+        # Anything cached while deaf may be stale, and vice versa
+        invalidate_all()
+    notifications_live = live
+
+
+class DomainCache:
+    # Long-TTL cache whose entries belong to one (api_server, domain)
+    def __init__(self, name: str):
+        self.name = name
+        self._entries: Dict[Tuple[Any, ...], Tuple[float, Any]] = {}
+        # Bumped on every invalidation so a load that raced one is not stored
+        self._generation = 0
+        _caches.append(self)
+
+    async def get(
+        self,
+        api_server: str,
+        domain: str,
+        loader: Callable[[], Awaitable[T]],
+        *extra: Any,
+    ) -> T:
+        if not notifications_live:
+            return await loader()
+
+        key = (api_server, domain, *extra)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry and entry[0] > now:
+            return entry[1]
+
+        generation = self._generation
+        value = await loader()
+        if generation == self._generation and notifications_live:
+            self._entries[key] = (now + settings.DOMAIN_CACHE_TTL_SECONDS, value)
+        return value
+
+    def invalidate(self, api_server: str, domain: str) -> None:
+        self._generation += 1
+        for key in [k for k in self._entries if k[0] == api_server and k[1] == domain]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+
+
+_caches: List[DomainCache] = []
+
+
+def invalidate_domain(api_server: str, domain: str) -> None:
+    for c in _caches:
+        c.invalidate(api_server, domain)
+
+
+def invalidate_all() -> None:
+    for c in _caches:
+        c.clear()
+
+
+# --- Read-your-writes within this process ---
+# NOTIFY arrives asynchronously after commit; a client following up on its
+# own write could otherwise hit the old entry first.
+
+ALL_DOMAINS = ("*", "*")
+TRACKED = (Subscription, OAuthCredential)
+
+
+def _touched(session: Session) -> Set[DomainKey]:
+    return session.info.setdefault("cache_touched_domains", set())
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session: Session, flush_context: Any) -> None:
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, TRACKED):
+            _touched(session).add((obj.api_server, obj.domain))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statement(state: ORMExecuteState) -> None:
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+    mapper = state.bind_mapper
+    if mapper is None or not issubclass(mapper.class_, TRACKED):
+        return
+
+    params = state.parameters
+    rows = params if isinstance(params, list) else [params] if params else []
+    keys: Optional[Set[DomainKey]] = set()
+    for row in rows:
+        if "api_server" in row and "domain" in row:
+            keys.add((row["api_server"], row["domain"]))
+        else:
+            keys = None
+            break
+    # Statements without per-row domain values (UPDATE ... WHERE id = ...)
+    touched = _touched(state.session)
+    if keys:
+        touched.update(keys)
+    else:
+        touched.add(ALL_DOMAINS)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session: Session) -> None:
+    touched = session.info.pop("cache_touched_domains", None)
+    if not touched:
+        return
+    if ALL_DOMAINS in touched:
+        invalidate_all()
+        return
+    for api_server, domain in touched:
+        invalidate_domain(api_server, domain)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back(session: Session) -> None:
+    session.info.pop("cache_touched_domains", None)
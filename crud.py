@@ -1,9 +1,19 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import List, Optional
-from datetime import datetime
-from models import Subscription, AuditLog, OAuthCredential
+from sqlalchemy import BigInteger, Text, select, insert, func, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+from datetime import datetime, timedelta, timezone
+from models import (
+    Subscription,
+    AuditLog,
+    OAuthCredential,
+    DomainHealth,
+    MaintenanceCheckpoint,
+)
 from schemas import SubscriptionCreate, SubscriptionUpdate
+from security import encrypt_string
+from config import settings
+from renewal_policy import subscription_lifetime_seconds
 
 
 async def create_audit_log(
@@ -17,7 +27,7 @@ async def create_audit_log(
     description: Optional[str] = None,
     details: Optional[str] = None,
 ) -> AuditLog:
-    # Create audit log entry
+    # Stage audit log entry; committed with the caller's unit of work
     log = AuditLog(
         api_server=api_server,
         domain=domain,
@@ -29,59 +39,116 @@ async def create_audit_log(
         details=details,
     )
     db.add(log)
-    await db.commit()
     return log
 
 
-async def create_subscription(
-    db: AsyncSession, sub_in: SubscriptionCreate, api_server: str, domain: str
-) -> Subscription:
-    # Create or update subscription record
-    from config import settings
-    from datetime import timedelta
+async def create_audit_logs(db: AsyncSession, entries: List[Dict[str, Any]]) -> None:
+    # Stage many audit log entries as one multi-row INSERT
+    if entries:
+        await db.execute(insert(AuditLog), entries)
 
-    stmt = select(Subscription).where(
-        Subscription.api_server == api_server,
-        Subscription.domain == domain,
-        Subscription.user == sub_in.user,
-        Subscription.subscription_model == sub_in.subscription_model,
-        Subscription.post_url == sub_in.post_url,
+
+SubscriptionKey = Tuple[str, str, str, str, str]
+
+
+def subscription_key(row: Union[Subscription, Dict[str, Any]]) -> SubscriptionKey:
+    # Natural key matching _subscription_uc
+    get = row.get if isinstance(row, dict) else lambda k: getattr(row, k)
+    return (
+        get("api_server"),
+        get("domain"),
+        get("user"),
+        get("subscription_model"),
+        get("post_url"),
     )
-    result = await db.execute(stmt)
-    existing_sub = result.scalar_one_or_none()
 
-    expires_at = sub_in.expires_at
+
+def subscription_values(
+    sub_in: SubscriptionCreate,
+    api_server: str,
+    domain: str,
+    pbx_subscription_id: Optional[str] = None,
+    pbx_expires_at: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    # Column values for a new or re-activated subscription row. The expiry
+    # sent to the PBX is the one stored, so both sides agree
+    expires_at = sub_in.expires_at or pbx_expires_at
     if expires_at is None:
-        expires_at = datetime.now() + timedelta(
-            days=settings.SUBSCRIPTION_DURATION_DAYS
+        expires_at = datetime.now(timezone.utc) + timedelta(
+            seconds=subscription_lifetime_seconds()
         )
 
-    if existing_sub:
-        existing_sub.description = sub_in.description
-        existing_sub.expires_at = expires_at
-        existing_sub.status = "active"
-        existing_sub.updated_at = datetime.now()
-        existing_sub.maintenance_status = "pending"
-        existing_sub.maintenance_message = None
+    return {
+        "api_server": api_server,
+        "domain": domain,
+        "user": sub_in.user,
+        "subscription_model": sub_in.subscription_model,
+        "post_url": sub_in.post_url,
+        "description": sub_in.description,
+        "expires_at": expires_at,
+        "status": "active",
+        "maintenance_status": "pending",
+        "attempt_count": 0,
+        "next_attempt_at": None,
+        "pbx_subscription_id": pbx_subscription_id,
+        "pbx_expires_at": pbx_expires_at,
+    }
 
-        await db.commit()
-        await db.refresh(existing_sub)
-        return existing_sub
 
-    db_sub = Subscription(
-        api_server=api_server,
-        domain=domain,
-        user=sub_in.user,
-        subscription_model=sub_in.subscription_model,
-        post_url=sub_in.post_url,
-        description=sub_in.description,
-        expires_at=expires_at,
-        status="active",
+async def upsert_subscriptions(
+    db: AsyncSession, rows: List[Dict[str, Any]]
+) -> Dict[SubscriptionKey, Subscription]:
+    # Create or update many subscription records in one INSERT ... ON CONFLICT
+    if not rows:
+        return {}
+
+    # ON CONFLICT cannot touch the same row twice in one statement; last wins
+    unique_rows = {subscription_key(r): r for r in rows}
+
+    stmt = pg_insert(Subscription)
+    table = Subscription.__table__
+    stmt = stmt.on_conflict_do_update(
+        constraint="_subscription_uc",
+        set_={
+            "description": stmt.excluded.description,
+            "expires_at": stmt.excluded.expires_at,
+            "pbx_subscription_id": func.coalesce(
+                stmt.excluded.pbx_subscription_id, table.c.pbx_subscription_id
+            ),
+            "pbx_expires_at": func.coalesce(
+                stmt.excluded.pbx_expires_at, table.c.pbx_expires_at
+            ),
+            "status": "active",
+            "updated_at": func.now(),
+            "maintenance_status": "pending",
+            "maintenance_message": None,
+            "attempt_count": 0,
+            "next_attempt_at": None,
+        },
+    ).returning(Subscription)
+
+    result = await db.execute(
+        stmt,
+        list(unique_rows.values()),
+        execution_options={"populate_existing": True},
     )
-    db.add(db_sub)
-    await db.commit()
-    await db.refresh(db_sub)
-    return db_sub
+    return {subscription_key(s): s for s in result.scalars().all()}
+
+
+async def create_subscription(
+    db: AsyncSession,
+    sub_in: SubscriptionCreate,
+    api_server: str,
+    domain: str,
+    pbx_subscription_id: Optional[str] = None,
+    pbx_expires_at: Optional[datetime] = None,
+) -> Subscription:
+    # Create or update subscription record in a single INSERT ... ON CONFLICT
+    row = subscription_values(
+        sub_in, api_server, domain, pbx_subscription_id, pbx_expires_at
+    )
+    upserted = await upsert_subscriptions(db, [row])
+    return upserted[subscription_key(row)]
 
 
 async def get_subscriptions(
@@ -101,6 +168,241 @@ async def get_subscriptions(
     return list(result.scalars().all())
 
 
+async def get_subscriptions_page(
+    db: AsyncSession,
+    api_server: str,
+    domain: str,
+    sort_column: Any,
+    descending: bool,
+    after: Optional[Tuple[Any, ...]],
+    limit: int,
+    user: Optional[str] = None,
+    subscription_model: Optional[str] = None,
+    maintenance_status: Optional[str] = None,
+) -> List[Subscription]:
+    # Keyset page of active subscriptions ordered by (sort_column, id); `after`
+    # is the last row's key from the previous page
+    keys = [sort_column]
+    if sort_column is not Subscription.id:
+        keys.append(Subscription.id)
+    query = select(Subscription).where(
+        Subscription.api_server == api_server,
+        Subscription.domain == domain,
+        Subscription.status != "archived",
+    )
+    if user:
+        query = query.where(Subscription.user == user)
+    if subscription_model:
+        query = query.where(Subscription.subscription_model == subscription_model)
+    if maintenance_status:
+        query = query.where(Subscription.maintenance_status == maintenance_status)
+    if after is not None:
+        position = tuple_(*keys)
+        query = query.where(position < after if descending else position > after)
+
+    query = query.order_by(*(k.desc() if descending else k for k in keys)).limit(limit)
+    result = await db.execute(query)
+    return list(result.scalars().all())
+
+
+async def get_subscriptions_by_keys(
+    db: AsyncSession, api_server: str, domain: str, keys: List[SubscriptionKey]
+) -> Dict[SubscriptionKey, Subscription]:
+    # Active subscriptions matching the given natural keys
+    if not keys:
+        return {}
+    query = select(Subscription).where(
+        Subscription.api_server == api_server,
+        Subscription.domain == domain,
+        Subscription.status != "archived",
+        tuple_(
+            Subscription.api_server,
+            Subscription.domain,
+            Subscription.user,
+            Subscription.subscription_model,
+            Subscription.post_url,
+        ).in_(keys),
+    )
+    result = await db.execute(query)
+    return {subscription_key(s): s for s in result.scalars().all()}
+
+
+async def get_subscription_keys(
+    db: AsyncSession, api_server: str, domain: str
+) -> Set[SubscriptionKey]:
+    # Natural keys of active subscriptions, without loading ORM rows
+    query = select(
+        Subscription.api_server,
+        Subscription.domain,
+        Subscription.user,
+        Subscription.subscription_model,
+        Subscription.post_url,
+    ).where(
+        Subscription.api_server == api_server,
+        Subscription.domain == domain,
+        Subscription.status != "archived",
+    )
+    result = await db.execute(query)
+    return {tuple(row) for row in result.all()}
+
+
+async def get_domain_version(db: AsyncSession, api_server: str, domain: str) -> int:
+    # Stamped by the domain_health trigger on every write to the domain. Unlike
+    # max(change_version), which is drawn before commit, it changes with every
+    # commit, so a late commit cannot leave a validator unchanged.
+    query = select(DomainHealth.version).where(
+        DomainHealth.api_server == api_server,
+        DomainHealth.domain == domain,
+    )
+    result = await db.execute(query)
+    return result.scalar_one_or_none() or 0
+
+
+async def get_domain_health_summary(
+    db: AsyncSession, api_server: str, domain: str
+) -> Optional[DomainHealth]:
+    # Maintained summary row; absent for domains that never had a subscription
+    return await db.get(DomainHealth, (api_server, domain))
+
+
+# Counts the subscription triggers keep current; expiring_soon_count is
+# time-dependent and only changes on a recount
+TRACKED_HEALTH_COUNTS = (
+    "active_count",
+    "failed_count",
+    "expired_count",
+    "archived_count",
+)
+
+
+async def get_recount_domains(db: AsyncSession) -> List[Tuple[str, str]]:
+    # Every domain with subscriptions or a domain_health row, least recently
+    # recounted first, so a recount cut short picks up there next time
+    domains = (
+        select(Subscription.api_server, Subscription.domain)
+        .union(select(DomainHealth.api_server, DomainHealth.domain))
+        .subquery()
+    )
+    result = await db.execute(
+        select(domains.c.api_server, domains.c.domain)
+        .outerjoin(
+            DomainHealth,
+            (DomainHealth.api_server == domains.c.api_server)
+            & (DomainHealth.domain == domains.c.domain),
+        )
+        .order_by(
+            DomainHealth.recounted_at.asc().nulls_first(),
+            domains.c.api_server,
+            domains.c.domain,
+        )
+    )
+    return [(api_server, domain) for api_server, domain in result.all()]
+
+
+async def recount_one_domain_health(
+    db: AsyncSession, api_server: str, domain: str
+) -> bool:
+    # Recount one domain under its summary row lock; True if it had drifted.
+    # Commits.
+    #
+    # Every write that moves a count updates this row from its trigger, so
+    # the lock waits for in-flight writers that already applied a delta and
+    # holds new ones at their trigger until we commit; no delta can land
+    # between the count and the overwrite. Writes to other domains go on.
+    await db.execute(
+        pg_insert(DomainHealth)
+        .values(api_server=api_server, domain=domain)
+        .on_conflict_do_nothing()
+    )
+    stored = await db.scalar(
+        select(DomainHealth)
+        .where(DomainHealth.api_server == api_server, DomainHealth.domain == domain)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+
+    expiring_before = datetime.now(timezone.utc) + timedelta(
+        hours=settings.SUBSCRIPTION_RENEWAL_WINDOW_HOURS
+    )
+    active = Subscription.status == "active"
+    result = await db.execute(
+        select(
+            func.count().filter(active).label("active_count"),
+            func.count()
+            .filter(active, Subscription.maintenance_status == "failed")
+            .label("failed_count"),
+            func.count()
+            .filter(Subscription.status == "expired")
+            .label("expired_count"),
+            func.count()
+            .filter(Subscription.status == "archived")
+            .label("archived_count"),
+            func.count()
+            .filter(
+                active,
+                func.coalesce(Subscription.pbx_expires_at, Subscription.expires_at)
+                < expiring_before,
+            )
+            .label("expiring_soon_count"),
+            func.count().label("total"),
+        ).where(Subscription.api_server == api_server, Subscription.domain == domain)
+    )
+    fresh = result.one()._asdict()
+
+    drifted = any(getattr(stored, c) != fresh[c] for c in TRACKED_HEALTH_COUNTS)
+    if not fresh.pop("total"):
+        # Domain whose subscriptions were all deleted
+        await db.delete(stored)
+    else:
+        for column, value in fresh.items():
+            setattr(stored, column, value)
+        stored.recounted_at = func.now()
+        if drifted:
+            # Corrected counts change what /status returns; move the validator
+            stored.version = func.nextval("subscriptions_change_seq")
+    await db.commit()
+    return drifted
+
+
+async def get_subscription_changes(
+    db: AsyncSession, api_server: str, domain: str, since: int, limit: int
+) -> List[Subscription]:
+    # Rows changed after cursor `since`, archived ones included as tombstones.
+    # Versions are drawn before commit, so rows written by transactions older
+    # than the oldest still in flight are held back; otherwise a late commit
+    # with a lower version could slip behind a client's cursor.
+    visible_xmin = func.pg_snapshot_xmin(func.pg_current_snapshot())
+    query = (
+        select(Subscription)
+        .where(
+            Subscription.api_server == api_server,
+            Subscription.domain == domain,
+            Subscription.change_version > since,
+            Subscription.change_xid < visible_xmin.cast(Text).cast(BigInteger),
+        )
+        .order_by(Subscription.change_version)
+        .limit(limit)
+    )
+    result = await db.execute(query)
+    return list(result.scalars().all())
+
+
+async def get_subscriptions_by_ids(
+    db: AsyncSession, api_server: str, domain: str, subscription_ids: List[int]
+) -> Dict[int, Subscription]:
+    # Load many subscriptions of one domain in a single query
+    if not subscription_ids:
+        return {}
+
+    query = select(Subscription).where(
+        Subscription.api_server == api_server,
+        Subscription.domain == domain,
+        Subscription.id.in_(subscription_ids),
+    )
+    result = await db.execute(query)
+    return {s.id: s for s in result.scalars().all()}
+
+
 async def get_subscription_by_id(
     db: AsyncSession, subscription_id: int
 ) -> Optional[Subscription]:
@@ -120,12 +422,22 @@ async def update_subscription(
     if not sub:
         return None
 
+    return apply_subscription_update(sub, sub_update)
+
+
+def apply_subscription_update(
+    sub: Subscription, sub_update: SubscriptionUpdate
+) -> Subscription:
+    # Stage non-identity field changes on an already loaded row
     update_data = sub_update.model_dump(exclude_unset=True)
     for key, value in update_data.items():
         setattr(sub, key, value)
 
-    await db.commit()
-    await db.refresh(sub)
+    # An edit may fix what kept failing; let the next run retry right away
+    if update_data:
+        sub.attempt_count = 0
+        sub.next_attempt_at = None
+
     return sub
 
 
@@ -141,11 +453,35 @@ async def archive_subscription(
         return None
 
     sub.status = "archived"
-    await db.commit()
-    await db.refresh(sub)
     return sub
 
 
+async def get_credential_id(
+    db: AsyncSession, api_server: str, domain: str, user: str
+) -> Optional[int]:
+    # Id of the user's stored OAuth credential, without decrypting tokens
+    query = select(OAuthCredential.id).where(
+        OAuthCredential.api_server == api_server,
+        OAuthCredential.domain == domain,
+        OAuthCredential.user == user,
+    )
+    result = await db.execute(query)
+    return result.scalar_one_or_none()
+
+
+async def get_oauth_credential(
+    db: AsyncSession, api_server: str, domain: str, user: str
+) -> Optional[OAuthCredential]:
+    # The user's stored OAuth credential, if they ever completed the flow
+    query = select(OAuthCredential).where(
+        OAuthCredential.api_server == api_server,
+        OAuthCredential.domain == domain,
+        OAuthCredential.user == user,
+    )
+    result = await db.execute(query)
+    return result.scalar_one_or_none()
+
+
 async def upsert_oauth_credential(
     db: AsyncSession,
     api_server: str,
@@ -155,43 +491,52 @@ async def upsert_oauth_credential(
     access_token: Optional[str] = None,
     expires_in: Optional[int] = None,
 ) -> OAuthCredential:
-    # Create or update OAuth credential
-    stmt = select(OAuthCredential).where(
-        OAuthCredential.api_server == api_server,
-        OAuthCredential.domain == domain,
-        OAuthCredential.user == user,
-    )
-    result = await db.execute(stmt)
-    cred = result.scalar_one_or_none()
-
+    # Create or update OAuth credential in a single INSERT ... ON CONFLICT
     expires_at = None
     if expires_in:
         from datetime import timedelta
 
-        expires_at = datetime.now() + timedelta(seconds=expires_in)
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+
+    stmt = pg_insert(OAuthCredential).values(
+        api_server=api_server,
+        domain=domain,
+        user=user,
+        refresh_token=encrypt_string(refresh_token) if refresh_token else "",
+        access_token=encrypt_string(access_token) if access_token else "",
+        expires_at=expires_at,
+        last_refresh_at=func.now(),
+        maintenance_status="success",
+        attempt_count=0,
+        next_attempt_at=None,
+    )
+    table = OAuthCredential.__table__
+    stmt = stmt.on_conflict_do_update(
+        constraint="_credential_uc",
+        set_={
+            "refresh_token": stmt.excluded.refresh_token,
+            # Keep stored values when the token response omits them
+            "access_token": func.coalesce(
+                func.nullif(stmt.excluded.access_token, ""), table.c.access_token
+            ),
+            "expires_at": func.coalesce(stmt.excluded.expires_at, table.c.expires_at),
+            "last_refresh_at": func.now(),
+            "updated_at": func.now(),
+            "maintenance_status": "success",
+            "attempt_count": 0,
+            "next_attempt_at": None,
+        },
+    ).returning(OAuthCredential)
 
-    if cred:
-        cred.refresh_token = refresh_token
-        if access_token:
-            cred.access_token = access_token
-        if expires_at:
-            cred.expires_at = expires_at
+    result = await db.execute(stmt, execution_options={"populate_existing": True})
+    return result.scalar_one()
 
-        cred.maintenance_status = "success"
-        cred.last_refresh_at = datetime.now()
-    else:
-        cred = OAuthCredential(
-            api_server=api_server,
-            domain=domain,
-            user=user,
-            refresh_token=refresh_token,
-            access_token=access_token,
-            expires_at=expires_at,
-            last_refresh_at=datetime.now(),
-            maintenance_status="success",
-        )
-        db.add(cred)
 
-    await db.commit()
-    await db.refresh(cred)
-    return cred
+async def get_maintenance_checkpoint(
+    db: AsyncSession, name: str
+) -> MaintenanceCheckpoint:
+    # Created on first use; concurrent runs may both try
+    await db.execute(
+        pg_insert(MaintenanceCheckpoint).values(name=name).on_conflict_do_nothing()
+    )
+    return await db.get(MaintenanceCheckpoint, name)
@@ -3,6 +3,7 @@ from ns_client import NSClient
 from models import NSUser
 from config import settings
 from security import is_origin_allowed
+import identity_service
 import httpx
 import logging
 from typing import AsyncGenerator
@@ -47,8 +48,14 @@ async def get_ns_client(
 
 
 async def get_ns_user(client: NSClient = Depends(get_ns_client)) -> NSUser:
-    # Resolves and returns current NSUser
+    # Resolves and returns current NSUser, locally from a signed token when
+    # signing keys are configured, else (or if it can't be checked) via the PBX
     try:
+        if settings.IDENTITY_JWKS_URL:
+            try:
+                return await identity_service.verify_portal_token(client.token)
+            except identity_service.TokenUnverifiable as e:
+                logger.debug(f"Local identity check skipped: {e}")
         return await client.get_current_user()
     except HTTPException as e:
         logger.warning(f"Identity resolution failed: {e.detail}")
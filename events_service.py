@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+from fastapi import Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import async_session_factory
+from config import settings
+from cache import DomainCache
+import cache
+import crud
+
+logger = logging.getLogger(__name__)
+
+DomainKey = Tuple[str, str]
+
+
+domain_versions = DomainCache("domain_version")
+domain_health = DomainCache("domain_health")
+
+
+async def get_domain_version(db: AsyncSession, api_server: str, domain: str) -> int:
+    return await domain_versions.get(
+        api_server, domain, lambda: crud.get_domain_version(db, api_server, domain)
+    )
+
+
+async def get_domain_health(
+    db: AsyncSession, api_server: str, domain: str
+) -> Dict[str, Any]:
+    return await domain_health.get(
+        api_server, domain, lambda: read_domain_health(db, api_server, domain)
+    )
+
+
+async def read_domain_health(
+    db: AsyncSession, api_server: str, domain: str
+) -> Dict[str, Any]:
+    # Health for managed subscriptions (shared by /status and the stream),
+    # from the trigger-maintained domain_health row
+    summary = await crud.get_domain_health_summary(db, api_server, domain)
+    failed = summary.failed_count if summary else 0
+
+    if failed:
+        return {
+            "status": "unhealthy",
+            "count": failed,
+            "message": f"Maintenance is failing for {failed} subscriptions.",
+        }
+    return {"status": "healthy"}
+
+
+def format_event(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class HealthBroadcaster:
+    # One watcher per domain with listeners, fanned out to every connected tab
+    def __init__(self):
+        self._listeners: Dict[DomainKey, Set[asyncio.Queue]] = {}
+        self._watchers: Dict[DomainKey, asyncio.Task] = {}
+        self._last: Dict[DomainKey, Tuple[int, Dict[str, Any]]] = {}
+
+    def subscribe(self, api_server: str, domain: str) -> asyncio.Queue:
+        key = (api_server, domain)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=16)
+        self._listeners.setdefault(key, set()).add(queue)
+
+        if key in self._last:
+            queue.put_nowait(self._last[key])
+        if key not in self._watchers:
+            self._watchers[key] = asyncio.create_task(self._watch(key))
+        return queue
+
+    def unsubscribe(self, api_server: str, domain: str, queue: asyncio.Queue) -> None:
+        key = (api_server, domain)
+        listeners = self._listeners.get(key)
+        if listeners is None:
+            return
+        listeners.discard(queue)
+        if not listeners:
+            del self._listeners[key]
+            self._last.pop(key, None)
+            watcher = self._watchers.pop(key, None)
+            if watcher:
+                watcher.cancel()
+
+    async def close(self) -> None:
+        # Ends every open stream so shutdown is not held up by idle tabs
+        for watcher in self._watchers.values():
+            watcher.cancel()
+        for listeners in self._listeners.values():
+            for queue in listeners:
+                self._offer(queue, None)
+        self._watchers.clear()
+        self._listeners.clear()
+        self._last.clear()
+
+    async def refresh(self, api_server: str, domain: str) -> None:
+        # Re-read the domain and push if its health changed
+        key = (api_server, domain)
+        if key not in self._listeners:
+            return
+
+        async with async_session_factory() as db:
+            version = await get_domain_version(db, api_server, domain)
+            last = self._last.get(key)
+            if last and last[0] == version:
+                return
+            health = await get_domain_health(db, api_server, domain)
+
+        self._last[key] = (version, health)
+        if last and last[1] == health:
+            return
+        for queue in self._listeners.get(key, ()):
+            self._offer(queue, (version, health))
+
+    async def _watch(self, key: DomainKey) -> None:
+        # The version probe is one index-only MAX; health is recounted only on
+        # change. With NOTIFY connected, refreshes are pushed and this is a backstop
+        while True:
+            try:
+                await self.refresh(*key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Health watcher for {key[1]} failed: {e}")
+            await asyncio.sleep(
+                settings.SSE_NOTIFY_BACKSTOP_SECONDS
+                if cache.notifications_live
+                else settings.SSE_POLL_INTERVAL_SECONDS
+            )
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, item: Any) -> None:
+        # A tab that stops reading only loses stale states, never blocks others
+        if queue.full():
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        queue.put_nowait(item)
+
+
+broadcaster = HealthBroadcaster()
+
+
+async def health_stream(
+    request: Request, api_server: str, domain: str
+) -> AsyncIterator[str]:
+    # SSE body: current health first, then every change, with keepalive comments
+    queue = broadcaster.subscribe(api_server, domain)
+    try:
+        yield f"retry: {settings.SSE_RETRY_MILLISECONDS}\n\n"
+        while True:
+            try:
+                item = await asyncio.wait_for(
+                    queue.get(), timeout=settings.SSE_KEEPALIVE_SECONDS
+                )
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keepalive\n\n"
+                continue
+
+            if item is None:
+                break
+            version, health = item
+            yield format_event("health", health, event_id=version)
+    finally:
+        broadcaster.unsubscribe(api_server, domain, queue)
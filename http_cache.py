@@ -0,0 +1,39 @@
+import hashlib
+from typing import Any
+from fastapi import Request, Response
+
+# Per-user API responses: the browser may store them but must revalidate
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def weak_etag(*parts: Any) -> str:
+    # Weak validator from whatever version inputs the representation depends on
+    digest = hashlib.sha1(":".join(str(p) for p in parts).encode()).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    # If-None-Match uses weak comparison: W/ prefixes are ignored on both sides
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    opaque = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == opaque for tag in header.split(",")
+    )
+
+
+def set_validators(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+    # Representations are per caller, so shared caches must key on the token
+    response.headers["Vary"] = "Authorization"
+
+
+def not_modified(etag: str) -> Response:
+    response = Response(status_code=304)
+    set_validators(response, etag)
+    return response
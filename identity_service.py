@@ -0,0 +1,218 @@
+import asyncio
+import base64
+import json
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+import httpx
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+from fastapi import HTTPException
+from pydantic import ValidationError
+from config import settings
+from models import NSUser
+
+logger = logging.getLogger(__name__)
+
+# Asymmetric algorithms only: the PBX publishes public keys, and a shared
+# secret in a key set would let anyone holding it mint identities
+RSA_ALGORITHMS = {
+    "RS256": hashes.SHA256,
+    "RS384": hashes.SHA384,
+    "RS512": hashes.SHA512,
+}
+EC_ALGORITHMS = {
+    "ES256": (hashes.SHA256, ec.SECP256R1),
+    "ES384": (hashes.SHA384, ec.SECP384R1),
+}
+EC_CURVES = {"P-256": ec.SECP256R1, "P-384": ec.SECP384R1}
+
+# A token naming an unknown key id triggers a refetch at most this often,
+# so garbage tokens cannot hammer the key source
+KEY_REFETCH_MIN_SECONDS = 60
+
+
+class TokenUnverifiable(Exception):
+    # Not a token we can check locally; resolve identity through the PBX instead
+    pass
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _b64int(segment: str) -> int:
+    return int.from_bytes(_b64decode(segment), "big")
+
+
+def load_jwk(jwk: Dict[str, Any]) -> Optional[Any]:
+    # Public key object for an RSA or EC JWK, None for anything else
+    try:
+        if jwk.get("kty") == "RSA":
+            return rsa.RSAPublicNumbers(
+                _b64int(jwk["e"]), _b64int(jwk["n"])
+            ).public_key()
+        if jwk.get("kty") == "EC" and jwk.get("crv") in EC_CURVES:
+            return ec.EllipticCurvePublicNumbers(
+                _b64int(jwk["x"]), _b64int(jwk["y"]), EC_CURVES[jwk["crv"]]()
+            ).public_key()
+    except (KeyError, TypeError, ValueError) as e:
+        logger.warning(f"Skipping unreadable signing key {jwk.get('kid')}: {e}")
+    return None
+
+
+class SigningKeys:
+    # The PBX's published signing keys, refetched every refresh interval and
+    # early when a token names a key we have not seen (rotation)
+    def __init__(self):
+        self._keys: Dict[Optional[str], Any] = {}
+        self._fetched_at: Optional[float] = None
+        self._attempted_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    async def get(self, kid: Optional[str]) -> Optional[Any]:
+        if self._needs_refresh(kid):
+            async with self._lock:
+                # Another request may have refreshed while we waited
+                if self._needs_refresh(kid):
+                    await self.refresh()
+
+        if kid is None and len(self._keys) == 1:
+            return next(iter(self._keys.values()))
+        return self._keys.get(kid)
+
+    def _needs_refresh(self, kid: Optional[str]) -> bool:
+        now = time.monotonic()
+        if (
+            self._attempted_at is not None
+            and now - self._attempted_at < KEY_REFETCH_MIN_SECONDS
+        ):
+            return False
+        if self._fetched_at is None:
+            return True
+        if now - self._fetched_at >= settings.IDENTITY_JWKS_REFRESH_SECONDS:
+            return True
+        return kid is not None and kid not in self._keys
+
+    async def refresh(self) -> None:
+        # Keeps the previous keys if the source is unreachable
+        self._attempted_at = time.monotonic()
+        try:
+            jwks = await self._fetch()
+            keys = {}
+            for jwk in jwks.get("keys", []):
+                if jwk.get("use", "sig") != "sig":
+                    continue
+                key = load_jwk(jwk)
+                if key is not None:
+                    keys[jwk.get("kid")] = key
+        except Exception as e:
+            logger.warning(f"Failed to fetch identity signing keys: {e}")
+            return
+
+        self._keys = keys
+        self._fetched_at = self._attempted_at
+        logger.info(f"Loaded {len(keys)} identity signing keys")
+
+    async def _fetch(self) -> Dict[str, Any]:
+        # Keys decide who a caller is, so TLS is always verified here
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            response = await client.get(settings.IDENTITY_JWKS_URL)
+            response.raise_for_status()
+            return response.json()
+
+
+signing_keys = SigningKeys()
+
+
+def _verify_signature(
+    key: Any, alg: str, signing_input: bytes, signature: bytes
+) -> None:
+    if alg in RSA_ALGORITHMS and isinstance(key, rsa.RSAPublicKey):
+        key.verify(signature, signing_input, padding.PKCS1v15(), RSA_ALGORITHMS[alg]())
+        return
+    if alg in EC_ALGORITHMS and isinstance(key, ec.EllipticCurvePublicKey):
+        hash_type, curve = EC_ALGORITHMS[alg]
+        if not isinstance(key.curve, curve):
+            raise InvalidSignature()
+        # JWS carries raw r || s; cryptography expects DER
+        size = (key.curve.key_size + 7) // 8
+        if len(signature) != 2 * size:
+            raise InvalidSignature()
+        der = encode_dss_signature(
+            int.from_bytes(signature[:size], "big"),
+            int.from_bytes(signature[size:], "big"),
+        )
+        key.verify(der, signing_input, ec.ECDSA(hash_type()))
+        return
+    # The key's type does not match the algorithm the token claims
+    raise InvalidSignature()
+
+
+def _parse(token: str) -> Tuple[Dict[str, Any], Dict[str, Any], bytes, bytes]:
+    parts = token.split(".")
+    if len(parts) != 3:
+        raise TokenUnverifiable("not a JWT")
+    try:
+        header = json.loads(_b64decode(parts[0]))
+        claims = json.loads(_b64decode(parts[1]))
+        signature = _b64decode(parts[2])
+    except ValueError:
+        raise TokenUnverifiable("malformed JWT")
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise TokenUnverifiable("malformed JWT")
+    return header, claims, f"{parts[0]}.{parts[1]}".encode(), signature
+
+
+async def verify_portal_token(token: str) -> NSUser:
+    # Identity from a signed portal token without calling the PBX. Raises
+    # TokenUnverifiable when the token cannot be checked locally, and 401 when
+    # it can and fails.
+    header, claims, signing_input, signature = _parse(token)
+
+    alg = header.get("alg")
+    if alg not in RSA_ALGORITHMS and alg not in EC_ALGORITHMS:
+        raise TokenUnverifiable(f"unsupported algorithm {alg!r}")
+    kid = header.get("kid")
+    # The header is caller-supplied; anything but a string would break the
+    # key lookups below
+    if kid is not None and not isinstance(kid, str):
+        raise TokenUnverifiable("malformed kid")
+    key = await signing_keys.get(kid)
+    if key is None:
+        raise TokenUnverifiable(f"no signing key for kid {kid!r}")
+
+    try:
+        _verify_signature(key, alg, signing_input, signature)
+    except InvalidSignature:
+        raise HTTPException(status_code=401, detail="Invalid token signature")
+
+    now = time.time()
+    leeway = settings.IDENTITY_JWT_LEEWAY_SECONDS
+    exp = claims.get("exp")
+    if not isinstance(exp, (int, float)):
+        raise TokenUnverifiable("token has no expiry")
+    if exp + leeway < now:
+        raise HTTPException(status_code=401, detail="Token expired")
+    nbf = claims.get("nbf")
+    if isinstance(nbf, (int, float)) and nbf - leeway > now:
+        raise HTTPException(status_code=401, detail="Token not yet valid")
+    if (
+        settings.IDENTITY_JWT_ISSUER
+        and claims.get("iss") != settings.IDENTITY_JWT_ISSUER
+    ):
+        raise HTTPException(status_code=401, detail="Token issuer not accepted")
+
+    user = claims.get(settings.IDENTITY_JWT_USER_CLAIM)
+    domain = claims.get(settings.IDENTITY_JWT_DOMAIN_CLAIM)
+    if user in (None, "") or domain in (None, ""):
+        raise TokenUnverifiable("token carries no user/domain claims")
+    try:
+        # Profile claims (names, email) are picked up when the token has them
+        return NSUser.model_validate(
+            {**claims, "user": str(user), "domain": str(domain)}
+        )
+    except ValidationError as e:
+        raise TokenUnverifiable(f"unusable identity claims: {e}")
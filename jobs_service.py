@@ -0,0 +1,333 @@
+import asyncio
+import logging
+import httpx
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, or_, and_, func
+from models import Job
+from ns_client import NSClient
+from database import async_session_factory
+from maintenance_service import credential_client
+from config import settings
+import crud
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    # Everything a handler needs: its own session, a PBX client and progress reporting
+    def __init__(self, job: Job, db: AsyncSession, client: NSClient):
+        self.job_id = job.id
+        self.api_server = job.api_server
+        self.domain = job.domain
+        self.user = job.user
+        self.params: Dict[str, Any] = job.params or {}
+        self.db = db
+        self.client = client
+
+    async def progress(self, current: int, total: Optional[int] = None) -> None:
+        # Persist counters and pick up cancellation in one round trip
+        values: Dict[str, Any] = {
+            "progress_current": current,
+            "heartbeat_at": func.now(),
+        }
+        if total is not None:
+            values["progress_total"] = total
+        async with async_session_factory() as session:
+            result = await session.execute(
+                update(Job)
+                .where(Job.id == self.job_id)
+                .values(**values)
+                .returning(Job.cancel_requested)
+            )
+            cancel_requested = result.scalar_one()
+            await session.commit()
+        if cancel_requested:
+            raise JobCancelled()
+
+
+JobHandler = Callable[[JobContext], Awaitable[Optional[Dict[str, Any]]]]
+JOB_HANDLERS: Dict[str, JobHandler] = {}
+
+
+def job_handler(kind: str) -> Callable[[JobHandler], JobHandler]:
+    # Register a coroutine as the handler for a job kind
+    def register(func: JobHandler) -> JobHandler:
+        JOB_HANDLERS[kind] = func
+        return func
+
+    return register
+
+
+async def enqueue_job(
+    db: AsyncSession,
+    kind: str,
+    api_server: str,
+    domain: str,
+    user: Optional[str],
+    token: str,
+    params: Optional[Dict[str, Any]] = None,
+) -> Job:
+    # Persist a queued job; the executor picks it up from the table. The
+    # caller's token is kept only as a fallback for job_client.
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    job = Job(
+        api_server=api_server,
+        domain=domain,
+        user=user,
+        kind=kind,
+        params=params or {},
+    )
+    job.token = token
+    db.add(job)
+    await db.commit()
+
+    executor.wake()
+    return job
+
+
+async def get_job(
+    db: AsyncSession, api_server: str, domain: str, job_id: int
+) -> Optional[Job]:
+    stmt = select(Job).where(
+        Job.id == job_id, Job.api_server == api_server, Job.domain == domain
+    )
+    result = await db.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def get_jobs(
+    db: AsyncSession, api_server: str, domain: str, limit: int = 50
+) -> List[Job]:
+    stmt = (
+        select(Job)
+        .where(Job.api_server == api_server, Job.domain == domain)
+        .order_by(Job.id.desc())
+        .limit(limit)
+    )
+    result = await db.execute(stmt)
+    return list(result.scalars().all())
+
+
+async def cancel_job(db: AsyncSession, job: Job) -> Job:
+    # Queued jobs are cancelled outright; running ones stop at their next checkpoint
+    if job.status in FINISHED_STATUSES:
+        return job
+
+    # Conditional UPDATEs so a job claimed meanwhile is not marked cancelled twice
+    await db.execute(
+        update(Job)
+        .where(Job.id == job.id, Job.status == "queued")
+        .values(status="cancelled", finished_at=func.now(), _token=None)
+    )
+    await db.execute(
+        update(Job).where(Job.id == job.id).values(cancel_requested=True)
+    )
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+async def claim_next_job() -> Optional[Job]:
+    # Take the oldest runnable job; SKIP LOCKED keeps concurrent executors apart
+    stale_before = datetime.now(timezone.utc) - timedelta(
+        seconds=settings.JOB_STALE_AFTER_SECONDS
+    )
+    next_id = (
+        select(Job.id)
+        .where(
+            or_(
+                Job.status == "queued",
+                and_(Job.status == "running", Job.heartbeat_at < stale_before),
+            )
+        )
+        .order_by(Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(Job)
+        .where(Job.id == next_id)
+        .values(
+            status="running",
+            started_at=func.coalesce(Job.started_at, func.now()),
+            heartbeat_at=func.now(),
+            attempts=Job.attempts + 1,
+        )
+        .returning(Job)
+    )
+    async with async_session_factory() as db:
+        result = await db.execute(stmt, execution_options={"populate_existing": True})
+        job = result.scalar_one_or_none()
+        await db.commit()
+    return job
+
+
+async def job_client(
+    db: AsyncSession, job: Job, http_client: httpx.AsyncClient
+) -> NSClient:
+    # Jobs can outlive the caller's portal token, so they run under the
+    # user's stored OAuth credential, which refreshes itself on 401. The token
+    # captured at enqueue time is only used for users without one.
+    cred = None
+    if job.user:
+        cred = await crud.get_oauth_credential(
+            db, job.api_server, job.domain, job.user
+        )
+    if (
+        cred is not None
+        and cred.access_token
+        and cred.maintenance_status != "failed_permanent"
+    ):
+        return credential_client(cred, http_client)
+    if not job.token:
+        raise RuntimeError("No PBX credential available to run this job")
+    return NSClient(job.token, client=http_client)
+
+
+async def finish_job(
+    job_id: int,
+    status: str,
+    result: Optional[Dict[str, Any]] = None,
+    message: Optional[str] = None,
+) -> None:
+    # Record the outcome and drop the stored PBX token
+    async with async_session_factory() as db:
+        await db.execute(
+            update(Job)
+            .where(Job.id == job_id)
+            .values(
+                status=status,
+                result=result,
+                message=message,
+                finished_at=func.now(),
+                _token=None,
+            )
+        )
+        await db.commit()
+
+
+class JobExecutor:
+    # Runs queued jobs as asyncio tasks inside the current process
+    def __init__(self):
+        self._wake = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._running: Dict[int, asyncio.Task] = {}
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+            logger.info("Job executor started")
+
+    async def stop(self) -> None:
+        # Running jobs go back to the queue and resume on the next start
+        if self._runner is None:
+            return
+        self._runner.cancel()
+        tasks: Set[asyncio.Task] = set(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(self._runner, *tasks, return_exceptions=True)
+        self._runner = None
+        logger.info("Job executor stopped")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._heartbeat()
+                while len(self._running) < max(1, settings.JOB_MAX_CONCURRENCY):
+                    job = await claim_next_job()
+                    if job is None:
+                        break
+                    task = asyncio.create_task(self._execute(job))
+                    self._running[job.id] = task
+                    task.add_done_callback(
+                        lambda _, job_id=job.id: self._done(job_id)
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job executor loop error: {e}")
+
+            try:
+                await asyncio.wait_for(
+                    self._wake.wait(), timeout=settings.JOB_POLL_INTERVAL_SECONDS
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _done(self, job_id: int) -> None:
+        self._running.pop(job_id, None)
+        self.wake()
+
+    async def _heartbeat(self) -> None:
+        # Keep owned jobs from looking stale while a handler is between checkpoints
+        if not self._running:
+            return
+        async with async_session_factory() as db:
+            await db.execute(
+                update(Job)
+                .where(Job.id.in_(list(self._running)), Job.status == "running")
+                .values(heartbeat_at=func.now())
+            )
+            await db.commit()
+
+    async def _execute(self, job: Job) -> None:
+        handler = JOB_HANDLERS.get(job.kind)
+        if handler is None:
+            await finish_job(job.id, "failed", message=f"Unknown job kind: {job.kind}")
+            return
+        if job.cancel_requested:
+            await finish_job(job.id, "cancelled")
+            return
+        if job.attempts > settings.JOB_MAX_ATTEMPTS:
+            await finish_job(
+                job.id, "failed", message=f"Abandoned after {job.attempts - 1} attempts"
+            )
+            return
+
+        logger.info(f"Running job {job.id} ({job.kind}) for {job.domain}")
+        try:
+            async with async_session_factory() as db:
+                async with httpx.AsyncClient(timeout=30.0) as http_client:
+                    client = await job_client(db, job, http_client)
+                    ctx = JobContext(job, db, client)
+                    result = await handler(ctx)
+        except JobCancelled:
+            logger.info(f"Job {job.id} cancelled")
+            await finish_job(job.id, "cancelled")
+        except asyncio.CancelledError:
+            # Process shutting down; hand the job back to the queue
+            async with async_session_factory() as db:
+                await db.execute(
+                    update(Job)
+                    .where(Job.id == job.id, Job.status == "running")
+                    .values(
+                        status="queued", heartbeat_at=None, attempts=Job.attempts - 1
+                    )
+                )
+                await db.commit()
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            await finish_job(job.id, "failed", message=str(e))
+        else:
+            logger.info(f"Job {job.id} ({job.kind}) completed")
+            await finish_job(job.id, "completed", result=result)
+
+
+executor = JobExecutor()
@@ -1,19 +1,52 @@
 import uvicorn
-from fastapi import FastAPI, Request, Depends, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, Query
+from fastapi.responses import RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES
 from config import settings
 from dependencies import get_ns_user, get_ns_client, verify_origin
-from models import NSUser, Subscription
+from models import NSUser
 from ns_client import NSClient
-from database import get_db
+from database import async_session_factory, get_db
 from sqlalchemy.ext.asyncio import AsyncSession
-from schemas import SubscriptionCreate, SubscriptionResponse, SubscriptionUpdate
+from schemas import (
+    AdoptAllResponse,
+    AuthStatusResponse,
+    BootstrapConfig,
+    BootstrapResponse,
+    BulkRequest,
+    BulkResponse,
+    CallBudgetResponse,
+    DomainHealthResponse,
+    DriftReportResponse,
+    JobResponse,
+    ReconciliationRunResponse,
+    SubscriptionAdopt,
+    SubscriptionChange,
+    SubscriptionChangesResponse,
+    SubscriptionCreate,
+    SubscriptionPage,
+    SubscriptionResponse,
+    SubscriptionUpdate,
+)
 import crud
+import events_service
+import identity_service
+import jobs_service
+import notify_service
+from http_cache import weak_etag, etag_matches, set_validators, not_modified
+from portal_script import get_portal_script
+from serialization import FastJSONResponse, list_adapter
+import reconciliation_service
+import subscription_service
+import asyncio
 import logging
-from typing import List, Union, Optional, Dict, Any
-from datetime import datetime
+import time
+from typing import List, Literal, Union, Optional
 
 log_level = getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO)
 if settings.DEBUG:
@@ -22,11 +55,38 @@ if settings.DEBUG:
 logging.basicConfig(level=log_level, format=settings.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Netsapiens Subscription Registry")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Render the portal script up front so no page load pays for it
+    get_portal_script(templates.env)
+    # Fetch identity signing keys before the first request needs them
+    if settings.IDENTITY_JWKS_URL:
+        await identity_service.signing_keys.refresh()
+    if settings.CHANGE_NOTIFICATIONS_ENABLED:
+        notify_service.listener.start()
+    # Run queued background jobs inside the API process
+    if settings.JOB_EXECUTOR_ENABLED:
+        jobs_service.executor.start()
+    yield
+    await events_service.broadcaster.close()
+    await jobs_service.executor.stop()
+    await notify_service.listener.stop()
+
+
+app = FastAPI(title="Netsapiens Subscription Registry", lifespan=lifespan)
 
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Compress JSON payloads (SSE streams are excluded by Starlette). The portal
+# script is precompressed and sets its own Vary, so it is left alone too.
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=1000,
+    exclude_content_types=(*DEFAULT_EXCLUDED_CONTENT_TYPES, "application/javascript"),
+)
+
 # CORS Configuration - Dynamic regex for wildcard origin matching
 raw_origins = [o.strip() for o in settings.ALLOWED_ORIGINS.split(",") if o.strip()]
 
@@ -75,21 +135,19 @@ async def health_check():
 
 
 @app.get("/portal-script.js")
-async def get_portal_script(request: Request):
-    # Dynamically generated JS for portal injection
-    base = settings.PUBLIC_API_URL.rstrip("/")
-    redirect_uri = f"{base}/receive-ns-redirect/"
+async def get_portal_loader(request: Request):
+    # Stable URL referenced by the portal; a tiny loader for the hashed bundle
+    return get_portal_script(templates.env).loader.respond(request)
 
-    return templates.TemplateResponse(
-        "portal_injection.js",
-        {
-            "request": request,
-            "api_endpoint": f"{base}/subscriptions",
-            "client_id": settings.NS_CLIENT_ID,
-            "redirect_uri": redirect_uri,
-        },
-        media_type="application/javascript",
-    )
+
+@app.get("/portal-script.{digest}.js")
+async def get_portal_bundle(digest: str, request: Request):
+    # Content-hashed portal script, rendered and compressed once per process
+    portal = get_portal_script(templates.env)
+    if digest != portal.bundle.digest:
+        # Loader cached from before a deploy; send it to the current bundle
+        return RedirectResponse(portal.url, headers={"Cache-Control": "no-cache"})
+    return portal.bundle.respond(request)
 
 
 @app.get("/subscriptions", dependencies=[Depends(verify_origin)])
@@ -100,6 +158,55 @@ async def get_subscriptions_ui(request: Request, user: NSUser = Depends(get_ns_u
     )
 
 
+@app.get(
+    "/bootstrap",
+    response_model=BootstrapResponse,
+    dependencies=[Depends(verify_origin)],
+)
+async def bootstrap(
+    user: NSUser = Depends(get_ns_user),
+    db: AsyncSession = Depends(get_db),
+    client: NSClient = Depends(get_ns_client),
+):
+    # First render of the Subscriptions tab in one round trip with a single
+    # identity lookup. The credential and health lookups run on their own
+    # sessions alongside the first page; that page reaches into the PBX only
+    # when the managed rows do not fill it.
+    api_url = normalize_api_url(settings.NS_API_URL)
+    base = settings.PUBLIC_API_URL.rstrip("/")
+
+    async def credential_id():
+        async with async_session_factory() as session:
+            return await crud.get_credential_id(
+                session, api_url, user.domain, user.user
+            )
+
+    async def health():
+        async with async_session_factory() as session:
+            return await events_service.get_domain_health(
+                session, api_url, user.domain
+            )
+
+    cred_id, domain_health, page = await asyncio.gather(
+        credential_id(),
+        health(),
+        subscription_service.first_list_page(db, client, api_url, user.domain),
+    )
+
+    return BootstrapResponse(
+        auth=AuthStatusResponse(
+            has_auth=cred_id is not None, user=user.user, domain=user.domain
+        ),
+        health=domain_health,
+        subscriptions=page,
+        config=BootstrapConfig(
+            client_id=settings.NS_CLIENT_ID,
+            redirect_uri=f"{base}/receive-ns-redirect/",
+            subscription_duration_days=settings.SUBSCRIPTION_DURATION_DAYS,
+        ),
+    )
+
+
 @app.post(
     "/subscriptions",
     response_model=SubscriptionResponse,
@@ -115,13 +222,8 @@ async def create_subscription(
     api_url = normalize_api_url(settings.NS_API_URL)
 
     try:
-        expires_seconds = settings.SUBSCRIPTION_DURATION_DAYS * 24 * 60 * 60
-        await client.create_subscription(
-            domain=user.domain,
-            user=sub_in.user,
-            model=sub_in.subscription_model.lower(),
-            url=sub_in.post_url,
-            expires=expires_seconds,
+        pbx_id, pbx_expires_at = await subscription_service.push_create(
+            client, user.domain, sub_in
         )
     except Exception as e:
         logger.error(f"Failed to create subscription on PBX: {e}")
@@ -129,9 +231,16 @@ async def create_subscription(
             status_code=502, detail=f"Failed to create on PBX: {str(e)}"
         )
 
-    return await crud.create_subscription(
-        db, sub_in, api_server=api_url, domain=user.domain
+    db_sub = await crud.create_subscription(
+        db,
+        sub_in,
+        api_server=api_url,
+        domain=user.domain,
+        pbx_subscription_id=pbx_id,
+        pbx_expires_at=pbx_expires_at,
     )
+    await db.commit()
+    return db_sub
 
 
 @app.post(
@@ -141,7 +250,7 @@ async def create_subscription(
     dependencies=[Depends(verify_origin)],
 )
 async def adopt_subscription(
-    sub_in: SubscriptionCreate,
+    sub_in: SubscriptionAdopt,
     user: NSUser = Depends(get_ns_user),
     db: AsyncSession = Depends(get_db),
 ):
@@ -149,7 +258,11 @@ async def adopt_subscription(
     api_url = normalize_api_url(settings.NS_API_URL)
 
     db_sub = await crud.create_subscription(
-        db, sub_in, api_server=api_url, domain=user.domain
+        db,
+        sub_in,
+        api_server=api_url,
+        domain=user.domain,
+        pbx_subscription_id=sub_in.pbx_subscription_id,
     )
 
     await crud.create_audit_log(
@@ -162,10 +275,76 @@ async def adopt_subscription(
         resource_id=db_sub.id,
         description=f"Adopted existing PBX subscription for {sub_in.user}",
     )
+    await db.commit()
 
     return db_sub
 
 
+@app.post(
+    "/subscriptions/adopt-all",
+    response_model=Union[AdoptAllResponse, JobResponse],
+    dependencies=[Depends(verify_origin)],
+)
+async def adopt_all_subscriptions(
+    response: Response,
+    dry_run: bool = False,
+    background: bool = False,
+    user: NSUser = Depends(get_ns_user),
+    db: AsyncSession = Depends(get_db),
+    client: NSClient = Depends(get_ns_client),
+):
+    # Adopt every unmanaged PBX subscription in the domain (or preview with dry_run)
+    api_url = normalize_api_url(settings.NS_API_URL)
+
+    if background:
+        job = await jobs_service.enqueue_job(
+            db,
+            "adopt_all",
+            api_server=api_url,
+            domain=user.domain,
+            user=user.user,
+            token=client.token,
+            params={"dry_run": dry_run},
+        )
+        response.status_code = 202
+        return JobResponse.model_validate(job)
+
+    try:
+        return await subscription_service.adopt_all_unmanaged(
+            db, client, user, api_url, dry_run=dry_run
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to adopt unmanaged subscriptions: {e}")
+        raise HTTPException(
+            status_code=502, detail=f"Failed to adopt from PBX: {str(e)}"
+        )
+
+
+@app.post(
+    "/subscriptions/bulk",
+    response_model=BulkResponse,
+    dependencies=[Depends(verify_origin)],
+)
+async def bulk_subscriptions(
+    bulk_in: BulkRequest,
+    user: NSUser = Depends(get_ns_user),
+    db: AsyncSession = Depends(get_db),
+    client: NSClient = Depends(get_ns_client),
+):
+    # Apply many create/update/delete operations with concurrent PBX calls
+    api_url = normalize_api_url(settings.NS_API_URL)
+
+    results = await subscription_service.apply_bulk_operations(
+        db, client, user, api_url, bulk_in.operations
+    )
+    succeeded = sum(1 for r in results if r.status == "ok")
+    return BulkResponse(
+        succeeded=succeeded, failed=len(results) - succeeded, results=results
+    )
+
+
 @app.put(
     "/subscriptions/{subscription_id}",
     response_model=SubscriptionResponse,
@@ -179,54 +358,12 @@ async def update_subscription(
     client: NSClient = Depends(get_ns_client),
 ):
     # Update managed subscription on PBX and local registry
-    from datetime import timezone
-
     db_sub = await crud.get_subscription_by_id(db, subscription_id)
     if not db_sub:
         raise HTTPException(status_code=404, detail="Subscription not found")
 
     try:
-        pbx_subs = await client.get_subscriptions(
-            domain=db_sub.domain, user=db_sub.user
-        )
-        target_pbx_id = None
-        for p in pbx_subs:
-            if (
-                p.model.lower() == db_sub.subscription_model.lower()
-                and p.post_url == db_sub.post_url
-            ):
-                target_pbx_id = p.id
-                break
-
-        if target_pbx_id:
-            ns_payload: Dict[str, Any] = {
-                "model": db_sub.subscription_model,
-                "post-url": (
-                    sub_update.post_url if sub_update.post_url else db_sub.post_url
-                ),
-                "subscription-geo-support": "yes",
-            }
-            if sub_update.expires_at:
-                duration = sub_update.expires_at - datetime.now(timezone.utc)
-                ns_payload["expires"] = max(60, int(duration.total_seconds()))
-
-            await client.update_subscription(target_pbx_id, db_sub.domain, **ns_payload)
-            logger.info(
-                f"Updated PBX sub {target_pbx_id} for local sub {subscription_id}"
-            )
-        else:
-            logger.warning(
-                f"PBX sub not found for local sub {subscription_id}. Attempting re-creation."
-            )
-            expires_seconds = settings.SUBSCRIPTION_DURATION_DAYS * 24 * 60 * 60
-            await client.create_subscription(
-                domain=db_sub.domain,
-                user=db_sub.user,
-                model=db_sub.subscription_model.lower(),
-                url=sub_update.post_url if sub_update.post_url else db_sub.post_url,
-                expires=expires_seconds,
-            )
-
+        await subscription_service.push_update(client, db_sub, sub_update)
     except Exception as e:
         logger.error(f"Failed to update subscription on PBX: {e}")
         raise HTTPException(
@@ -245,91 +382,168 @@ async def update_subscription(
         resource_id=subscription_id,
         description=f"Updated subscription {subscription_id}",
     )
+    await db.commit()
 
     return updated_sub
 
 
 @app.get("/subscriptions/status", dependencies=[Depends(verify_origin)])
 async def get_subscriptions_status(
+    request: Request,
+    response: Response,
     user: NSUser = Depends(get_ns_user),
     db: AsyncSession = Depends(get_db),
 ):
     # Health summary for managed subscriptions
-    from sqlalchemy import select
-    from models import Subscription
+    api_url = normalize_api_url(settings.NS_API_URL)
+
+    version = await events_service.get_domain_version(db, api_url, user.domain)
+    etag = weak_etag("status", api_url, user.domain, version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_validators(response, etag)
+
+    return await events_service.get_domain_health(db, api_url, user.domain)
 
+
+@app.get(
+    "/subscriptions/summary",
+    response_model=DomainHealthResponse,
+    dependencies=[Depends(verify_origin)],
+)
+async def get_subscriptions_summary(
+    user: NSUser = Depends(get_ns_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Per-domain subscription counts from the maintained summary row
     api_url = normalize_api_url(settings.NS_API_URL)
 
-    stmt = select(Subscription).where(
-        Subscription.domain == user.domain,
-        Subscription.status == "active",
-        Subscription.maintenance_status == "failed",
-        Subscription.api_server == api_url,
-    )
-    result = await db.execute(stmt)
-    failed_subs = result.scalars().all()
+    summary = await crud.get_domain_health_summary(db, api_url, user.domain)
+    if not summary:
+        return DomainHealthResponse()
+    return summary
+
 
-    if failed_subs:
-        return {
-            "status": "unhealthy",
-            "count": len(failed_subs),
-            "message": f"Maintenance is failing for {len(failed_subs)} subscriptions.",
-        }
+@app.get(
+    "/subscriptions/pbx-usage",
+    response_model=CallBudgetResponse,
+    dependencies=[Depends(verify_origin)],
+)
+async def get_pbx_usage(user: NSUser = Depends(get_ns_user)):
+    # The caller's domain against its PBX call budgets in this API process
+    return NSClient.budget.usage(user.domain)
+
+
+@app.get("/subscriptions/events", dependencies=[Depends(verify_origin)])
+async def subscription_events(
+    request: Request,
+    user: NSUser = Depends(get_ns_user),
+):
+    # SSE stream of maintenance health; authenticates once per connection
+    api_url = normalize_api_url(settings.NS_API_URL)
 
-    return {"status": "healthy"}
+    return StreamingResponse(
+        events_service.health_stream(request, api_url, user.domain),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get(
     "/subscriptions/list",
-    response_model=List[SubscriptionResponse],
+    response_model=SubscriptionPage,
     dependencies=[Depends(verify_origin)],
 )
 async def list_subscriptions(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(
+        subscription_service.LIST_DEFAULT_LIMIT,
+        ge=1,
+        le=subscription_service.LIST_MAX_LIMIT,
+    ),
+    sort: str = Query("id", pattern=r"^-?(id|user|change_version)$"),
+    user_filter: Optional[str] = Query(None, alias="user"),
+    model: Optional[str] = None,
+    maintenance_status: Optional[str] = None,
+    source: Optional[Literal["db", "pbx"]] = None,
     user: NSUser = Depends(get_ns_user),
     db: AsyncSession = Depends(get_db),
     client: NSClient = Depends(get_ns_client),
 ):
-    # Merged list of managed (DB) and unmanaged (PBX) subscriptions
+    # One page of managed (DB) then unmanaged (PBX) subscriptions
     api_url = normalize_api_url(settings.NS_API_URL)
+    position = subscription_service.decode_list_cursor(cursor, sort, source)
+
+    # Only pages past the managed rows include PBX data, which carries no DB
+    # version; those tags also roll over per TTL window
+    version = await events_service.get_domain_version(db, api_url, user.domain)
+    pbx_window = (
+        int(time.time() // max(1, settings.LIST_ETAG_PBX_TTL_SECONDS))
+        if position["p"] == "pbx"
+        else None
+    )
+    etag = weak_etag(
+        "list", api_url, user.domain, version, pbx_window, request.url.query
+    )
+    if etag_matches(request, etag):
+        return not_modified(etag)
 
-    db_subs = await crud.get_subscriptions(db, api_server=api_url, domain=user.domain)
+    page = await subscription_service.list_subscriptions_page(
+        db,
+        client,
+        api_url,
+        user.domain,
+        position,
+        limit,
+        user=user_filter,
+        subscription_model=model,
+        maintenance_status=maintenance_status,
+        source=source,
+    )
+    if position["p"] == "pbx":
+        # A lazy backfill may have moved the domain version; tag what was sent
+        version = await events_service.get_domain_version(db, api_url, user.domain)
+        etag = weak_etag(
+            "list", api_url, user.domain, version, pbx_window, request.url.query
+        )
+    # Rows go straight to JSON; SubscriptionPage only documents the shape
+    response = FastJSONResponse(page)
+    set_validators(response, etag)
+    return response
 
-    try:
-        pbx_subs_raw = await client.get_subscriptions(domain=user.domain)
-    except Exception as e:
-        logger.warning(f"Failed to fetch PBX subscriptions: {e}")
-        pbx_subs_raw = []
-
-    merged_list: List[Union[Subscription, SubscriptionResponse]] = []
-    db_index = {f"{s.user}:{s.subscription_model}:{s.post_url}": s for s in db_subs}
-    merged_list.extend(db_subs)
-
-    for p in pbx_subs_raw:
-        p_user = p.user
-        p_model = p.model
-        p_url = p.post_url
-
-        if not (p_user and p_model and p_url):
-            continue
-
-        key = f"{p_user}:{p_model}:{p_url}"
-
-        if key not in db_index:
-            unmanaged = SubscriptionResponse(
-                user=p_user,
-                subscription_model=p_model,
-                post_url=p_url,
-                expires_at=None,
-                description="Unmanaged (PBX Only)",
-                status="active",
-                source="pbx",
-                api_server=api_url,
-                domain=user.domain,
-                id=None,
-            )
-            merged_list.append(unmanaged)
 
-    return merged_list
+@app.get(
+    "/subscriptions/changes",
+    response_model=SubscriptionChangesResponse,
+    dependencies=[Depends(verify_origin)],
+)
+async def get_subscription_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=5000),
+    user: NSUser = Depends(get_ns_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Managed rows changed after cursor `since`; archives come back as tombstones
+    api_url = normalize_api_url(settings.NS_API_URL)
+
+    rows = await crud.get_subscription_changes(
+        db, api_url, user.domain, since=since, limit=limit + 1
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    changes = [
+        SubscriptionChange.model_validate(row).model_copy(
+            update={"deleted": row.status == "archived"}
+        )
+        for row in rows
+    ]
+    return SubscriptionChangesResponse(
+        cursor=rows[-1].change_version if rows else since,
+        has_more=has_more,
+        changes=changes,
+    )
 
 
 @app.delete(
@@ -349,42 +563,137 @@ async def delete_subscription(
         raise HTTPException(status_code=404, detail="Subscription not found")
 
     try:
-        pbx_subs = await client.get_subscriptions(domain=sub.domain, user=sub.user)
-
-        target_id = None
-        for p in pbx_subs:
-            if (
-                p.model.lower() == sub.subscription_model.lower()
-                and p.post_url == sub.post_url
-            ):
-                target_id = p.id
-                break
-
-        if target_id:
-            await client.delete_subscription(target_id, domain=sub.domain)
-            logger.info(
-                f"Deleted PBX subscription {target_id} for local sub {subscription_id}"
-            )
-        else:
-            logger.warning(
-                f"Could not find PBX subscription for local sub {subscription_id} to delete."
-            )
-
+        await subscription_service.push_delete(client, sub)
     except HTTPException as e:
-        if e.status_code == 404:
-            logger.info(
-                "Subscription not found on PBX (404). Proceeding to archive local record."
-            )
-        else:
-            logger.error(f"Failed to delete subscription from PBX: {e.detail}")
-            raise e
+        logger.error(f"Failed to delete subscription from PBX: {e.detail}")
+        raise e
     except Exception as e:
         logger.error(f"Unexpected error deleting subscription from PBX: {e}")
         raise HTTPException(
             status_code=502, detail=f"Failed to delete on PBX: {str(e)}"
         )
 
-    return await crud.archive_subscription(db, subscription_id)
+    archived_sub = await crud.archive_subscription(db, subscription_id)
+    await db.commit()
+    return archived_sub
+
+
+@app.post(
+    "/subscriptions/reconcile",
+    response_model=Union[ReconciliationRunResponse, JobResponse],
+    dependencies=[Depends(verify_origin)],
+)
+async def reconcile_subscriptions(
+    response: Response,
+    auto_repair: bool = False,
+    background: bool = False,
+    user: NSUser = Depends(get_ns_user),
+    db: AsyncSession = Depends(get_db),
+    client: NSClient = Depends(get_ns_client),
+):
+    # On-demand DB vs PBX drift report for the caller's domain
+    api_url = normalize_api_url(settings.NS_API_URL)
+
+    if background:
+        job = await jobs_service.enqueue_job(
+            db,
+            "reconcile",
+            api_server=api_url,
+            domain=user.domain,
+            user=user.user,
+            token=client.token,
+            params={"auto_repair": auto_repair},
+        )
+        response.status_code = 202
+        return JobResponse.model_validate(job)
+
+    run = await reconciliation_service.reconcile_domain(
+        db,
+        client,
+        api_server=api_url,
+        domain=user.domain,
+        token_user=user.user,
+        auto_repair=auto_repair,
+        trigger="manual",
+    )
+    drift = await reconciliation_service.get_drift_reports(db, run.id)
+    return ReconciliationRunResponse.model_validate(run).model_copy(
+        update={"drift": [DriftReportResponse.model_validate(d) for d in drift]}
+    )
+
+
+@app.get(
+    "/subscriptions/reconcile/latest",
+    response_model=ReconciliationRunResponse,
+    dependencies=[Depends(verify_origin)],
+)
+async def get_latest_reconciliation(
+    user: NSUser = Depends(get_ns_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Most recent drift report for the caller's domain
+    api_url = normalize_api_url(settings.NS_API_URL)
+
+    run = await reconciliation_service.get_latest_run(db, api_url, user.domain)
+    if not run:
+        raise HTTPException(status_code=404, detail="No reconciliation runs found")
+
+    drift = await reconciliation_service.get_drift_reports(db, run.id)
+    return ReconciliationRunResponse.model_validate(run).model_copy(
+        update={"drift": [DriftReportResponse.model_validate(d) for d in drift]}
+    )
+
+
+@app.get(
+    "/jobs",
+    response_model=List[JobResponse],
+    dependencies=[Depends(verify_origin)],
+)
+async def list_jobs(
+    user: NSUser = Depends(get_ns_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Recent background jobs for the caller's domain
+    api_url = normalize_api_url(settings.NS_API_URL)
+    return await jobs_service.get_jobs(db, api_url, user.domain)
+
+
+@app.get(
+    "/jobs/{job_id}",
+    response_model=JobResponse,
+    dependencies=[Depends(verify_origin)],
+)
+async def get_job(
+    job_id: int,
+    user: NSUser = Depends(get_ns_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Status and progress of one background job
+    api_url = normalize_api_url(settings.NS_API_URL)
+
+    job = await jobs_service.get_job(db, api_url, user.domain, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post(
+    "/jobs/{job_id}/cancel",
+    response_model=JobResponse,
+    dependencies=[Depends(verify_origin)],
+)
+async def cancel_job(
+    job_id: int,
+    user: NSUser = Depends(get_ns_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Cancel a queued job, or ask a running one to stop at its next checkpoint
+    api_url = normalize_api_url(settings.NS_API_URL)
+
+    job = await jobs_service.get_job(db, api_url, user.domain, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return await jobs_service.cancel_job(db, job)
 
 
 @app.get(
@@ -399,7 +708,7 @@ async def search_users(
     all_users = await client.get_users(domain=user.domain)
 
     if not q:
-        return all_users[:20]
+        return users_response(all_users[:20])
 
     q_lower = q.lower()
 
@@ -412,7 +721,12 @@ async def search_users(
         ):
             filtered.append(u)
 
-    return filtered[:50]
+    return users_response(filtered[:50])
+
+
+def users_response(users: List[NSUser]) -> Response:
+    # Already validated by the client; dumped by alias as response_model would
+    return FastJSONResponse(list_adapter(NSUser).dump_json(users, by_alias=True))
 
 
 def normalize_api_url(url: str) -> str:
@@ -475,6 +789,7 @@ async def receive_ns_redirect(
         access_token=token_data.get("access_token"),
         expires_in=token_data.get("expires_in"),
     )
+    await db.commit()
 
     return templates.TemplateResponse(
         "auth_success.html", {"request": request, "user": user, "domain": domain}
@@ -483,24 +798,23 @@ async def receive_ns_redirect(
 
 @app.get("/auth/check", dependencies=[Depends(verify_origin)])
 async def check_auth_status(
+    request: Request,
+    response: Response,
     user: NSUser = Depends(get_ns_user),
     db: AsyncSession = Depends(get_db),
 ):
     # Check if valid OAuth credentials exist for the user
-    from sqlalchemy import select
-    from models import OAuthCredential
-
     api_url = normalize_api_url(settings.NS_API_URL)
 
-    stmt = select(OAuthCredential).where(
-        OAuthCredential.api_server == api_url,
-        OAuthCredential.domain == user.domain,
-        OAuthCredential.user == user.user,
-    )
-    result = await db.execute(stmt)
-    cred = result.scalar_one_or_none()
+    # Only existence is reported; the row id alone versions the answer
+    cred_id = await crud.get_credential_id(db, api_url, user.domain, user.user)
+
+    etag = weak_etag("auth", api_url, user.domain, user.user, cred_id)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_validators(response, etag)
 
-    return {"has_auth": cred is not None, "user": user.user, "domain": user.domain}
+    return {"has_auth": cred_id is not None, "user": user.user, "domain": user.domain}
 
 
 if __name__ == "__main__":
@@ -510,4 +824,6 @@ if __name__ == "__main__":
         port=8000,
         proxy_headers=True,
         forwarded_allow_ips="*",
+        # Open SSE streams never finish on their own; cut them off at shutdown
+        timeout_graceful_shutdown=5,
     )
@@ -1,8 +1,11 @@
+import argparse
 import asyncio
 import logging
+import signal
 import sys
 from database import async_session_factory
-from maintenance_service import run_maintenance
+from maintenance_service import RunBudget, run_maintenance, run_health_recount
+from reconciliation_service import run_scheduled_reconciliation
 from config import settings
 
 # Configure logging for CLI
@@ -15,27 +18,82 @@ logging.basicConfig(
 logger = logging.getLogger("maintenance-cli")
 
 
-async def main():
-    # CLI entrypoint for maintenance run
+async def run_once(budget: RunBudget) -> bool:
+    # One maintenance pass; returns False if it failed
+    async with async_session_factory() as db:
+        try:
+            await run_maintenance(db, budget)
+            await run_health_recount(db, budget)
+            await run_scheduled_reconciliation(db, budget)
+            logger.info("Maintenance run completed successfully.")
+        except Exception as e:
+            logger.exception(f"Maintenance run failed: {e}")
+            return False
+    return True
+
+
+async def main(max_duration_minutes: float, interval_minutes: float):
+    # CLI entrypoint for maintenance runs
     db_url = settings.DATABASE_URL
     if "@" in db_url:
         part1, part2 = db_url.split("@")
         masked_url = f"{part1.split(':')[0]}:***@{part2}"
         logger.info(f"Connecting to database: {masked_url}")
 
-    logger.info("Starting maintenance run...")
-    async with async_session_factory() as db:
+    # Past the budget (or on SIGTERM) the run stops between items and the
+    # next one resumes from the saved checkpoint. SIGTERM also ends the
+    # interval loop, so a container stop never waits out a sleep.
+    stopping = asyncio.Event()
+    budget = RunBudget()
+
+    def stop() -> None:
+        logger.info("SIGTERM received; stopping after the current item.")
+        budget.stop()
+        stopping.set()
+
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop)
+
+    while True:
+        budget = RunBudget(max_duration_minutes * 60)
+        limit = f" (budget {max_duration_minutes:g} minutes)" if budget.deadline else ""
+        logger.info(f"Starting maintenance run{limit}...")
+        ok = await run_once(budget)
+        if not interval_minutes:
+            if not ok:
+                sys.exit(1)
+            return
+        if stopping.is_set():
+            return
+
+        logger.info(f"Sleeping for {interval_minutes:g} minutes...")
         try:
-            await run_maintenance(db)
-            logger.info("Maintenance run completed successfully.")
-        except Exception as e:
-            logger.exception(f"Maintenance run failed: {e}")
-            sys.exit(1)
+            await asyncio.wait_for(stopping.wait(), interval_minutes * 60)
+            return
+        except asyncio.TimeoutError:
+            pass
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run maintenance passes")
+    parser.add_argument(
+        "--max-duration",
+        type=float,
+        default=settings.MAINTENANCE_MAX_DURATION_MINUTES,
+        metavar="MINUTES",
+        help="stop starting new work after this long; 0 for no limit "
+        "(default: MAINTENANCE_MAX_DURATION_MINUTES)",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.0,
+        metavar="MINUTES",
+        help="keep running, starting a pass this long after the previous one "
+        "ends; 0 for a single pass (default: 0)",
+    )
+    args = parser.parse_args()
     try:
-        asyncio.run(main())
+        asyncio.run(main(max(0.0, args.max_duration), max(0.0, args.interval)))
     except KeyboardInterrupt:
         logger.info("Maintenance run interrupted by user.")
         sys.exit(0)
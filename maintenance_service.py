@@ -1,17 +1,47 @@
+import asyncio
 import logging
+import time
 import httpx
+from collections import deque
 from datetime import datetime, timezone, timedelta
-from typing import Dict, Tuple, Optional
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Set,
+    Tuple,
+    Optional,
+    TypeVar,
+    Union,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from models import Subscription, OAuthCredential
-from ns_client import NSClient
-from crud import create_audit_log
+from database import async_session_factory
+from models import (
+    MaintenanceCheckpoint,
+    NSSubscription,
+    OAuthCredential,
+    Subscription,
+)
+from ns_client import CallBudgetExceeded, NSClient, extract_subscription_id
+from crud import (
+    create_audit_log,
+    get_maintenance_checkpoint,
+    get_recount_domains,
+    recount_one_domain_health,
+)
+from notify_service import publish_domain_changes
+import renewal_policy
 from config import settings
 from fastapi import HTTPException
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 def ensure_utc(dt: Optional[datetime]) -> Optional[datetime]:
     if dt is None:
@@ -21,15 +51,103 @@ def ensure_utc(dt: Optional[datetime]) -> Optional[datetime]:
     return dt.astimezone(timezone.utc)
 
 
+class RunBudget:
+    # Wall-clock budget for one maintenance run. Work stops between items once
+    # it is spent (or stop() is called), so a PBX call in flight still finishes.
+    def __init__(self, max_seconds: Optional[float] = None):
+        self.started = time.monotonic()
+        self.deadline = self.started + max_seconds if max_seconds else None
+        self.stopped = False
+
+    def stop(self) -> None:
+        self.stopped = True
+
+    def exhausted(self) -> bool:
+        if not self.stopped and self.deadline is not None:
+            self.stopped = time.monotonic() >= self.deadline
+        return self.stopped
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+
+def resume_order(
+    items: List[T], key: Callable[[T], Tuple[Any, ...]], position: Optional[list]
+) -> List[T]:
+    # Items sorted by key, starting after the checkpointed position and
+    # wrapping around to the ones before it
+    items = sorted(items, key=key)
+    if not position:
+        return items
+    after = tuple(position)
+    split = next((i for i, item in enumerate(items) if key(item) > after), len(items))
+    return items[split:] + items[:split]
+
+
+def credential_key(cred: OAuthCredential) -> Tuple[int]:
+    return (cred.id,)
+
+
+# Items whose failures back off (same tracking columns on both)
+MaintainedItem = Union[Subscription, OAuthCredential]
+
+
+def retry_eligible(item: MaintainedItem, now: Optional[datetime] = None) -> bool:
+    next_attempt_at = ensure_utc(item.next_attempt_at)
+    return next_attempt_at is None or next_attempt_at <= (
+        now or datetime.now(timezone.utc)
+    )
+
+
+def record_success(item: MaintainedItem, message: str) -> None:
+    item.maintenance_status = "success"
+    item.maintenance_message = message
+    item.last_maintenance_attempt = datetime.now(timezone.utc)
+    item.attempt_count = 0
+    item.next_attempt_at = None
+
+
+def record_failure(item: MaintainedItem, message: str) -> None:
+    # Failed items sit out runs until next_attempt_at, so a persistent failure
+    # (e.g. a webhook URL the PBX rejects) stops costing calls every run
+    now = datetime.now(timezone.utc)
+    item.attempt_count = (item.attempt_count or 0) + 1
+    item.maintenance_status = "failed"
+    item.maintenance_message = message
+    item.last_maintenance_attempt = now
+    item.next_attempt_at = now + renewal_policy.retry_delay(item.attempt_count)
+
+
+async def fetch_domain_users(ns_client: NSClient, domain: str) -> Optional[Set[str]]:
+    # Load the domain's user directory once so existence checks stay in memory
+    try:
+        users = await ns_client.get_users(domain=domain)
+    except Exception as e:
+        logger.warning(
+            f"Could not load user directory for {domain}, "
+            f"checking users individually: {e}"
+        )
+        return None
+    return {u.user for u in users}
+
+
 async def check_user_existence(
-    db: AsyncSession, sub: Subscription, ns_client: NSClient
+    db: AsyncSession,
+    sub: Subscription,
+    ns_client: NSClient,
+    known_users: Optional[Set[str]] = None,
 ) -> bool:
     # Check if user exists on PBX and archive if not
+    if known_users is not None and sub.user in known_users:
+        return True
+
+    # Directory may be partial for the token's scope, so confirm before archiving
     try:
         user = await ns_client.get_user(sub.domain, sub.user)
         if not user:
             logger.warning(
-                f"User {sub.user} @ {sub.domain} not found on PBX. Archiving subscription {sub.id}."
+                f"User {sub.user} @ {sub.domain} not found on PBX. "
+                f"Archiving subscription {sub.id}."
             )
             sub.status = "archived"
             sub.maintenance_status = "archived"
@@ -48,26 +166,83 @@ async def check_user_existence(
             await db.commit()
             return False
         return True
+    except CallBudgetExceeded:
+        # The domain is out of calls, not the subscription at fault
+        raise
     except Exception as e:
         logger.error(
             f"Error checking user existence for {sub.user} @ {sub.domain}: {e}"
         )
-        sub.maintenance_status = "failed"
-        sub.maintenance_message = f"Existence check failed: {str(e)}"
-        sub.last_maintenance_attempt = datetime.now(timezone.utc)
+        record_failure(sub, f"Existence check failed: {str(e)}")
         await db.commit()
         return False
 
 
-async def refresh_credential(db: AsyncSession, cred: OAuthCredential) -> bool:
-    # Refresh OAuth token if expiring soon
-    TOKEN_MAINTENANCE_WINDOW = timedelta(hours=2)
-    now = datetime.now(timezone.utc)
+# One refresh per credential at a time in this process; the row lock taken
+# under it covers other processes. Refresh tokens may rotate, so a duplicate
+# refresh with the old one could fail and archive the user's subscriptions.
+_refresh_locks: Dict[int, asyncio.Lock] = {}
+
 
+def token_due(cred: OAuthCredential) -> bool:
+    # Expired tokens are also caught on first use (401), so the proactive
+    # window only needs to cover the gap until the next maintenance run
+    window = renewal_policy.token_refresh_lead(cred.id)
     expires_at = ensure_utc(cred.expires_at)
-    if expires_at and (expires_at - now) > TOKEN_MAINTENANCE_WINDOW:
+    return not expires_at or (expires_at - datetime.now(timezone.utc)) <= window
+
+
+async def refresh_credential(
+    db: AsyncSession, cred: OAuthCredential, rejected_token: Optional[str] = None
+) -> bool:
+    # Refresh OAuth token if expiring soon, or at once when the PBX has
+    # rejected rejected_token
+    if rejected_token is None and not token_due(cred):
         return True
+    if not retry_eligible(cred):
+        return False
+
+    async with _refresh_locks.setdefault(cred.id, asyncio.Lock()):
+        # Re-read under a row lock; another worker may have refreshed already
+        await db.refresh(cred, with_for_update=True)
+        if rejected_token is None:
+            refreshed = not token_due(cred)
+        else:
+            refreshed = cred.access_token != rejected_token
+        if refreshed:
+            await db.commit()
+            return True
+        if not retry_eligible(cred):
+            # Failed in another worker meanwhile; wait out its backoff
+            await db.commit()
+            return False
+        return await _refresh_locked_credential(db, cred)
 
+
+async def refresh_on_unauthorized(cred_id: int, rejected_token: str) -> Optional[str]:
+    # NSClient token_refresher for stored credentials. Uses its own session so
+    # a 401 mid-way through a caller's unit of work never commits it.
+    async with async_session_factory() as db:
+        cred = await db.get(OAuthCredential, cred_id)
+        if cred is None or cred.maintenance_status == "failed_permanent":
+            return None
+        logger.info(f"Access token for {cred.user} @ {cred.domain} was rejected")
+        if not await refresh_credential(db, cred, rejected_token=rejected_token):
+            return None
+        return cred.access_token
+
+
+def credential_client(
+    cred: OAuthCredential, http_client: httpx.AsyncClient
+) -> NSClient:
+    return NSClient(
+        token=cred.access_token,
+        client=http_client,
+        token_refresher=partial(refresh_on_unauthorized, cred.id),
+    )
+
+
+async def _refresh_locked_credential(db: AsyncSession, cred: OAuthCredential) -> bool:
     logger.info(f"Refreshing token for {cred.user} @ {cred.domain}")
     try:
         new_token_data = await NSClient.refresh_oauth_token(cred.refresh_token)
@@ -80,9 +255,7 @@ async def refresh_credential(db: AsyncSession, cred: OAuthCredential) -> bool:
         cred.expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
         cred.last_refresh_at = datetime.now(timezone.utc)
 
-        cred.maintenance_status = "success"
-        cred.maintenance_message = "Token refreshed successfully"
-        cred.last_maintenance_attempt = datetime.now(timezone.utc)
+        record_success(cred, "Token refreshed successfully")
 
         await create_audit_log(
             db,
@@ -126,11 +299,9 @@ async def refresh_credential(db: AsyncSession, cred: OAuthCredential) -> bool:
                 )
             )
             await db.execute(stmt_archive)
+            cred.last_maintenance_attempt = datetime.now(timezone.utc)
         else:
-            cred.maintenance_status = "failed"
-            cred.maintenance_message = f"Refresh failed: {e.detail}"
-
-        cred.last_maintenance_attempt = datetime.now(timezone.utc)
+            record_failure(cred, f"Refresh failed: {e.detail}")
 
         await create_audit_log(
             db,
@@ -146,9 +317,7 @@ async def refresh_credential(db: AsyncSession, cred: OAuthCredential) -> bool:
         return False
     except Exception as e:
         logger.error(f"Failed to refresh token for {cred.user} @ {cred.domain}: {e}")
-        cred.maintenance_status = "failed"
-        cred.maintenance_message = f"Refresh failed: {str(e)}"
-        cred.last_maintenance_attempt = datetime.now(timezone.utc)
+        record_failure(cred, f"Refresh failed: {str(e)}")
 
         await create_audit_log(
             db,
@@ -164,39 +333,108 @@ async def refresh_credential(db: AsyncSession, cred: OAuthCredential) -> bool:
         return False
 
 
-async def renew_subscription(
-    db: AsyncSession, sub: Subscription, ns_client: NSClient
-) -> bool:
-    # Renew PBX subscription if expiring soon or duration mismatch
+async def fetch_domain_subscriptions(
+    ns_client: NSClient, domain: str
+) -> Optional[List[NSSubscription]]:
+    # Load the domain's PBX subscription listing once per run
+    try:
+        return await ns_client.get_subscriptions(domain=domain)
+    except Exception as e:
+        logger.warning(
+            f"Could not load PBX subscriptions for {domain}, using stored expiry: {e}"
+        )
+        return None
+
+
+# PBX listing entries by (user, lowercased model, post_url)
+PBXIndex = Dict[Tuple[str, str, str], NSSubscription]
+
+
+def index_pbx_subscriptions(pbx_subs: List[NSSubscription]) -> PBXIndex:
+    # Build once per domain so each subscription is a dict lookup; the first
+    # listed entry wins, as a scan would find it
+    index: PBXIndex = {}
+    for p in pbx_subs:
+        index.setdefault((p.user, p.model.lower(), p.post_url), p)
+    return index
+
+
+def apply_pbx_state(
+    sub: Subscription, pbx_index: Optional[PBXIndex], covered: bool
+) -> Optional[bool]:
+    # Sync PBX-reported id/expiry onto sub. True if listed, False if missing,
+    # None if the listing is unavailable or does not cover this user
+    if pbx_index is None or not covered:
+        return None
+
+    p = pbx_index.get((sub.user, sub.subscription_model.lower(), sub.post_url))
+    if p is None:
+        return False
+    if p.id:
+        sub.pbx_subscription_id = p.id
+    pbx_expires_at = p.expires_at
+    if pbx_expires_at:
+        sub.pbx_expires_at = pbx_expires_at
+        sub.expires_at = pbx_expires_at
+    return True
+
+
+def renewal_reason(
+    sub: Subscription, pbx_listed: Optional[bool] = None
+) -> Optional[str]:
+    # Why renewal is due (missing on PBX, expiring soon or duration mismatch),
+    # None if not due
     now = datetime.now(timezone.utc)
-    standard_duration = timedelta(days=settings.SUBSCRIPTION_DURATION_DAYS)
+    # Lifetimes are jittered short of the standard duration on purpose
+    shortest_lifetime = timedelta(
+        days=settings.SUBSCRIPTION_DURATION_DAYS,
+        hours=-settings.SUBSCRIPTION_EXPIRY_JITTER_HOURS,
+    )
     renewal_window = timedelta(hours=settings.SUBSCRIPTION_RENEWAL_WINDOW_HOURS)
     expires_at = ensure_utc(sub.expires_at)
 
+    if pbx_listed is False:
+        return "missing on PBX"
     if not expires_at:
-        should_renew = True
-    else:
-        time_left = expires_at - now
-        if time_left < renewal_window:
-            should_renew = True
-        elif time_left < (standard_duration - renewal_window):
-            logger.info(
-                f"Subscription {sub.id} does not meet standard {settings.SUBSCRIPTION_DURATION_DAYS} day duration. Forcing renewal."
-            )
-            should_renew = True
-        else:
-            should_renew = False
+        return "no known expiry"
+
+    time_left = expires_at - now
+    if time_left < renewal_window:
+        return "expiring soon"
+    # Stored expiry is only an estimate when the PBX state is unknown
+    if pbx_listed is None and time_left < (shortest_lifetime - renewal_window):
+        return (
+            f"does not meet standard {settings.SUBSCRIPTION_DURATION_DAYS} "
+            "day duration"
+        )
+    return None
+
 
-    if not should_renew:
+async def renew_subscription(
+    db: AsyncSession,
+    sub: Subscription,
+    ns_client: NSClient,
+    known_users: Optional[Set[str]] = None,
+    pbx_listed: Optional[bool] = None,
+    early: bool = False,
+) -> bool:
+    # Renew PBX subscription if missing, expiring soon or duration mismatch,
+    # or ahead of time when picked to flatten renewal load
+    reason = renewal_reason(sub, pbx_listed) or (
+        "early, to flatten renewal load" if early else None
+    )
+    if not reason:
         return True
 
-    logger.info(f"Renewing subscription {sub.id} for {sub.user} @ {sub.domain}")
+    logger.info(
+        f"Renewing subscription {sub.id} for {sub.user} @ {sub.domain} ({reason})"
+    )
     try:
-        if not await check_user_existence(db, sub, ns_client):
+        if not await check_user_existence(db, sub, ns_client, known_users):
             return False
 
-        expires_seconds = int(standard_duration.total_seconds())
-        await ns_client.create_subscription(
+        expires_seconds = renewal_policy.subscription_lifetime_seconds()
+        pbx_resp = await ns_client.create_subscription(
             domain=sub.domain,
             user=sub.user,
             model=sub.subscription_model,
@@ -204,10 +442,12 @@ async def renew_subscription(
             expires=expires_seconds,
         )
 
-        sub.expires_at = datetime.now(timezone.utc) + standard_duration
-        sub.maintenance_status = "success"
-        sub.maintenance_message = "Subscription renewed successfully"
-        sub.last_maintenance_attempt = datetime.now(timezone.utc)
+        pbx_id = extract_subscription_id(pbx_resp)
+        if pbx_id:
+            sub.pbx_subscription_id = pbx_id
+        sub.expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_seconds)
+        sub.pbx_expires_at = sub.expires_at
+        record_success(sub, "Subscription renewed successfully")
 
         await create_audit_log(
             db,
@@ -220,11 +460,11 @@ async def renew_subscription(
         )
         await db.commit()
         return True
+    except CallBudgetExceeded:
+        raise
     except Exception as e:
         logger.error(f"Failed to renew subscription {sub.id}: {e}")
-        sub.maintenance_status = "failed"
-        sub.maintenance_message = f"Renewal failed: {str(e)}"
-        sub.last_maintenance_attempt = datetime.now(timezone.utc)
+        record_failure(sub, f"Renewal failed: {str(e)}")
 
         await create_audit_log(
             db,
@@ -239,8 +479,11 @@ async def renew_subscription(
         return False
 
 
-async def run_maintenance(db: AsyncSession) -> None:
-    # Main maintenance loop: refresh tokens and renew subscriptions
+async def run_maintenance(db: AsyncSession, budget: Optional[RunBudget] = None) -> None:
+    # Main maintenance loop: refresh tokens and renew subscriptions. Each pass
+    # resumes after its checkpoint, so a run cut short by the budget (or a
+    # crash) is continued by the next one instead of starting over.
+    budget = budget or RunBudget()
     async with httpx.AsyncClient(timeout=30.0) as http_client:
         stmt_cred = select(OAuthCredential).where(
             OAuthCredential.maintenance_status != "failed_permanent"
@@ -249,21 +492,43 @@ async def run_maintenance(db: AsyncSession) -> None:
         credentials = result_cred.scalars().all()
 
         logger.info(f"Checking {len(credentials)} credentials for refresh...")
-        for cred in credentials:
+        cred_checkpoint = await get_maintenance_checkpoint(db, "credentials")
+        cred_order = resume_order(credentials, credential_key, cred_checkpoint.position)
+        for done, cred in enumerate(cred_order):
+            if budget.exhausted():
+                logger.warning(
+                    f"Run budget spent after {done} of {len(cred_order)} credentials; "
+                    "the next run resumes there"
+                )
+                await db.commit()
+                return
+            # Backed-off credentials are skipped inside refresh_credential
             await refresh_credential(db, cred)
+            cred_checkpoint.position = list(credential_key(cred))
+        await db.commit()
 
         stmt_sub = select(Subscription).where(Subscription.status == "active")
         result_sub = await db.execute(stmt_sub)
-        subscriptions = result_sub.scalars().all()
+        now = datetime.now(timezone.utc)
+        subscriptions = []
+        backing_off = 0
+        for sub in result_sub.scalars().all():
+            if retry_eligible(sub, now):
+                subscriptions.append(sub)
+            else:
+                backing_off += 1
 
         logger.info(
-            f"Checking {len(subscriptions)} active subscriptions for renewal..."
+            f"Checking {len(subscriptions)} active subscriptions for renewal "
+            f"({backing_off} waiting out retry backoff)..."
         )
+        early = plan_early_renewals(subscriptions)
 
         cred_map: Dict[Tuple[str, str, str], OAuthCredential] = {
             (c.api_server, c.domain, c.user): c for c in credentials
         }
         clients: Dict[Tuple[str, str, str], NSClient] = {}
+        by_domain: Dict[Tuple[str, str], List[Tuple[Subscription, NSClient]]] = {}
 
         for sub in subscriptions:
             cred_key = (sub.api_server, sub.domain, sub.user)
@@ -271,7 +536,8 @@ async def run_maintenance(db: AsyncSession) -> None:
 
             if not cred_obj or not cred_obj.access_token:
                 logger.warning(
-                    f"No valid credential for subscription {sub.id}. Archiving orphaned subscription."
+                    f"No valid credential for subscription {sub.id}. "
+                    "Archiving orphaned subscription."
                 )
                 sub.status = "archived"
                 sub.maintenance_status = "archived"
@@ -292,18 +558,235 @@ async def run_maintenance(db: AsyncSession) -> None:
 
             if cred_obj.maintenance_status == "failed_permanent":
                 logger.warning(
-                    f"Skipping subscription {sub.id} due to permanently failed credential."
+                    f"Skipping subscription {sub.id} due to permanently "
+                    "failed credential."
                 )
-                sub.maintenance_status = "failed"
-                sub.maintenance_message = (
-                    f"Credential failed: {cred_obj.maintenance_message}"
+                record_failure(
+                    sub, f"Credential failed: {cred_obj.maintenance_message}"
                 )
-                sub.last_maintenance_attempt = datetime.now(timezone.utc)
                 await db.commit()
                 continue
 
             if cred_key not in clients:
-                clients[cred_key] = NSClient(
-                    token=cred_obj.access_token, client=http_client
+                clients[cred_key] = credential_client(cred_obj, http_client)
+            by_domain.setdefault((sub.api_server, sub.domain), []).append(
+                (sub, clients[cred_key])
+            )
+
+        # Domains sharing an urgency are taken in turn, starting after the
+        # one the previous run reached
+        sub_checkpoint = await get_maintenance_checkpoint(db, "subscriptions")
+        queues = resume_order(
+            [DomainQueue(key, work) for key, work in sorted(by_domain.items())],
+            lambda queue: queue.key,
+            sub_checkpoint.position,
+        )
+        await renew_fairly(db, queues, early, budget, sub_checkpoint)
+
+        await db.commit()
+        logger.info(f"Maintenance pass finished in {budget.elapsed():.0f}s")
+
+
+# Renewal queued for a domain: (urgency, subscription, client, pbx_listed)
+QueuedRenewal = Tuple[datetime, Subscription, NSClient, Optional[bool]]
+
+
+class DomainQueue:
+    # One domain's share of a maintenance run. Its PBX listing is synced when
+    # the scheduler first reaches it; due renewals then queue most urgent first.
+    def __init__(self, key: Tuple[str, str], work: List[Tuple[Subscription, NSClient]]):
+        self.key = key
+        self.work = work
+        self.loaded = False
+        self.due: Deque[QueuedRenewal] = deque()
+        self.known_users: Optional[Set[str]] = None
+        self.renewed = 0
+        self.deferred = 0
+        # Until the listing is in, stored expiry is the best guess
+        self.urgency = min(
+            renewal_policy.renewal_urgency(ensure_utc(sub.expires_at))
+            for sub, _ in work
+        )
+
+    @property
+    def domain(self) -> str:
+        return self.key[1]
+
+    def pending(self) -> bool:
+        return not self.loaded or bool(self.due)
+
+
+async def load_domain_queue(
+    db: AsyncSession, queue: DomainQueue, early: Set[int]
+) -> None:
+    # Sync the domain's PBX state onto its rows and queue what is due
+    work = queue.work
+    # PBX-reported expiry is the source of truth for renewal decisions
+    owner = work[0][0].user
+    pbx_subs = await fetch_domain_subscriptions(work[0][1], queue.domain)
+    # A user token may only see its own subscriptions; the listing covers
+    # the whole domain once it shows anyone else's
+    domain_wide = pbx_subs is not None and any(p.user != owner for p in pbx_subs)
+    pbx_index = index_pbx_subscriptions(pbx_subs) if pbx_subs is not None else None
+    due: List[QueuedRenewal] = []
+    for sub, ns_client in work:
+        pbx_listed = apply_pbx_state(
+            sub, pbx_index, covered=domain_wide or sub.user == owner
+        )
+        if renewal_reason(sub, pbx_listed) or sub.id in early:
+            urgency = renewal_policy.renewal_urgency(
+                ensure_utc(sub.expires_at), missing=pbx_listed is False
+            )
+            due.append((urgency, sub, ns_client, pbx_listed))
+
+    # Persist synced expiry for subscriptions that need no renewal
+    await db.commit()
+
+    due.sort(key=lambda item: (item[0], item[1].id))
+    queue.due = deque(due)
+    queue.loaded = True
+    if due:
+        queue.urgency = due[0][0]
+        logger.info(
+            f"Queued {len(due)} of {len(work)} subscriptions in {queue.domain} "
+            "for renewal"
+        )
+
+
+async def renew_fairly(
+    db: AsyncSession,
+    queues: List[DomainQueue],
+    early: Set[int],
+    budget: RunBudget,
+    checkpoint: MaintenanceCheckpoint,
+) -> None:
+    # Weighted round robin over per-domain queues, so one large tenant cannot
+    # spend the whole run's budget. The first round gives every domain its
+    # minimum share, domains with overdue renewals first, each group in
+    # rotation order so an overloaded run still reaches every domain over a
+    # few runs. Later rounds go most urgent first, and domains still overdue
+    # take a weighted quantum. Work left when the budget runs out stays due.
+    rounds = 0
+    while True:
+        active = [queue for queue in queues if queue.pending()]
+        if not active:
+            break
+        if budget.exhausted():
+            unchecked = sum(1 for q in queues if not q.loaded)
+            logger.warning(
+                f"Run budget spent in round {rounds}; "
+                f"{sum(len(q.due) for q in queues)} queued renewals and "
+                f"{unchecked} unchecked domains carry over to the next run"
+            )
+            return
+        rounds += 1
+        now = datetime.now(timezone.utc)
+        # Stable sorts: ties keep the rotation order
+        if rounds == 1:
+            active.sort(key=lambda queue: queue.urgency > now)
+        else:
+            active.sort(key=lambda queue: queue.urgency)
+
+        for queue in active:
+            if budget.exhausted():
+                break
+
+            if not queue.loaded:
+                await load_domain_queue(db, queue, early)
+                checkpoint.position = list(queue.key)
+                if not queue.due:
+                    continue
+                # One user directory fetch per domain instead of one lookup
+                # per renewal
+                queue.known_users = await fetch_domain_users(
+                    queue.due[0][2], queue.domain
                 )
-            await renew_subscription(db, sub, clients[cred_key])
+
+            quantum = renewal_policy.domain_quantum(queue.urgency, now, rounds == 1)
+            for _ in range(quantum):
+                if not queue.due or budget.exhausted():
+                    break
+                _, sub, ns_client, pbx_listed = queue.due[0]
+                try:
+                    await renew_subscription(
+                        db,
+                        sub,
+                        ns_client,
+                        queue.known_users,
+                        pbx_listed,
+                        sub.id in early,
+                    )
+                except CallBudgetExceeded as e:
+                    # Not counted as a failure: the rest wait for the next run
+                    logger.warning(
+                        f"{e.detail}; {len(queue.due)} renewals in {queue.domain} "
+                        "deferred to the next run"
+                    )
+                    queue.deferred = len(queue.due)
+                    queue.due.clear()
+                    break
+                queue.due.popleft()
+                queue.renewed += 1
+            if queue.due:
+                queue.urgency = queue.due[0][0]
+
+    served = [queue for queue in queues if queue.renewed]
+    if served:
+        logger.info(
+            f"Renewed {sum(q.renewed for q in served)} subscriptions across "
+            f"{len(served)} domains in {rounds} rounds"
+        )
+    for queue in queues:
+        usage = NSClient.budget.usage(queue.domain)
+        rejected = sum(op["rejected"] for op in usage["operations"].values())
+        if queue.deferred or rejected:
+            logger.warning(
+                f"{queue.domain}: {usage['used']} PBX calls in the last "
+                f"{usage['window_seconds']}s (budget {usage['limit'] or 'unlimited'}), "
+                f"{rejected} refused this process, {queue.deferred} renewals deferred"
+            )
+
+
+def plan_early_renewals(subscriptions: List[Subscription]) -> Set[int]:
+    # Picks this run's early renewals and logs the projected load it smooths
+    now = datetime.now(timezone.utc)
+    expiries = {s.id: ensure_utc(s.expires_at) for s in subscriptions}
+    early = renewal_policy.pick_early_renewals(expiries, now)
+
+    hourly = renewal_policy.projected_histogram(
+        expiries.values(), now, renewal_policy.cycle_hours()
+    )
+    mean = len(subscriptions) / len(hourly)
+    logger.info(
+        f"Projected renewals: peak {max(hourly)}/h vs mean {mean:.1f}/h over "
+        f"{len(hourly)} hours; renewing {len(early)} early "
+        f"(target {renewal_policy.run_target(len(subscriptions))} per run)"
+    )
+    return early
+
+
+async def run_health_recount(
+    db: AsyncSession, budget: Optional[RunBudget] = None
+) -> None:
+    # Periodic full recount of domain_health to correct any drift in the
+    # trigger-kept counts, one short transaction per domain, least recently
+    # recounted first; drifted domains are announced so caches refresh
+    budget = budget or RunBudget()
+    domains = await get_recount_domains(db)
+    drifted = []
+    for done, (api_server, domain) in enumerate(domains):
+        if budget.exhausted():
+            logger.warning(
+                f"Run budget spent; {len(domains) - done} domains left to recount"
+            )
+            break
+        if await recount_one_domain_health(db, api_server, domain):
+            drifted.append((api_server, domain))
+
+    if drifted:
+        logger.warning(
+            f"Corrected domain_health drift in {len(drifted)} domains: "
+            + ", ".join(domain for _, domain in drifted)
+        )
+        await publish_domain_changes(db, "domain_health", drifted)
+        await db.commit()
@@ -1,14 +1,31 @@
 from pydantic import BaseModel, Field, ConfigDict
 from typing import Optional
-from sqlalchemy import String, Integer, DateTime, Text, UniqueConstraint
+from sqlalchemy import (
+    JSON,
+    BigInteger,
+    Boolean,
+    DateTime,
+    FetchedValue,
+    ForeignKey,
+    Index,
+    Integer,
+    Sequence,
+    String,
+    Text,
+    UniqueConstraint,
+)
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from database import Base
 from security import encrypt_string, decrypt_string
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 # --- Database Models ---
 
+# Monotonic change cursor for subscriptions; a BEFORE UPDATE trigger
+# (see migration d2f8a6c1b953) draws a new value on every row change
+subscriptions_change_seq = Sequence("subscriptions_change_seq", metadata=Base.metadata)
+
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
@@ -35,6 +52,14 @@ class Subscription(Base):
         DateTime(timezone=True), onupdate=func.now()
     )
 
+    # PBX-side identity, captured on create/adopt and backfilled from listings
+    pbx_subscription_id: Mapped[Optional[str]] = mapped_column(
+        String, nullable=True, index=True
+    )
+    pbx_expires_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+
     # pending, success, failed, archived
     maintenance_status: Mapped[str] = mapped_column(
         String, default="pending", server_default="pending", index=True
@@ -43,6 +68,28 @@ class Subscription(Base):
         DateTime(timezone=True), nullable=True
     )
     maintenance_message: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # Consecutive failures and when maintenance may try again (None: now)
+    attempt_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0", nullable=False
+    )
+    next_attempt_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+
+    # Change feed: version from subscriptions_change_seq and the writing
+    # transaction id, both maintained by the database
+    change_version: Mapped[int] = mapped_column(
+        BigInteger,
+        server_default=subscriptions_change_seq.next_value(),
+        server_onupdate=FetchedValue(),
+        nullable=False,
+    )
+    change_xid: Mapped[int] = mapped_column(
+        BigInteger,
+        server_default=text("(pg_current_xact_id()::text::bigint)"),
+        server_onupdate=FetchedValue(),
+        nullable=False,
+    )
 
     __table_args__ = (
         UniqueConstraint(
@@ -53,13 +100,67 @@ class Subscription(Base):
             "post_url",
             name="_subscription_uc",
         ),
+        Index(
+            "ix_subscriptions_domain_change_version",
+            "api_server",
+            "domain",
+            "change_version",
+        ),
+        # Keyset pagination of /subscriptions/list by id and by user
+        Index("ix_subscriptions_domain_id", "api_server", "domain", "id"),
+        Index("ix_subscriptions_domain_user", "api_server", "domain", "user", "id"),
     )
+    # Fetch server-generated timestamps via RETURNING instead of a refresh
+    __mapper_args__ = {"eager_defaults": True}
 
     @property
     def source(self) -> str:
         return "db"
 
 
+class DomainHealth(Base):
+    # Per-domain subscription counts, kept current by statement-level triggers
+    # on subscriptions (see migration f3c8e2a9b417) and recounted by maintenance
+    __tablename__ = "domain_health"
+
+    api_server: Mapped[str] = mapped_column(String, primary_key=True)
+    domain: Mapped[str] = mapped_column(String, primary_key=True)
+
+    active_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    # Active subscriptions whose last maintenance attempt failed
+    failed_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    expired_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    archived_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    # Time-dependent, so only refreshed by the recount
+    expiring_soon_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0"
+    )
+
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    recounted_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    # Fresh value from subscriptions_change_seq on every committed write to
+    # the domain (see migration d9a3b6e4f215); the list/status validator
+    version: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
+
+
+class MaintenanceCheckpoint(Base):
+    # Where a time-boxed maintenance pass stopped; the next run resumes after
+    # `position` and wraps around, so every item is reached in turn
+    __tablename__ = "maintenance_checkpoints"
+
+    # credentials, subscriptions
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    # Sort key of the last item processed, e.g. [api_server, domain, id]
+    position: Mapped[Optional[list]] = mapped_column(JSON, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
 class OAuthCredential(Base):
     __tablename__ = "oauth_credentials"
 
@@ -94,10 +195,18 @@ class OAuthCredential(Base):
         DateTime(timezone=True), nullable=True
     )
     maintenance_message: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # Consecutive failures and when maintenance may try again (None: now)
+    attempt_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0", nullable=False
+    )
+    next_attempt_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
 
     __table_args__ = (
         UniqueConstraint("api_server", "domain", "user", name="_credential_uc"),
     )
+    __mapper_args__ = {"eager_defaults": True}
 
     @property
     def refresh_token(self) -> str:
@@ -138,6 +247,143 @@ class AuditLog(Base):
     )
 
 
+class ReconciliationRun(Base):
+    __tablename__ = "reconciliation_runs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    api_server: Mapped[str] = mapped_column(String, index=True, nullable=False)
+    domain: Mapped[str] = mapped_column(String, index=True, nullable=False)
+
+    # schedule, manual, job
+    trigger: Mapped[str] = mapped_column(String, nullable=False)
+    auto_repair: Mapped[bool] = mapped_column(
+        Boolean, default=False, server_default="false"
+    )
+    # running, completed, failed
+    status: Mapped[str] = mapped_column(
+        String, default="running", server_default="running", index=True
+    )
+
+    db_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    pbx_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    missing_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    unmanaged_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0"
+    )
+    expiry_drift_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0"
+    )
+    post_url_drift_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0"
+    )
+    repaired_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0"
+    )
+    message: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    started_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), index=True
+    )
+    finished_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+
+    __mapper_args__ = {"eager_defaults": True}
+
+
+class DriftReport(Base):
+    __tablename__ = "drift_reports"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    run_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("reconciliation_runs.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    api_server: Mapped[str] = mapped_column(String, index=True, nullable=False)
+    domain: Mapped[str] = mapped_column(String, index=True, nullable=False)
+    user: Mapped[str] = mapped_column(String, nullable=False)
+    subscription_model: Mapped[str] = mapped_column(String, nullable=False)
+    post_url: Mapped[str] = mapped_column(String, nullable=False)
+
+    # missing_on_pbx, unmanaged, expiry_mismatch, post_url_mismatch
+    drift_type: Mapped[str] = mapped_column(String, index=True, nullable=False)
+    subscription_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    pbx_subscription_id: Mapped[Optional[str]] = mapped_column(
+        String, nullable=True
+    )
+    db_expires_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    pbx_expires_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    pbx_post_url: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    repaired: Mapped[bool] = mapped_column(
+        Boolean, default=False, server_default="false"
+    )
+    details: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    api_server: Mapped[str] = mapped_column(String, index=True, nullable=False)
+    domain: Mapped[str] = mapped_column(String, index=True, nullable=False)
+    user: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+
+    # adopt_all, reconcile
+    kind: Mapped[str] = mapped_column(String, index=True, nullable=False)
+    # queued, running, completed, failed, cancelled
+    status: Mapped[str] = mapped_column(
+        String, default="queued", server_default="queued", index=True
+    )
+    params: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    result: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    message: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    # PBX bearer token the job acts with; cleared once the job finishes
+    _token: Mapped[Optional[str]] = mapped_column("token", Text, nullable=True)
+
+    progress_current: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0"
+    )
+    progress_total: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    cancel_requested: Mapped[bool] = mapped_column(
+        Boolean, default=False, server_default="false"
+    )
+    attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    started_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    finished_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+
+    __mapper_args__ = {"eager_defaults": True}
+
+    @property
+    def token(self) -> str:
+        return decrypt_string(self._token) if self._token else ""
+
+    @token.setter
+    def token(self, value: str):
+        self._token = encrypt_string(value) if value else None
+
+
 # --- API Models ---
 
 
@@ -170,3 +416,12 @@ class NSSubscription(BaseModel):
     expires: Optional[int] = None
 
     model_config = ConfigDict(populate_by_name=True)
+
+    @property
+    def expires_at(self) -> Optional[datetime]:
+        # PBX reports either an epoch timestamp or seconds remaining
+        if self.expires is None:
+            return None
+        if self.expires > 1_000_000_000:
+            return datetime.fromtimestamp(self.expires, tz=timezone.utc)
+        return datetime.now(timezone.utc) + timedelta(seconds=self.expires)
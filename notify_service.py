@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+from typing import Any, List, Optional, Set, Tuple
+import asyncpg
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import engine
+import cache
+import events_service
+
+logger = logging.getLogger(__name__)
+
+# Published by the notify_domain_change() trigger on subscriptions and
+# oauth_credentials, so writes from maintenance, crud or psql all count
+CHANGES_CHANNEL = "ns_domain_changes"
+
+PING_INTERVAL_SECONDS = 30
+MAX_RECONNECT_DELAY_SECONDS = 60
+
+
+async def publish_domain_changes(
+    db: AsyncSession, table: str, domains: List[Tuple[str, str]]
+) -> None:
+    # Same payload the triggers send, for writes that bypass them
+    for api_server, domain in domains:
+        payload = json.dumps({"t": table, "a": api_server, "d": domain})
+        await db.execute(select(func.pg_notify(CHANGES_CHANNEL, payload)))
+
+
+def listener_dsn() -> str:
+    # Plain libpq-style DSN for a dedicated asyncpg connection
+    return engine.url.set(drivername="postgresql").render_as_string(
+        hide_password=False
+    )
+
+
+class ChangeListener:
+    # Holds one LISTEN connection per process and fans notifications out
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        cache.set_notifications_live(False)
+
+    async def _run(self) -> None:
+        delay = 1
+        while True:
+            conn: Optional[asyncpg.Connection] = None
+            try:
+                conn = await asyncpg.connect(listener_dsn())
+                lost = asyncio.Event()
+                # Bound now: a late callback from an earlier connection must
+                # not end the current one
+                conn.add_termination_listener(lambda _, lost=lost: lost.set())
+                await conn.add_listener(CHANGES_CHANNEL, self._on_notify)
+                cache.set_notifications_live(True)
+                logger.info(f"Listening for changes on '{CHANGES_CHANNEL}'")
+                delay = 1
+
+                # Termination events miss silently dropped links; ping as well
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), PING_INTERVAL_SECONDS)
+                    except asyncio.TimeoutError:
+                        await asyncio.wait_for(conn.fetchval("SELECT 1"), 10)
+                logger.warning("Change listener connection lost")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Change listener unavailable: {e}")
+            finally:
+                cache.set_notifications_live(False)
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY_SECONDS)
+
+    def _on_notify(self, conn: Any, pid: int, channel: str, payload: str) -> None:
+        try:
+            change = json.loads(payload)
+            api_server, domain = change["a"], change["d"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed change notification: {payload!r}")
+            return
+
+        cache.invalidate_domain(api_server, domain)
+        if change.get("t") in ("subscriptions", "domain_health"):
+            task = asyncio.create_task(
+                events_service.broadcaster.refresh(api_server, domain)
+            )
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+
+listener = ChangeListener()
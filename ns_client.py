@@ -1,15 +1,34 @@
 import httpx
 import json
 import asyncio
-from typing import Optional, Any, List, Type, TypeVar, Dict
+import math
+import time
+from collections import deque
+from typing import (
+    Optional,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    List,
+    Tuple,
+    Type,
+    TypeVar,
+    Dict,
+)
 from fastapi import HTTPException
 from models import NSUser, NSSubscription
 import logging
 from pydantic import BaseModel
 from config import settings
+from serialization import list_adapter
 
 T = TypeVar("T", bound=BaseModel)
 
+# Given the access token the PBX just rejected, returns a current one (or None)
+TokenRefresher = Callable[[str], Awaitable[Optional[str]]]
+
 logger = logging.getLogger(__name__)
 
 
@@ -35,25 +54,131 @@ class AsyncRateLimiter:
             await asyncio.sleep(wait_time)
 
 
+class CallBudgetExceeded(HTTPException):
+    # A domain has used its PBX call budget for the window; the call was not
+    # sent. Reaches portal callers as a 429 with Retry-After.
+    def __init__(self, domain: str, operation: Optional[str], retry_after: float):
+        self.domain = domain
+        self.operation = operation
+        scope = f"{domain} ({operation})" if operation else domain
+        seconds = max(1, math.ceil(retry_after))
+        super().__init__(
+            status_code=429,
+            detail=f"PBX call budget for {scope} exhausted; retry in {seconds}s",
+            headers={"Retry-After": str(seconds)},
+        )
+
+
+class CallBudget:
+    # Sliding-window PBX call budgets per domain, and per domain and
+    # operation, shared by every client in the process (portal requests,
+    # maintenance, jobs). Keeps counters for the usage endpoint and logs.
+    def __init__(self):
+        self._windows: Dict[Tuple[str, Optional[str]], Deque[float]] = {}
+        self.calls: Dict[Tuple[str, str], int] = {}
+        self.rejected: Dict[Tuple[str, str], int] = {}
+
+    @staticmethod
+    def limit(domain: str, operation: Optional[str]) -> int:
+        # 0 means unlimited
+        if operation is not None:
+            return settings.NS_API_OPERATION_CALL_BUDGETS.get(operation, 0)
+        return settings.NS_API_DOMAIN_CALL_BUDGETS.get(
+            domain, settings.NS_API_DOMAIN_CALL_BUDGET
+        )
+
+    def _window(
+        self, domain: str, operation: Optional[str], now: float
+    ) -> Deque[float]:
+        window = self._windows.setdefault((domain, operation), deque())
+        horizon = now - settings.NS_API_BUDGET_WINDOW_SECONDS
+        while window and window[0] <= horizon:
+            window.popleft()
+        return window
+
+    def acquire(self, domain: str, operation: str) -> None:
+        # Count a call against both budgets, or raise without counting it
+        now = time.monotonic()
+        windows = []
+        for scope in (operation, None):
+            limit = self.limit(domain, scope)
+            window = self._window(domain, scope, now)
+            if limit > 0 and len(window) >= limit:
+                key = (domain, operation)
+                self.rejected[key] = self.rejected.get(key, 0) + 1
+                retry_after = window[0] + settings.NS_API_BUDGET_WINDOW_SECONDS - now
+                raise CallBudgetExceeded(domain, scope, retry_after)
+            windows.append(window)
+        for window in windows:
+            window.append(now)
+        self.calls[(domain, operation)] = self.calls.get((domain, operation), 0) + 1
+
+    def check(
+        self, domain: str, calls: Dict[str, int], total: Optional[int] = None
+    ) -> None:
+        # Raise unless every budget has room for these calls right now, so a
+        # batch is refused before any of it reaches the PBX. total is the
+        # domain-wide count when it is less than the sum (per-operation
+        # worst cases that cannot all happen together)
+        now = time.monotonic()
+        if total is None:
+            total = sum(calls.values())
+        needed: Dict[Optional[str], int] = {None: total, **calls}
+        for scope, count in needed.items():
+            limit = self.limit(domain, scope)
+            window = self._window(domain, scope, now)
+            overflow = len(window) + count - limit
+            if limit > 0 and count > 0 and overflow > 0:
+                # Wait until enough calls leave the window; a batch larger
+                # than the budget itself gets a full window
+                if overflow <= len(window):
+                    freed_at = window[overflow - 1] + settings.NS_API_BUDGET_WINDOW_SECONDS
+                    retry_after = freed_at - now
+                else:
+                    retry_after = settings.NS_API_BUDGET_WINDOW_SECONDS
+                raise CallBudgetExceeded(domain, scope, retry_after)
+
+    def usage(self, domain: str) -> Dict[str, Any]:
+        # Calls in the current window against each budget, plus totals since
+        # the process started
+        now = time.monotonic()
+        operations = {op for d, op in [*self.calls, *self.rejected] if d == domain}
+        operations.update(settings.NS_API_OPERATION_CALL_BUDGETS)
+        return {
+            "window_seconds": settings.NS_API_BUDGET_WINDOW_SECONDS,
+            "used": len(self._window(domain, None, now)),
+            "limit": self.limit(domain, None) or None,
+            "operations": {
+                op: {
+                    "used": len(self._window(domain, op, now)),
+                    "limit": self.limit(domain, op) or None,
+                    "total": self.calls.get((domain, op), 0),
+                    "rejected": self.rejected.get((domain, op), 0),
+                }
+                for op in sorted(operations)
+            },
+        }
+
+
 class NSClient:
     _limiter: Optional[AsyncRateLimiter] = None
+    budget = CallBudget()
 
     def __init__(
         self,
         token: str,
         client: Optional[httpx.AsyncClient] = None,
+        token_refresher: Optional[TokenRefresher] = None,
     ):
         if NSClient._limiter is None:
             NSClient._limiter = AsyncRateLimiter(
                 max_rate=settings.NS_API_MAX_REQUESTS_PER_SECOND
             )
 
-        self.token = token
         self.client = client
-        self.headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        }
+        # Only clients built from stored credentials can refresh on a 401
+        self.token_refresher = token_refresher
+        self.set_token(token)
         self.candidate_urls = []
 
         if not settings.NS_API_URL:
@@ -69,6 +194,13 @@ class NSClient:
         self.call_stats: Dict[str, int] = {}
         self.total_calls = 0
 
+    def set_token(self, token: str) -> None:
+        self.token = token
+        self.headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        }
+
     def _sanitize_log(self, data: Any) -> Any:
         # Mask sensitive fields in logs
         if isinstance(data, dict):
@@ -188,11 +320,53 @@ class NSClient:
             return token_data
 
     async def _request(
-        self, method: str, path: str, model: Optional[Type[T]] = None, **kwargs
+        self,
+        method: str,
+        path: str,
+        model: Optional[Type[T]] = None,
+        allow_not_found: bool = True,
+        operation: str = "other",
+        budget_domain: Optional[str] = None,
+        **kwargs,
     ) -> Any:
-        # Core request handler with rate limiting and failover
+        # A token revoked or expired mid-run is refreshed once and the call
+        # retried; concurrent 401s share one refresh via the refresher
+        sent_token = self.token
+        send = (method, path, model, allow_not_found, operation, budget_domain)
+        try:
+            return await self._send(*send, **kwargs)
+        except HTTPException as e:
+            if e.status_code != 401 or self.token_refresher is None:
+                raise
+            token = await self.token_refresher(sent_token)
+            if not token:
+                raise
+            logger.info(f"Retrying {method} {path} with a refreshed token")
+            self.set_token(token)
+            return await self._send(*send, **kwargs)
+
+    async def _send(
+        self,
+        method: str,
+        path: str,
+        model: Optional[Type[T]] = None,
+        allow_not_found: bool = True,
+        operation: str = "other",
+        budget_domain: Optional[str] = None,
+        **kwargs,
+    ) -> Any:
+        # Core request handler with call budgets, rate limiting and failover
         import re
 
+        # Over budget fails before queueing on the rate limiter; calls that
+        # can't be tied to a domain (identity lookups) are not budgeted
+        if budget_domain:
+            try:
+                self.budget.acquire(budget_domain, operation)
+            except CallBudgetExceeded as e:
+                logger.warning(f"Refused {method} {path}: {e.detail}")
+                raise
+
         if self._limiter:
             await self._limiter.acquire()
 
@@ -231,6 +405,10 @@ class NSClient:
                 if response.status_code < 500:
                     if response.status_code == 404:
                         logger.info(f"Resource not found (404) at {url}")
+                        if not allow_not_found:
+                            raise HTTPException(
+                                status_code=404, detail="Resource not found"
+                            )
                         return None
 
                 if response.status_code >= 400:
@@ -243,7 +421,7 @@ class NSClient:
                 try:
                     data = response.json()
                     if model and isinstance(data, list):
-                        return [model.model_validate(item) for item in data]
+                        return list_adapter(model).validate_python(data)
                     elif model and isinstance(data, dict):
                         return model.model_validate(data)
                     return data
@@ -262,26 +440,55 @@ class NSClient:
         logger.error(f"All API endpoints failed. Exceptions: {exceptions}")
         raise HTTPException(status_code=503, detail="Upstream PBX Unreachable")
 
-    async def _get_paginated(
+    async def _iter_paginated(
         self,
         path: str,
         model: Type[T],
+        operation: str,
+        budget_domain: str,
         limit: int = 1000,
-        max_items: int = 10000,
         **kwargs,
-    ) -> List[T]:
-        # Generic paginated GET handler
-        items: List[T] = []
+    ) -> AsyncIterator[List[T]]:
+        # Yields one page at a time so large listings stay in bounded memory
         start = 0
         while True:
             params = {"limit": limit, "start": start}
             params.update(kwargs)
 
-            batch = await self._request("GET", path, model=model, params=params)
+            batch = await self._request(
+                "GET",
+                path,
+                model=model,
+                operation=operation,
+                budget_domain=budget_domain,
+                params=params,
+            )
 
             if not batch:
                 break
 
+            yield batch
+
+            if len(batch) < limit:
+                break
+
+            start += limit
+
+    async def _get_paginated(
+        self,
+        path: str,
+        model: Type[T],
+        operation: str,
+        budget_domain: str,
+        limit: int = 1000,
+        max_items: int = 10000,
+        **kwargs,
+    ) -> List[T]:
+        # Generic paginated GET handler
+        items: List[T] = []
+        async for batch in self._iter_paginated(
+            path, model, operation, budget_domain, limit=limit, **kwargs
+        ):
             items.extend(batch)
 
             if len(items) > max_items:
@@ -290,15 +497,10 @@ class NSClient:
                     detail=f"Resource limit exceeded: >{max_items} items found at {path}",
                 )
 
-            if len(batch) < limit:
-                break
-
-            start += limit
-
         return items
 
     async def get_me(self) -> Dict[str, Any]:
-        return await self._request("GET", "/domains/~/users/~")
+        return await self._request("GET", "/domains/~/users/~", operation="get_me")
 
     async def get_current_user(self) -> NSUser:
         data = await self.get_me()
@@ -306,20 +508,56 @@ class NSClient:
 
     async def get_users(self, domain: str, **kwargs) -> List[NSUser]:
         return await self._get_paginated(
-            f"/domains/{domain}/users", model=NSUser, **kwargs
+            f"/domains/{domain}/users", NSUser, "list_users", domain, **kwargs
         )
 
     async def get_user(self, domain: str, user: str) -> Optional[NSUser]:
         return await self._request(
-            "GET", f"/domains/{domain}/users/{user}", model=NSUser
+            "GET",
+            f"/domains/{domain}/users/{user}",
+            model=NSUser,
+            operation="get_user",
+            budget_domain=domain,
         )
 
     async def get_subscriptions(self, domain: str, **kwargs) -> List[NSSubscription]:
         kwargs["domain"] = domain
         return await self._get_paginated(
-            "/subscriptions", model=NSSubscription, **kwargs
+            "/subscriptions", NSSubscription, "list_subscriptions", domain, **kwargs
+        )
+
+    async def get_subscriptions_page(
+        self, domain: str, start: int, limit: int, **kwargs
+    ) -> List[NSSubscription]:
+        # One slice of the listing, for callers that page it themselves
+        params = {"domain": domain, "start": start, "limit": limit}
+        params.update(kwargs)
+        return await self._request(
+            "GET",
+            "/subscriptions",
+            model=NSSubscription,
+            operation="list_subscriptions",
+            budget_domain=domain,
+            params=params,
         )
 
+    def iter_subscriptions(
+        self, domain: str, **kwargs
+    ) -> AsyncIterator[List[NSSubscription]]:
+        kwargs["domain"] = domain
+        return self._iter_paginated(
+            "/subscriptions", NSSubscription, "list_subscriptions", domain, **kwargs
+        )
+
+    async def find_subscription(
+        self, domain: str, user: str, model: str, post_url: str
+    ) -> Optional[NSSubscription]:
+        # Locate a PBX subscription by scanning the user's listing
+        for p in await self.get_subscriptions(domain=domain, user=user):
+            if p.model.lower() == model.lower() and p.post_url == post_url:
+                return p
+        return None
+
     async def create_subscription(
         self,
         domain: str,
@@ -341,7 +579,13 @@ class NSClient:
         payload.update(kwargs)
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Creating Subscription Payload: {json.dumps(payload)}")
-        return await self._request("POST", "/subscriptions", json=payload)
+        return await self._request(
+            "POST",
+            "/subscriptions",
+            operation="create_subscription",
+            budget_domain=domain,
+            json=payload,
+        )
 
     async def delete_subscription(
         self, subscription_id: str, domain: Optional[str] = None
@@ -351,7 +595,13 @@ class NSClient:
             kwargs["json"] = {"domain": domain}
 
         return await self._request(
-            "DELETE", f"/subscriptions/{subscription_id}", model=None, **kwargs
+            "DELETE",
+            f"/subscriptions/{subscription_id}",
+            model=None,
+            allow_not_found=False,
+            operation="delete_subscription",
+            budget_domain=domain,
+            **kwargs,
         )
 
     async def update_subscription(
@@ -360,5 +610,19 @@ class NSClient:
         payload = {"domain": domain}
         payload.update(kwargs)
         return await self._request(
-            "PUT", f"/subscriptions/{subscription_id}", json=payload
+            "PUT",
+            f"/subscriptions/{subscription_id}",
+            json=payload,
+            allow_not_found=False,
+            operation="update_subscription",
+            budget_domain=domain,
         )
+
+
+def extract_subscription_id(data: Any) -> Optional[str]:
+    # Pull the PBX subscription id out of a create/update response
+    if isinstance(data, list):
+        data = data[0] if data else None
+    if isinstance(data, dict) and data.get("id") is not None:
+        return str(data["id"])
+    return None
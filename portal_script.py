@@ -0,0 +1,109 @@
+import gzip
+import hashlib
+from functools import lru_cache
+from typing import Dict
+import brotli
+from fastapi import Request, Response
+from jinja2 import Environment
+from config import settings
+
+# Hashed bundles never change, so browsers keep them for a year without asking
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+LOADER_TEMPLATE = (
+    "(function(){{var s=document.createElement('script');"
+    "s.async=true;s.src='{src}';"
+    "(document.head||document.documentElement).appendChild(s);}})();\n"
+)
+
+
+def minify_js(source: str) -> str:
+    # Conservative: drops indentation, blank lines and comment-only lines but
+    # keeps line breaks so automatic semicolon insertion behaves as authored.
+    # The template has no template literals or line continuations to protect.
+    lines = []
+    in_block_comment = False
+    for raw in source.splitlines():
+        line = raw.strip()
+        if in_block_comment:
+            if "*/" in line:
+                in_block_comment = False
+            continue
+        if line.startswith("/*"):
+            in_block_comment = "*/" not in line
+            continue
+        if not line or line.startswith("//"):
+            continue
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+class StaticAsset:
+    # One immutable representation, with precompressed variants and a strong
+    # ETag per encoding so caches never confuse them
+    def __init__(self, body: str, cache_control: str):
+        self.identity = body.encode()
+        self.digest = hashlib.sha256(self.identity).hexdigest()[:16]
+        self.cache_control = cache_control
+        self.variants: Dict[str, bytes] = {
+            "br": brotli.compress(self.identity, quality=11),
+            "gzip": gzip.compress(self.identity, compresslevel=9, mtime=0),
+        }
+
+    def etag(self, encoding: str = "") -> str:
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+    def matches(self, request: Request) -> bool:
+        header = request.headers.get("if-none-match")
+        if not header:
+            return False
+        # Any encoding of the same digest is the same content
+        tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+        return "*" in tags or any(
+            self.etag(e) in tags for e in ("", *self.variants)
+        )
+
+    def respond(self, request: Request) -> Response:
+        # Picks the encoding itself, so it owns Vary; main.py keeps
+        # GZipMiddleware off these responses
+        accepted = request.headers.get("accept-encoding", "")
+        encoding = next((e for e in self.variants if e in accepted), "")
+        headers = {
+            "Cache-Control": self.cache_control,
+            "ETag": self.etag(encoding),
+            "Vary": "Accept-Encoding",
+        }
+
+        if self.matches(request):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            body = self.variants[encoding]
+        else:
+            body = self.identity
+        return Response(body, media_type="application/javascript", headers=headers)
+
+
+class PortalScript:
+    # The rendered portal script under its content-hashed URL, plus the small
+    # stable loader the PBX portal references
+    def __init__(self, env: Environment):
+        base = settings.PUBLIC_API_URL.rstrip("/")
+        rendered = env.get_template("portal_injection.js").render(
+            api_endpoint=f"{base}/subscriptions",
+            client_id=settings.NS_CLIENT_ID,
+            redirect_uri=f"{base}/receive-ns-redirect/",
+        )
+        self.bundle = StaticAsset(minify_js(rendered), IMMUTABLE_CACHE_CONTROL)
+        # Public URL of the bundle, including any path prefix of the API
+        self.url = f"{base}/portal-script.{self.bundle.digest}.js"
+        self.loader = StaticAsset(
+            LOADER_TEMPLATE.format(src=self.url),
+            f"public, max-age={settings.PORTAL_LOADER_MAX_AGE_SECONDS}",
+        )
+
+
+@lru_cache(maxsize=1)
+def get_portal_script(env: Environment) -> PortalScript:
+    # Rendered once per process; its inputs are fixed at startup
+    return PortalScript(env)
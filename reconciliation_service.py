@@ -0,0 +1,445 @@
+import logging
+import httpx
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, update, func
+from models import (
+    Subscription,
+    OAuthCredential,
+    ReconciliationRun,
+    DriftReport,
+    NSSubscription,
+)
+from ns_client import NSClient, extract_subscription_id
+from crud import create_audit_log
+from maintenance_service import RunBudget, credential_client, ensure_utc
+from renewal_policy import subscription_lifetime_seconds
+from jobs_service import JobContext, job_handler
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Expiry differences below this are clock/rounding noise, not drift
+EXPIRY_DRIFT_TOLERANCE = timedelta(minutes=5)
+
+# Rows buffered before a batched INSERT into drift_reports
+DRIFT_BATCH_SIZE = 500
+
+# Compact DB-side row kept in the hash table: (id, pbx id, expires_at, post_url)
+DBEntry = Tuple[int, Optional[str], Optional[datetime], str]
+JoinKey = Tuple[str, str, str]
+
+
+def join_key(user: str, model: str, post_url: str) -> JoinKey:
+    return (user, model.lower(), post_url)
+
+
+class DriftWriter:
+    # Buffers drift rows and local repairs and writes each batch in its own
+    # short transaction, so a long PBX listing never holds row locks or keeps
+    # a write transaction open (which would hold back the change feed)
+    def __init__(self, db: AsyncSession, run: ReconciliationRun):
+        self.db = db
+        self.run = run
+        self.buffer: List[Dict[str, Any]] = []
+        self.repairs: List[Dict[str, Any]] = []
+
+    async def add(self, drift_type: str, **fields: Any) -> None:
+        self.buffer.append(
+            {
+                "run_id": self.run.id,
+                "api_server": self.run.api_server,
+                "domain": self.run.domain,
+                "drift_type": drift_type,
+                **fields,
+            }
+        )
+        if len(self.buffer) >= DRIFT_BATCH_SIZE:
+            await self.flush()
+
+    async def repair(self, subscription_id: int, **values: Any) -> None:
+        # Local half of a repair, written with the next batch
+        self.repairs.append({"id": subscription_id, **values})
+        if len(self.repairs) >= DRIFT_BATCH_SIZE:
+            await self.flush()
+
+    async def flush(self) -> None:
+        # Also persists the run's counters so far. Commits.
+        if self.buffer:
+            await self.db.execute(insert(DriftReport), self.buffer)
+            self.buffer = []
+        if self.repairs:
+            await self.db.execute(update(Subscription), self.repairs)
+            self.repairs = []
+        await self.db.commit()
+
+
+async def load_db_index(
+    db: AsyncSession, api_server: str, domain: str
+) -> Tuple[Dict[JoinKey, DBEntry], Dict[str, JoinKey]]:
+    # Stream managed rows as plain tuples (no ORM identity map) into the hash table
+    stmt = select(
+        Subscription.id,
+        Subscription.user,
+        Subscription.subscription_model,
+        Subscription.post_url,
+        Subscription.pbx_subscription_id,
+        Subscription.expires_at,
+    ).where(
+        Subscription.api_server == api_server,
+        Subscription.domain == domain,
+        Subscription.status == "active",
+    )
+    by_key: Dict[JoinKey, DBEntry] = {}
+    by_pbx_id: Dict[str, JoinKey] = {}
+
+    result = await db.stream(stmt.execution_options(yield_per=1000))
+    async for row in result:
+        key = join_key(row.user, row.subscription_model, row.post_url)
+        by_key[key] = (
+            row.id,
+            row.pbx_subscription_id,
+            ensure_utc(row.expires_at),
+            row.post_url,
+        )
+        if row.pbx_subscription_id:
+            by_pbx_id[row.pbx_subscription_id] = key
+
+    return by_key, by_pbx_id
+
+
+async def repair_missing(
+    ns_client: NSClient, domain: str, key: JoinKey, entry: DBEntry
+) -> Optional[Dict[str, Any]]:
+    # Recreate a managed subscription that disappeared from the PBX; returns
+    # the local column values to record, None if the PBX refused
+    user, model, post_url = key
+    expires_seconds = subscription_lifetime_seconds()
+    try:
+        pbx_resp = await ns_client.create_subscription(
+            domain=domain,
+            user=user,
+            model=model,
+            url=post_url,
+            expires=expires_seconds,
+        )
+    except Exception as e:
+        logger.warning(f"Auto-repair failed to recreate subscription {entry[0]}: {e}")
+        return None
+
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_seconds)
+    return {
+        "pbx_subscription_id": extract_subscription_id(pbx_resp) or entry[1],
+        "expires_at": expires_at,
+        "pbx_expires_at": expires_at,
+    }
+
+
+async def repair_post_url(
+    ns_client: NSClient, domain: str, pbx_sub: NSSubscription, entry: DBEntry
+) -> bool:
+    # Point the PBX subscription back at the managed post_url
+    try:
+        await ns_client.update_subscription(
+            pbx_sub.id,
+            domain,
+            **{
+                "model": pbx_sub.model,
+                "post-url": entry[3],
+                "subscription-geo-support": "yes",
+            },
+        )
+    except Exception as e:
+        logger.warning(f"Auto-repair failed to update post_url of {pbx_sub.id}: {e}")
+        return False
+    return True
+
+
+async def reconcile_domain(
+    db: AsyncSession,
+    ns_client: NSClient,
+    api_server: str,
+    domain: str,
+    token_user: str,
+    auto_repair: bool = False,
+    trigger: str = "manual",
+) -> ReconciliationRun:
+    # Hash-join managed rows against the streamed PBX listing and record drift
+    run = ReconciliationRun(
+        api_server=api_server,
+        domain=domain,
+        trigger=trigger,
+        auto_repair=auto_repair,
+        status="running",
+    )
+    db.add(run)
+    await db.commit()
+    run_id = run.id
+
+    writer = DriftWriter(db, run)
+    try:
+        by_key, by_pbx_id = await load_db_index(db, api_server, domain)
+        run.db_count = len(by_key)
+        pbx_count = 0
+        domain_wide = False
+
+        async for page in ns_client.iter_subscriptions(domain=domain):
+            for p in page:
+                if not (p.user and p.model and p.post_url):
+                    continue
+                pbx_count += 1
+                if p.user != token_user:
+                    domain_wide = True
+                key = join_key(p.user, p.model, p.post_url)
+                pbx_expires_at = p.expires_at
+                entry = by_key.pop(key, None)
+
+                if entry is not None:
+                    db_expires_at = entry[2]
+                    if (
+                        pbx_expires_at
+                        and db_expires_at
+                        and abs(pbx_expires_at - db_expires_at)
+                        > EXPIRY_DRIFT_TOLERANCE
+                    ):
+                        run.expiry_drift_count += 1
+                        repaired = False
+                        if auto_repair:
+                            # PBX holds the real expiry; sync it locally
+                            await writer.repair(
+                                entry[0],
+                                expires_at=pbx_expires_at,
+                                pbx_expires_at=pbx_expires_at,
+                                pbx_subscription_id=p.id or entry[1],
+                            )
+                            repaired = True
+                            run.repaired_count += 1
+                        await writer.add(
+                            "expiry_mismatch",
+                            user=p.user,
+                            subscription_model=p.model,
+                            post_url=p.post_url,
+                            subscription_id=entry[0],
+                            pbx_subscription_id=p.id,
+                            db_expires_at=db_expires_at,
+                            pbx_expires_at=pbx_expires_at,
+                            repaired=repaired,
+                        )
+                    continue
+
+                # Same PBX id under a different post_url means the URL diverged
+                moved_key = by_pbx_id.get(p.id) if p.id else None
+                moved = by_key.pop(moved_key, None) if moved_key else None
+                if moved is not None:
+                    run.post_url_drift_count += 1
+                    repaired = False
+                    if auto_repair and await repair_post_url(
+                        ns_client, domain, p, moved
+                    ):
+                        repaired = True
+                        run.repaired_count += 1
+                    await writer.add(
+                        "post_url_mismatch",
+                        user=p.user,
+                        subscription_model=p.model,
+                        post_url=moved[3],
+                        subscription_id=moved[0],
+                        pbx_subscription_id=p.id,
+                        db_expires_at=moved[2],
+                        pbx_expires_at=pbx_expires_at,
+                        pbx_post_url=p.post_url,
+                        repaired=repaired,
+                    )
+                    continue
+
+                run.unmanaged_count += 1
+                await writer.add(
+                    "unmanaged",
+                    user=p.user,
+                    subscription_model=p.model,
+                    post_url=p.post_url,
+                    pbx_subscription_id=p.id,
+                    pbx_expires_at=pbx_expires_at,
+                )
+
+        run.pbx_count = pbx_count
+
+        # Whatever is left in the hash table was never seen on the PBX. A user
+        # token may only list its own subscriptions, so other users' rows are
+        # unverifiable unless the listing proved to be domain-wide
+        unverified = 0
+        for key, entry in by_key.items():
+            if not domain_wide and key[0] != token_user:
+                unverified += 1
+                continue
+            run.missing_count += 1
+            repaired = False
+            if auto_repair:
+                values = await repair_missing(ns_client, domain, key, entry)
+                if values is not None:
+                    await writer.repair(entry[0], **values)
+                    repaired = True
+                    run.repaired_count += 1
+            await writer.add(
+                "missing_on_pbx",
+                user=key[0],
+                subscription_model=key[1],
+                post_url=key[2],
+                subscription_id=entry[0],
+                pbx_subscription_id=entry[1],
+                db_expires_at=entry[2],
+                repaired=repaired,
+            )
+
+        await writer.flush()
+        if unverified:
+            run.message = (
+                f"PBX listing limited to {token_user}; "
+                f"{unverified} subscriptions of other users not verified"
+            )
+        run.status = "completed"
+    except Exception as e:
+        logger.error(f"Reconciliation failed for {domain}: {e}")
+        await db.rollback()
+        await db.execute(
+            update(ReconciliationRun)
+            .where(ReconciliationRun.id == run_id)
+            .values(
+                status="failed",
+                message=str(e),
+                finished_at=datetime.now(timezone.utc),
+            )
+        )
+        await db.commit()
+        failed_run = await db.get(
+            ReconciliationRun, run_id, populate_existing=True
+        )
+        assert failed_run is not None
+        return failed_run
+
+    run.finished_at = datetime.now(timezone.utc)
+
+    if run.repaired_count:
+        await create_audit_log(
+            db,
+            api_server,
+            domain,
+            "reconcile",
+            "subscription",
+            resource_id=run.id,
+            description=f"Reconciliation repaired {run.repaired_count} drifted subscriptions",
+        )
+
+    await db.commit()
+    logger.info(
+        f"Reconciled {domain}: {run.db_count} managed, {run.pbx_count} on PBX, "
+        f"{run.missing_count} missing, {run.unmanaged_count} unmanaged, "
+        f"{run.expiry_drift_count} expiry drift, {run.post_url_drift_count} post_url drift"
+    )
+    return run
+
+
+@job_handler("reconcile")
+async def reconcile_job(ctx: JobContext) -> Dict[str, Any]:
+    await ctx.progress(0, 1)
+    run = await reconcile_domain(
+        ctx.db,
+        ctx.client,
+        ctx.api_server,
+        ctx.domain,
+        token_user=ctx.user or "",
+        auto_repair=bool(ctx.params.get("auto_repair")),
+        trigger="job",
+    )
+    if run.status == "failed":
+        raise RuntimeError(run.message or "Reconciliation failed")
+    await ctx.progress(1, 1)
+    return {"run_id": run.id, "status": run.status}
+
+
+async def get_latest_run(
+    db: AsyncSession, api_server: str, domain: str
+) -> Optional[ReconciliationRun]:
+    stmt = (
+        select(ReconciliationRun)
+        .where(
+            ReconciliationRun.api_server == api_server,
+            ReconciliationRun.domain == domain,
+        )
+        .order_by(ReconciliationRun.started_at.desc())
+        .limit(1)
+    )
+    result = await db.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def get_drift_reports(
+    db: AsyncSession, run_id: int, limit: int = 500
+) -> List[DriftReport]:
+    stmt = (
+        select(DriftReport)
+        .where(DriftReport.run_id == run_id)
+        .order_by(DriftReport.id)
+        .limit(limit)
+    )
+    result = await db.execute(stmt)
+    return list(result.scalars().all())
+
+
+async def run_scheduled_reconciliation(
+    db: AsyncSession, budget: Optional[RunBudget] = None
+) -> None:
+    # Reconcile every domain with a working credential once per interval,
+    # stalest first so domains left over when the budget runs out go next time
+    budget = budget or RunBudget()
+    if settings.RECONCILIATION_INTERVAL_HOURS <= 0:
+        return
+
+    interval = timedelta(hours=settings.RECONCILIATION_INTERVAL_HOURS)
+    now = datetime.now(timezone.utc)
+
+    stmt_cred = select(OAuthCredential).where(
+        OAuthCredential.maintenance_status == "success"
+    )
+    result_cred = await db.execute(stmt_cred)
+    domain_creds: Dict[Tuple[str, str], OAuthCredential] = {}
+    for cred in result_cred.scalars().all():
+        if cred.access_token:
+            domain_creds.setdefault((cred.api_server, cred.domain), cred)
+
+    stmt_last = select(
+        ReconciliationRun.api_server,
+        ReconciliationRun.domain,
+        func.max(ReconciliationRun.started_at),
+    ).group_by(ReconciliationRun.api_server, ReconciliationRun.domain)
+    result_last = await db.execute(stmt_last)
+    last_runs = {(r[0], r[1]): ensure_utc(r[2]) for r in result_last.all()}
+
+    due = [
+        key
+        for key in domain_creds
+        if not last_runs.get(key) or now - last_runs[key] >= interval
+    ]
+    never = datetime.min.replace(tzinfo=timezone.utc)
+    due.sort(key=lambda key: last_runs.get(key) or never)
+
+    async with httpx.AsyncClient(timeout=30.0) as http_client:
+        for done, (api_server, domain) in enumerate(due):
+            if budget.exhausted():
+                logger.warning(
+                    f"Run budget spent; {len(due) - done} domains left to reconcile"
+                )
+                return
+
+            cred = domain_creds[(api_server, domain)]
+            ns_client = credential_client(cred, http_client)
+            await reconcile_domain(
+                db,
+                ns_client,
+                api_server,
+                domain,
+                token_user=cred.user,
+                auto_repair=settings.RECONCILIATION_AUTO_REPAIR,
+                trigger="schedule",
+            )
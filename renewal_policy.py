@@ -0,0 +1,120 @@
+import math
+import random
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set
+from config import settings
+
+# Load smoothing for PBX renewals and token refreshes. Cohorts created or
+# minted together would otherwise come due together every cycle; these keep
+# the per-run call volume close to the average.
+
+
+def subscription_lifetime_seconds() -> int:
+    # Standard duration less a bounded random offset, so a batch created or
+    # renewed together comes due spread over the jitter window
+    jitter = random.uniform(0, settings.SUBSCRIPTION_EXPIRY_JITTER_HOURS * 3600)
+    return settings.SUBSCRIPTION_DURATION_DAYS * 24 * 3600 - int(jitter)
+
+
+def token_refresh_lead(cred_id: int) -> timedelta:
+    # Stable per-credential extra lead, so tokens minted together are
+    # refreshed in different runs and drift apart from then on
+    spread = settings.TOKEN_REFRESH_JITTER_MINUTES * 60
+    offset = zlib.crc32(str(cred_id).encode()) % (spread + 1)
+    return timedelta(minutes=settings.TOKEN_REFRESH_WINDOW_MINUTES, seconds=offset)
+
+
+def retry_delay(attempt_count: int) -> timedelta:
+    # Exponential backoff after the given number of consecutive failures,
+    # capped, with the upper half randomised so items failing together (a PBX
+    # outage) do not all come back in the same run
+    base = settings.MAINTENANCE_RETRY_BASE_MINUTES * 60
+    cap = settings.MAINTENANCE_RETRY_MAX_HOURS * 3600
+    delay = min(cap, base * 2 ** max(0, min(attempt_count - 1, 32)))
+    return timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def renewal_due_at(expires_at: datetime) -> datetime:
+    return expires_at - timedelta(hours=settings.SUBSCRIPTION_RENEWAL_WINDOW_HOURS)
+
+
+def renewal_urgency(expires_at: Optional[datetime], missing: bool = False) -> datetime:
+    # When renewal falls due, for ordering; missing on the PBX or unknown
+    # expiry sorts ahead of everything
+    if missing or expires_at is None:
+        return datetime.min.replace(tzinfo=timezone.utc)
+    return renewal_due_at(expires_at)
+
+
+def domain_quantum(urgency: datetime, now: datetime, first_round: bool) -> int:
+    # Renewals a domain may take per scheduling round: the minimum share,
+    # weighted up after the first round while its most urgent renewal is due
+    share = max(1, settings.MAINTENANCE_DOMAIN_MIN_SHARE)
+    if not first_round and urgency <= now:
+        return share * max(1, settings.MAINTENANCE_URGENT_DOMAIN_WEIGHT)
+    return share
+
+
+def cycle_hours() -> int:
+    # One subscription duration in hours, at least one so projections and
+    # per-run targets over it stay defined for any configured duration
+    return max(1, settings.SUBSCRIPTION_DURATION_DAYS * 24)
+
+
+def projected_histogram(
+    expiries: Iterable[Optional[datetime]], now: datetime, hours: int
+) -> List[int]:
+    # Renewals due per hour over the next `hours` (at least one) from
+    # (UTC-aware) expiries. Overdue and unknown expiries land in the first hour.
+    hours = max(1, hours)
+    buckets = [0] * hours
+    for expires_at in expiries:
+        if expires_at is None:
+            buckets[0] += 1
+            continue
+        offset = (renewal_due_at(expires_at) - now).total_seconds() // 3600
+        if offset < hours:
+            buckets[max(0, int(offset))] += 1
+    return buckets
+
+
+def run_target(active_count: int) -> int:
+    # Renewals per maintenance run if load were perfectly flat
+    cycle_minutes = cycle_hours() * 60
+    runs_per_cycle = cycle_minutes / max(1, settings.MAINTENANCE_INTERVAL_MINUTES)
+    return math.ceil(active_count / max(1.0, runs_per_cycle))
+
+
+def pick_early_renewals(
+    expiries: Dict[int, Optional[datetime]], now: datetime
+) -> Set[int]:
+    # Subscription ids (keyed to their expiry) to renew ahead of time: a light
+    # run is filled up to the flat target from the heaviest upcoming hours
+    # within the horizon, busiest hour first
+    horizon = settings.RENEWAL_EARLY_HORIZON_HOURS
+    if horizon <= 0:
+        return set()
+
+    due_now = 0
+    upcoming: Dict[int, List[int]] = {}
+    for sub_id, expires_at in expiries.items():
+        offset = (
+            (renewal_due_at(expires_at) - now).total_seconds() / 3600
+            if expires_at
+            else 0
+        )
+        if offset <= 0:
+            due_now += 1
+        elif offset < horizon:
+            upcoming.setdefault(int(offset), []).append(sub_id)
+
+    spare = run_target(len(expiries)) - due_now
+    picked: Set[int] = set()
+    for _, bucket in sorted(upcoming.items(), key=lambda b: (-len(b[1]), b[0])):
+        if spare <= 0:
+            break
+        bucket.sort(key=lambda sub_id: expiries[sub_id])
+        picked.update(bucket[:spare])
+        spare -= min(spare, len(bucket))
+    return picked
@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import select
+from database import async_session_factory, engine
+from maintenance_service import ensure_utc
+from models import Subscription
+from config import settings
+import renewal_policy
+
+logging.basicConfig(
+    level=settings.LOG_LEVEL,
+    format="%(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+
+logger = logging.getLogger("renewal-report")
+
+BAR_WIDTH = 50
+
+
+async def main(hours: int, domain: Optional[str]):
+    # Projected PBX renewals per hour from stored expiry, to check that
+    # renewal load stays flat instead of arriving in cohorts
+    stmt = select(Subscription.expires_at).where(Subscription.status == "active")
+    if domain:
+        stmt = stmt.where(Subscription.domain == domain)
+    async with async_session_factory() as db:
+        result = await db.execute(stmt)
+        expiries = [ensure_utc(e) for e in result.scalars().all()]
+    await engine.dispose()
+
+    now = datetime.now(timezone.utc)
+    start = now.replace(minute=0, second=0, microsecond=0)
+    hourly = renewal_policy.projected_histogram(expiries, now, hours)
+    peak = max(hourly)
+    mean = sum(hourly) / hours
+    scale = BAR_WIDTH / peak if peak else 0
+
+    for i, count in enumerate(hourly):
+        hour = start + timedelta(hours=i)
+        logger.info(f"{hour:%Y-%m-%d %H:00}  {count:6d}  {'#' * round(count * scale)}")
+
+    logger.info(
+        f"\n{sum(hourly)} renewals in the next {hours}h "
+        f"({len(expiries) - sum(hourly)} later); mean {mean:.1f}/h, peak {peak}/h"
+        + (f" ({peak / mean:.1f}x mean)" if mean else "")
+    )
+    logger.info(
+        f"Flat target: {renewal_policy.run_target(len(expiries))} per "
+        f"{settings.MAINTENANCE_INTERVAL_MINUTES}-minute maintenance run"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Projected PBX subscription renewals per hour"
+    )
+    parser.add_argument(
+        "--hours",
+        type=int,
+        default=renewal_policy.cycle_hours(),
+        help="hours ahead to project (default: one subscription duration)",
+    )
+    parser.add_argument("--domain", help="limit to one domain")
+    args = parser.parse_args()
+    asyncio.run(main(max(1, args.hours), args.domain))
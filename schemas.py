@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, field_validator, ConfigDict
-from typing import Optional, Literal
+from typing import Annotated, Any, Dict, List, Optional, Literal, Union
 from datetime import datetime
 import ipaddress
 from urllib.parse import urlparse
@@ -52,6 +52,12 @@ class SubscriptionCreate(SubscriptionBase):
     pass
 
 
+class SubscriptionAdopt(SubscriptionCreate):
+    pbx_subscription_id: Optional[str] = Field(
+        None, description="PBX-side subscription id, if known"
+    )
+
+
 class SubscriptionUpdate(BaseModel):
     description: Optional[str] = None
     expires_at: Optional[datetime] = None
@@ -73,10 +79,204 @@ class SubscriptionResponse(SubscriptionBase):
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     source: Literal["db", "pbx"] = "db"
+    pbx_subscription_id: Optional[str] = None
+    pbx_expires_at: Optional[datetime] = None
 
     # Maintenance Tracking
     maintenance_status: Optional[str] = None
     last_maintenance_attempt: Optional[datetime] = None
     maintenance_message: Optional[str] = None
+    attempt_count: Optional[int] = None
+    next_attempt_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class SubscriptionPage(BaseModel):
+    items: List[SubscriptionResponse]
+    # Opaque; pass back with the same filters and sort for the next page
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+
+
+class SubscriptionChange(SubscriptionResponse):
+    change_version: int
+    # Archived rows are sent as tombstones so clients can drop them
+    deleted: bool = False
+
+
+class SubscriptionChangesResponse(BaseModel):
+    cursor: int
+    has_more: bool
+    changes: List[SubscriptionChange]
+
+
+# Upper bound on operations accepted by POST /subscriptions/bulk
+BULK_MAX_OPERATIONS = 1000
+
+
+class BulkCreateOperation(BaseModel):
+    action: Literal["create"]
+    subscription: SubscriptionCreate
+
+
+class BulkUpdateOperation(BaseModel):
+    action: Literal["update"]
+    id: int
+    changes: SubscriptionUpdate
+
+
+class BulkDeleteOperation(BaseModel):
+    action: Literal["delete"]
+    id: int
+
+
+BulkOperation = Annotated[
+    Union[BulkCreateOperation, BulkUpdateOperation, BulkDeleteOperation],
+    Field(discriminator="action"),
+]
+
+
+class BulkRequest(BaseModel):
+    operations: List[BulkOperation] = Field(
+        ..., min_length=1, max_length=BULK_MAX_OPERATIONS
+    )
+
+
+class BulkItemResult(BaseModel):
+    index: int
+    action: Literal["create", "update", "delete"]
+    status: Literal["ok", "error"]
+    subscription: Optional[SubscriptionResponse] = None
+    error: Optional[str] = None
+
+
+class BulkResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkItemResult]
+
+
+class AdoptAllSkipped(BaseModel):
+    user: str
+    subscription_model: str
+    post_url: str
+    pbx_subscription_id: Optional[str] = None
+    reason: str
+
+
+class AdoptAllResponse(BaseModel):
+    dry_run: bool
+    unmanaged_count: int
+    adopted_count: int
+    subscriptions: List[SubscriptionResponse]
+    skipped: List[AdoptAllSkipped] = []
+
+
+class AuthStatusResponse(BaseModel):
+    has_auth: bool
+    user: str
+    domain: str
+
+
+class BootstrapConfig(BaseModel):
+    client_id: str
+    redirect_uri: str
+    subscription_duration_days: int
+
+
+class BootstrapResponse(BaseModel):
+    # Everything the Subscriptions tab needs for its first render
+    auth: AuthStatusResponse
+    health: Dict[str, Any]
+    # First page of /subscriptions/list (default sort and filters)
+    subscriptions: SubscriptionPage
+    config: BootstrapConfig
+
+
+class DomainHealthResponse(BaseModel):
+    active_count: int = 0
+    failed_count: int = 0
+    expired_count: int = 0
+    archived_count: int = 0
+    expiring_soon_count: int = 0
+    updated_at: Optional[datetime] = None
+    recounted_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class CallBudgetUsage(BaseModel):
+    # Calls in the current window and the budget (None: unlimited); totals
+    # since the serving process started
+    used: int = 0
+    limit: Optional[int] = None
+    total: int = 0
+    rejected: int = 0
+
+
+class CallBudgetResponse(BaseModel):
+    window_seconds: int
+    used: int = 0
+    limit: Optional[int] = None
+    operations: Dict[str, CallBudgetUsage] = {}
+
+
+class DriftReportResponse(BaseModel):
+    id: int
+    user: str
+    subscription_model: str
+    post_url: str
+    drift_type: str
+    subscription_id: Optional[int] = None
+    pbx_subscription_id: Optional[str] = None
+    db_expires_at: Optional[datetime] = None
+    pbx_expires_at: Optional[datetime] = None
+    pbx_post_url: Optional[str] = None
+    repaired: bool = False
+    details: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ReconciliationRunResponse(BaseModel):
+    id: int
+    api_server: str
+    domain: str
+    trigger: str
+    auto_repair: bool
+    status: str
+    db_count: int
+    pbx_count: int
+    missing_count: int
+    unmanaged_count: int
+    expiry_drift_count: int
+    post_url_drift_count: int
+    repaired_count: int
+    message: Optional[str] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    drift: List[DriftReportResponse] = []
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    status: str
+    api_server: str
+    domain: str
+    user: Optional[str] = None
+    params: Optional[Dict[str, Any]] = None
+    result: Optional[Dict[str, Any]] = None
+    message: Optional[str] = None
+    progress_current: int = 0
+    progress_total: Optional[int] = None
+    cancel_requested: bool = False
+    attempts: int = 0
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
 
     model_config = ConfigDict(from_attributes=True)
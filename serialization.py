@@ -0,0 +1,38 @@
+from functools import lru_cache
+from operator import attrgetter
+from typing import Any, Dict, List, Type
+import pydantic_core
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+from models import Subscription
+from schemas import SubscriptionResponse
+
+# Fields of the public subscription shape, read straight off ORM rows
+SUBSCRIPTION_FIELDS = tuple(SubscriptionResponse.model_fields)
+_subscription_values = attrgetter(*SUBSCRIPTION_FIELDS)
+
+
+class FastJSONResponse(Response):
+    # Renders plain data in pydantic's Rust encoder, so the bytes match what
+    # response_model would have produced (datetimes included). Endpoints
+    # returning it skip FastAPI's response validation; keep response_model on
+    # the route for the OpenAPI schema only.
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return pydantic_core.to_json(content)
+
+
+@lru_cache(maxsize=None)
+def list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    # Built once per model: validating or dumping a whole list is then one
+    # call into pydantic-core instead of a Python loop
+    return TypeAdapter(List[model])
+
+
+def subscription_dict(sub: Subscription) -> Dict[str, Any]:
+    # Stored rows were validated on the way in; validating them again per
+    # response only re-runs the post_url checks
+    return dict(zip(SUBSCRIPTION_FIELDS, _subscription_values(sub), strict=True))
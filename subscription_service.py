@@ -0,0 +1,684 @@
+import asyncio
+import base64
+import json
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Subscription, NSUser, NSSubscription
+from ns_client import CallBudgetExceeded, NSClient, extract_subscription_id
+from schemas import (
+    AdoptAllResponse,
+    AdoptAllSkipped,
+    BulkCreateOperation,
+    BulkDeleteOperation,
+    BulkItemResult,
+    BulkOperation,
+    BulkUpdateOperation,
+    SubscriptionCreate,
+    SubscriptionResponse,
+    SubscriptionUpdate,
+)
+from jobs_service import JobContext, job_handler
+from renewal_policy import subscription_lifetime_seconds
+from serialization import subscription_dict
+from config import settings
+import crud
+
+logger = logging.getLogger(__name__)
+
+# Rows per upsert/commit when adopting a whole domain
+ADOPT_ALL_CHUNK_SIZE = 500
+
+
+# Sort keys for /subscriptions/list; each is backed by an (api_server, domain,
+# key) index so pages are index range scans
+LIST_SORT_KEYS = {
+    "id": Subscription.id,
+    "user": Subscription.user,
+    "change_version": Subscription.change_version,
+}
+# PBX listing slices read per page at most, so a run of managed rows on the
+# PBX side cannot turn one page into a full scan
+LIST_MAX_PBX_FETCHES = 5
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+
+
+def encode_list_cursor(position: Dict[str, Any]) -> str:
+    raw = json.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_list_cursor(
+    cursor: Optional[str], sort: str, source: Optional[str]
+) -> Dict[str, Any]:
+    # Where a page starts: {"p": "db", "k": last key} over managed rows, then
+    # {"p": "pbx", "o": offset} into the PBX listing for unmanaged ones
+    if not cursor:
+        if source == "pbx":
+            return {"s": sort, "p": "pbx", "o": 0}
+        return {"s": sort, "p": "db"}
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded))
+    except ValueError:
+        position = None
+    if not _valid_list_position(position, sort):
+        raise HTTPException(
+            status_code=400, detail="Invalid cursor for this sort order"
+        )
+    return position
+
+
+def _valid_list_position(position: Any, sort: str) -> bool:
+    # Cursors come back from clients, so every field is checked before use:
+    # "o" a non-negative offset, "k" the sort column value plus the id
+    # tie-breaker (just the id when sorting by id)
+    if not isinstance(position, dict) or position.get("s") != sort:
+        return False
+    if position.get("p") == "pbx":
+        offset = position.get("o")
+        return type(offset) is int and offset >= 0
+    if position.get("p") != "db":
+        return False
+    if "k" not in position:
+        return True
+
+    sort_column = LIST_SORT_KEYS[sort.lstrip("-")]
+    types = [sort_column.type.python_type]
+    if sort_column is not Subscription.id:
+        types.append(int)
+    key = position["k"]
+    return (
+        isinstance(key, list)
+        and len(key) == len(types)
+        and all(type(value) is t for value, t in zip(key, types, strict=True))
+    )
+
+
+def unmanaged_response(
+    api_server: str, domain: str, p: NSSubscription
+) -> SubscriptionResponse:
+    return SubscriptionResponse(
+        user=p.user,
+        subscription_model=p.model,
+        post_url=p.post_url,
+        expires_at=None,
+        description="Unmanaged (PBX Only)",
+        status="active",
+        source="pbx",
+        api_server=api_server,
+        domain=domain,
+        id=None,
+        pbx_subscription_id=p.id,
+        pbx_expires_at=p.expires_at,
+    )
+
+
+async def list_subscriptions_page(
+    db: AsyncSession,
+    client: NSClient,
+    api_server: str,
+    domain: str,
+    position: Dict[str, Any],
+    limit: int,
+    user: Optional[str] = None,
+    subscription_model: Optional[str] = None,
+    maintenance_status: Optional[str] = None,
+    source: Optional[str] = None,
+) -> Dict[str, Any]:
+    # Managed rows first, by keyset over the sort index, then unmanaged PBX
+    # rows. The PBX is only called once the managed rows are exhausted, and
+    # only for the slice a page needs. Returns the SubscriptionPage shape as
+    # plain data, ready for FastJSONResponse.
+    sort = position["s"]
+    # PBX rows carry no maintenance status, so that filter ends the list at DB rows
+    include_pbx = source != "db" and not maintenance_status
+
+    if position["p"] == "db":
+        sort_column = LIST_SORT_KEYS[sort.lstrip("-")]
+        after = tuple(position["k"]) if "k" in position else None
+        rows = await crud.get_subscriptions_page(
+            db,
+            api_server,
+            domain,
+            sort_column,
+            sort.startswith("-"),
+            after,
+            limit + 1,
+            user=user,
+            subscription_model=subscription_model,
+            maintenance_status=maintenance_status,
+        )
+        items: List[Any] = [subscription_dict(r) for r in rows[:limit]]
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            key = [getattr(last, sort_column.key)]
+            if sort_column is not Subscription.id:
+                key.append(last.id)
+            next_position: Optional[Dict[str, Any]] = {"s": sort, "p": "db", "k": key}
+        elif include_pbx:
+            next_position = {"s": sort, "p": "pbx", "o": 0}
+        else:
+            next_position = None
+    else:
+        items, next_position = await _list_unmanaged_page(
+            db, client, api_server, domain, position, limit, user, subscription_model
+        )
+
+    return {
+        "items": items,
+        "next_cursor": encode_list_cursor(next_position) if next_position else None,
+        "has_more": next_position is not None,
+    }
+
+
+async def first_list_page(
+    db: AsyncSession, client: NSClient, api_server: str, domain: str
+) -> Dict[str, Any]:
+    # The default first page of /list. When the managed rows run out before
+    # the page is full, it is topped up from the PBX listing so a domain with
+    # few managed rows still shows its unmanaged ones on first render.
+    page = await list_subscriptions_page(
+        db,
+        client,
+        api_server,
+        domain,
+        decode_list_cursor(None, "id", None),
+        LIST_DEFAULT_LIMIT,
+    )
+    room = LIST_DEFAULT_LIMIT - len(page["items"])
+    if room <= 0 or not page["next_cursor"]:
+        return page
+
+    position = decode_list_cursor(page["next_cursor"], "id", None)
+    if position["p"] != "pbx":
+        return page
+    try:
+        rest = await list_subscriptions_page(
+            db, client, api_server, domain, position, room
+        )
+    except CallBudgetExceeded:
+        # Managed rows are ready; the client pages on into the PBX later
+        return page
+    return {
+        "items": page["items"] + rest["items"],
+        "next_cursor": rest["next_cursor"],
+        "has_more": rest["has_more"],
+    }
+
+
+async def _list_unmanaged_page(
+    db: AsyncSession,
+    client: NSClient,
+    api_server: str,
+    domain: str,
+    position: Dict[str, Any],
+    limit: int,
+    user: Optional[str],
+    subscription_model: Optional[str],
+) -> Tuple[List[SubscriptionResponse], Optional[Dict[str, Any]]]:
+    offset = position["o"]
+    params = {"user": user} if user else {}
+    items: List[SubscriptionResponse] = []
+    backfilled = False
+
+    for _ in range(LIST_MAX_PBX_FETCHES):
+        try:
+            batch = await client.get_subscriptions_page(
+                domain, start=offset, limit=limit, **params
+            )
+        except CallBudgetExceeded:
+            # Out of calls for now: hand back what we have with a cursor to
+            # resume from, or the 429 so the client retries this page later
+            if not items:
+                raise
+            if backfilled:
+                await db.commit()
+            return items, {**position, "o": offset}
+        except Exception as e:
+            # Managed rows were already served; end the list rather than fail
+            logger.warning(f"Failed to fetch PBX subscriptions: {e}")
+            return items, None
+        batch = batch or []
+
+        listed = [p for p in batch if p.user and p.model and p.post_url]
+        managed = await crud.get_subscriptions_by_keys(
+            db,
+            api_server,
+            domain,
+            [(api_server, domain, p.user, p.model, p.post_url) for p in listed],
+        )
+
+        for i, p in enumerate(batch):
+            if not (p.user and p.model and p.post_url):
+                continue
+            db_match = managed.get((api_server, domain, p.user, p.model, p.post_url))
+            if db_match is not None:
+                # Lazily backfill PBX identity for rows created before it was tracked
+                if p.id and db_match.pbx_subscription_id != p.id:
+                    db_match.pbx_subscription_id = p.id
+                    backfilled = True
+                if p.expires_at and db_match.pbx_expires_at is None:
+                    db_match.pbx_expires_at = p.expires_at
+                    backfilled = True
+                continue
+            if subscription_model and p.model.lower() != subscription_model.lower():
+                continue
+
+            items.append(unmanaged_response(api_server, domain, p))
+            if len(items) == limit:
+                if backfilled:
+                    await db.commit()
+                return items, {**position, "o": offset + i + 1}
+
+        offset += len(batch)
+        if len(batch) < limit:
+            if backfilled:
+                await db.commit()
+            return items, None
+
+    # Short page; the cursor carries on where the PBX scan stopped
+    if backfilled:
+        await db.commit()
+    return items, {**position, "o": offset}
+
+
+async def with_pbx_subscription_id(
+    client: NSClient,
+    sub: Subscription,
+    action: Callable[[str], Awaitable[Any]],
+) -> Optional[str]:
+    # Run action against the stored PBX id, falling back to a listing scan on 404
+    if sub.pbx_subscription_id:
+        try:
+            await action(sub.pbx_subscription_id)
+            return sub.pbx_subscription_id
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            logger.info(
+                f"Stored PBX id {sub.pbx_subscription_id} for local sub {sub.id} "
+                "is stale. Scanning."
+            )
+
+    pbx_sub = await client.find_subscription(
+        sub.domain, sub.user, sub.subscription_model, sub.post_url
+    )
+    if not pbx_sub or not pbx_sub.id:
+        return None
+
+    await action(pbx_sub.id)
+    return pbx_sub.id
+
+
+async def push_create(
+    client: NSClient, domain: str, sub_in: SubscriptionCreate
+) -> Tuple[Optional[str], datetime]:
+    # Create subscription on PBX; returns PBX id and expiry. The expiry is
+    # settled once here and stored as-is by crud.subscription_values
+    now = datetime.now(timezone.utc)
+    if sub_in.expires_at:
+        expires_at = sub_in.expires_at
+        expires_seconds = max(60, int((expires_at - now).total_seconds()))
+    else:
+        expires_seconds = subscription_lifetime_seconds()
+        expires_at = now + timedelta(seconds=expires_seconds)
+    pbx_resp = await client.create_subscription(
+        domain=domain,
+        user=sub_in.user,
+        model=sub_in.subscription_model.lower(),
+        url=sub_in.post_url,
+        expires=expires_seconds,
+    )
+    return extract_subscription_id(pbx_resp), expires_at
+
+
+async def push_update(
+    client: NSClient, db_sub: Subscription, sub_update: SubscriptionUpdate
+) -> None:
+    # Apply update on PBX (re-creating if gone) and record PBX id/expiry on db_sub
+    ns_payload: Dict[str, Any] = {
+        "model": db_sub.subscription_model,
+        "post-url": (sub_update.post_url if sub_update.post_url else db_sub.post_url),
+        "subscription-geo-support": "yes",
+    }
+    if sub_update.expires_at:
+        duration = sub_update.expires_at - datetime.now(timezone.utc)
+        ns_payload["expires"] = max(60, int(duration.total_seconds()))
+
+    target_pbx_id = await with_pbx_subscription_id(
+        client,
+        db_sub,
+        lambda pbx_id: client.update_subscription(pbx_id, db_sub.domain, **ns_payload),
+    )
+
+    if target_pbx_id:
+        logger.info(f"Updated PBX sub {target_pbx_id} for local sub {db_sub.id}")
+        if sub_update.expires_at:
+            db_sub.pbx_expires_at = sub_update.expires_at
+    else:
+        logger.warning(
+            f"PBX sub not found for local sub {db_sub.id}. Attempting re-creation."
+        )
+        expires_seconds = subscription_lifetime_seconds()
+        pbx_resp = await client.create_subscription(
+            domain=db_sub.domain,
+            user=db_sub.user,
+            model=db_sub.subscription_model.lower(),
+            url=sub_update.post_url if sub_update.post_url else db_sub.post_url,
+            expires=expires_seconds,
+        )
+        target_pbx_id = extract_subscription_id(pbx_resp)
+        db_sub.pbx_expires_at = datetime.now(timezone.utc) + timedelta(
+            seconds=expires_seconds
+        )
+
+    db_sub.pbx_subscription_id = target_pbx_id
+
+
+async def push_delete(client: NSClient, sub: Subscription) -> Optional[str]:
+    # Delete subscription from PBX; a subscription already gone is not an error
+    try:
+        target_id = await with_pbx_subscription_id(
+            client,
+            sub,
+            lambda pbx_id: client.delete_subscription(pbx_id, domain=sub.domain),
+        )
+    except HTTPException as e:
+        if e.status_code != 404:
+            raise
+        logger.info(
+            "Subscription not found on PBX (404). Proceeding to archive local record."
+        )
+        return None
+
+    if target_id:
+        logger.info(f"Deleted PBX subscription {target_id} for local sub {sub.id}")
+    else:
+        logger.warning(
+            f"Could not find PBX subscription for local sub {sub.id} to delete."
+        )
+    return target_id
+
+
+def bulk_pbx_calls(
+    op: BulkOperation, sub: Optional[Subscription]
+) -> Tuple[Dict[str, int], int]:
+    # Worst-case PBX calls for one bulk operation, per operation and in all.
+    # A stale stored id costs the failed call, a listing scan and then the
+    # retry, or a re-create for updates; with no stored id the scan comes first.
+    if isinstance(op, BulkCreateOperation):
+        return {"create_subscription": 1}, 1
+    stored = sub is not None and bool(sub.pbx_subscription_id)
+    calls = {f"{op.action}_subscription": 2 if stored else 1, "list_subscriptions": 1}
+    if isinstance(op, BulkUpdateOperation):
+        calls["create_subscription"] = 1
+    return calls, 3 if stored else 2
+
+
+async def apply_bulk_operations(
+    db: AsyncSession,
+    client: NSClient,
+    user: NSUser,
+    api_server: str,
+    operations: List[BulkOperation],
+) -> List[BulkItemResult]:
+    # Run PBX calls concurrently, then persist all successes in one transaction
+    results: List[Optional[BulkItemResult]] = [None] * len(operations)
+
+    target_ids = [
+        op.id
+        for op in operations
+        if isinstance(op, (BulkUpdateOperation, BulkDeleteOperation))
+    ]
+    existing = await crud.get_subscriptions_by_ids(
+        db, api_server, user.domain, target_ids
+    )
+
+    # Reject operations that cannot run before any PBX call is made
+    seen_ids = set()
+    # Two creates for one (user, model, post_url) would both reach the PBX
+    # but upsert into a single row, orphaning the first PBX subscription
+    seen_keys = set()
+    runnable: List[Tuple[int, BulkOperation]] = []
+    for index, op in enumerate(operations):
+        if isinstance(op, BulkCreateOperation):
+            sub_in = op.subscription
+            key = (sub_in.user, sub_in.subscription_model.lower(), sub_in.post_url)
+            if key in seen_keys:
+                error = "Duplicate create for subscription in this batch"
+            else:
+                error = None
+                seen_keys.add(key)
+        elif op.id not in existing:
+            error = "Subscription not found"
+        elif op.id in seen_ids:
+            error = "Duplicate operation for subscription in this batch"
+        else:
+            error = None
+            seen_ids.add(op.id)
+        if error:
+            results[index] = BulkItemResult(
+                index=index, action=op.action, status="error", error=error
+            )
+            continue
+        runnable.append((index, op))
+
+    # Refuse the whole batch if the domain's PBX call budget cannot cover its
+    # worst case, rather than running out partway and leaving it half applied
+    calls: Dict[str, int] = {}
+    total = 0
+    for _, op in runnable:
+        sub = None if isinstance(op, BulkCreateOperation) else existing[op.id]
+        op_calls, op_total = bulk_pbx_calls(op, sub)
+        for operation, count in op_calls.items():
+            calls[operation] = calls.get(operation, 0) + count
+        total += op_total
+    NSClient.budget.check(user.domain, calls, total)
+
+    semaphore = asyncio.Semaphore(max(1, settings.BULK_MAX_CONCURRENCY))
+    created: Dict[int, Dict[str, Any]] = {}
+
+    async def run_pbx(index: int, op: BulkOperation) -> None:
+        async with semaphore:
+            try:
+                if isinstance(op, BulkCreateOperation):
+                    pbx_id, pbx_expires_at = await push_create(
+                        client, user.domain, op.subscription
+                    )
+                    created[index] = crud.subscription_values(
+                        op.subscription,
+                        api_server,
+                        user.domain,
+                        pbx_subscription_id=pbx_id,
+                        pbx_expires_at=pbx_expires_at,
+                    )
+                elif isinstance(op, BulkUpdateOperation):
+                    await push_update(client, existing[op.id], op.changes)
+                else:
+                    await push_delete(client, existing[op.id])
+            except Exception as e:
+                logger.error(f"Bulk {op.action} #{index} failed on PBX: {e}")
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                results[index] = BulkItemResult(
+                    index=index,
+                    action=op.action,
+                    status="error",
+                    error=f"PBX error: {detail}",
+                )
+
+    await asyncio.gather(*(run_pbx(index, op) for index, op in runnable))
+
+    upserted = await crud.upsert_subscriptions(db, list(created.values()))
+
+    persisted: List[Tuple[int, BulkOperation, Subscription]] = []
+    for index, op in runnable:
+        if results[index] is not None:
+            continue
+
+        if isinstance(op, BulkCreateOperation):
+            sub = upserted[crud.subscription_key(created[index])]
+            action, description = "create", f"Bulk created subscription for {sub.user}"
+        elif isinstance(op, BulkUpdateOperation):
+            sub = crud.apply_subscription_update(existing[op.id], op.changes)
+            action, description = "update", f"Bulk updated subscription {sub.id}"
+        else:
+            sub = existing[op.id]
+            sub.status = "archived"
+            action, description = "delete", f"Bulk archived subscription {sub.id}"
+
+        await crud.create_audit_log(
+            db,
+            api_server=api_server,
+            domain=user.domain,
+            user=user.user,
+            action=action,
+            resource_type="subscription",
+            resource_id=sub.id,
+            description=description,
+        )
+        persisted.append((index, op, sub))
+
+    await db.commit()
+
+    for index, op, sub in persisted:
+        results[index] = BulkItemResult(
+            index=index,
+            action=op.action,
+            status="ok",
+            subscription=SubscriptionResponse.model_validate(sub),
+        )
+    return [r for r in results if r is not None]
+
+
+async def find_unmanaged(
+    db: AsyncSession, client: NSClient, api_server: str, domain: str
+) -> List[NSSubscription]:
+    # Diff one PBX listing against the managed keys of the domain
+    managed = await crud.get_subscription_keys(db, api_server, domain)
+    unmanaged: Dict[crud.SubscriptionKey, NSSubscription] = {}
+
+    async for page in client.iter_subscriptions(domain=domain):
+        for p in page:
+            if not (p.user and p.model and p.post_url):
+                continue
+            key = (api_server, domain, p.user, p.model, p.post_url)
+            if key not in managed:
+                unmanaged.setdefault(key, p)
+
+    return list(unmanaged.values())
+
+
+async def adopt_all_unmanaged(
+    db: AsyncSession,
+    client: NSClient,
+    user: NSUser,
+    api_server: str,
+    dry_run: bool = False,
+    progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+) -> AdoptAllResponse:
+    # Adopt every unmanaged PBX subscription of the domain in one upsert
+    unmanaged = await find_unmanaged(db, client, api_server, user.domain)
+
+    rows: List[Dict[str, Any]] = []
+    skipped: List[AdoptAllSkipped] = []
+    for p in unmanaged:
+        try:
+            sub_in = SubscriptionCreate(
+                user=p.user,
+                subscription_model=p.model,
+                post_url=p.post_url,
+                description=p.description,
+                expires_at=p.expires_at,
+            )
+        except ValidationError as e:
+            skipped.append(
+                AdoptAllSkipped(
+                    user=p.user,
+                    subscription_model=p.model,
+                    post_url=p.post_url,
+                    pbx_subscription_id=p.id,
+                    reason=e.errors()[0]["msg"],
+                )
+            )
+            continue
+        rows.append(
+            crud.subscription_values(
+                sub_in,
+                api_server,
+                user.domain,
+                pbx_subscription_id=p.id,
+                pbx_expires_at=p.expires_at,
+            )
+        )
+
+    if dry_run:
+        preview = [
+            SubscriptionResponse(**row, source="pbx", id=None) for row in rows
+        ]
+        return AdoptAllResponse(
+            dry_run=True,
+            unmanaged_count=len(unmanaged),
+            adopted_count=0,
+            subscriptions=preview,
+            skipped=skipped,
+        )
+
+    # Chunks keep statements bounded; each one commits so a resumed job
+    # only sees what is still unmanaged
+    adopted: List[Subscription] = []
+    for start in range(0, len(rows), ADOPT_ALL_CHUNK_SIZE):
+        upserted = await crud.upsert_subscriptions(
+            db, rows[start : start + ADOPT_ALL_CHUNK_SIZE]
+        )
+        await crud.create_audit_logs(
+            db,
+            [
+                {
+                    "api_server": api_server,
+                    "domain": user.domain,
+                    "user": user.user,
+                    "action": "adopt",
+                    "resource_type": "subscription",
+                    "resource_id": sub.id,
+                    "description": (
+                        f"Adopted existing PBX subscription for {sub.user} (adopt all)"
+                    ),
+                }
+                for sub in upserted.values()
+            ],
+        )
+        await db.commit()
+        adopted.extend(upserted.values())
+        if progress:
+            await progress(len(adopted), len(rows))
+
+    logger.info(
+        f"Adopted {len(adopted)} unmanaged subscriptions in {user.domain} "
+        f"({len(skipped)} skipped)"
+    )
+    return AdoptAllResponse(
+        dry_run=False,
+        unmanaged_count=len(unmanaged),
+        adopted_count=len(adopted),
+        subscriptions=[SubscriptionResponse.model_validate(s) for s in adopted],
+        skipped=skipped,
+    )
+
+
+@job_handler("adopt_all")
+async def adopt_all_job(ctx: JobContext) -> Dict[str, Any]:
+    response = await adopt_all_unmanaged(
+        ctx.db,
+        ctx.client,
+        NSUser(user=ctx.user or "", domain=ctx.domain),
+        ctx.api_server,
+        dry_run=bool(ctx.params.get("dry_run")),
+        progress=ctx.progress,
+    )
+    # Full row lists stay out of the job record; counts and skips are enough
+    return response.model_dump(mode="json", exclude={"subscriptions"})
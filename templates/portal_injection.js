@@ -23,6 +23,11 @@
     window.ns_last_health_check = 0;
     window.ns_was_inventory = false;
     window.ns_observer_timeout = null;
+    window.ns_health_stream_live = false;
+    window.ns_health_stream_retry = 5000;
+    window.ns_auth_state = null;
+    window.ns_subs_data = [];
+    window.ns_subs_next_cursor = null;
 
     // BADGE LOGIC
     function updateBadgeState() {
@@ -142,6 +147,12 @@
 
     function checkAndOpenNewSubModal(item) {
         var token = localStorage.getItem("ns_t");
+
+        // Already known from /bootstrap; only re-check while not connected
+        if (window.ns_auth_state && window.ns_auth_state.has_auth) {
+            openEditModal(item);
+            return;
+        }
         
         // Check if we need auth
         $.ajax({
@@ -195,6 +206,10 @@
     }
 
     function checkSubscriptionHealth() {
+        if (window.ns_health_stream_live) { // Pushed over SSE; no need to poll
+            return;
+        }
+
         var now = new Date().getTime();
         if (now - window.ns_last_health_check < 5000) { // Max once every 5 seconds
             return;
@@ -220,22 +235,99 @@
             headers: {
                 'Authorization': 'Bearer ' + token
             },
-            success: function(data) {
-                if (data.status === 'unhealthy') {
-                    showHealthWarning(data.message);
-                    window.ns_health_count = data.count;
-                } else {
-                    $('#ns_health_warning').remove();
-                    window.ns_health_count = 0;
-                }
-                updateBadgeState();
-            },
+            success: applyHealthState,
             error: function(err) {
                 console.error("Health check failed:", err);
             }
         });
     }
 
+    function applyHealthState(data) {
+        if (data.status === 'unhealthy') {
+            showHealthWarning(data.message);
+            window.ns_health_count = data.count;
+        } else {
+            $('#ns_health_warning').remove();
+            window.ns_health_count = 0;
+        }
+        updateBadgeState();
+    }
+
+    // HEALTH STREAM (SSE over fetch so the Authorization header can be sent;
+    // polling above stays in charge whenever the stream is down)
+    function startHealthStream() {
+        if (!window.fetch || !window.TextDecoder || window.ns_health_stream_live) {
+            return; // Unsupported browser or already connected: polling/stream as is
+        }
+        var token = localStorage.getItem("ns_t");
+        if (!token) {
+            scheduleHealthStreamRetry(); // Not signed in to the portal yet
+            return;
+        }
+        window.ns_health_stream_live = true; // Claimed while connecting
+
+        fetch(apiEndpoint + "/events", {
+            headers: { 'Authorization': 'Bearer ' + token, 'Accept': 'text/event-stream' },
+            cache: 'no-store'
+        }).then(function(response) {
+            if (!response.ok || !response.body) {
+                throw new Error("Health stream unavailable: " + response.status);
+            }
+            window.ns_health_stream_retry = 5000;
+
+            var reader = response.body.getReader();
+            var decoder = new TextDecoder();
+            var buffer = '';
+
+            function pump() {
+                return reader.read().then(function(chunk) {
+                    if (chunk.done) {
+                        return;
+                    }
+                    buffer += decoder.decode(chunk.value, { stream: true });
+                    var frames = buffer.split("\n\n");
+                    buffer = frames.pop();
+                    frames.forEach(handleStreamFrame);
+                    return pump();
+                });
+            }
+            return pump();
+        }).catch(function(err) {
+            console.debug("Health stream error:", err);
+        }).then(function() {
+            // Stream ended: resume polling and reconnect with backoff
+            window.ns_health_stream_live = false;
+            scheduleHealthStreamRetry();
+        });
+    }
+
+    // The only reconnect path: a single pending timer, backing off up to 5 minutes
+    function scheduleHealthStreamRetry() {
+        var delay = window.ns_health_stream_retry || 5000;
+        window.ns_health_stream_retry = Math.min(delay * 2, 300000);
+        clearTimeout(window.ns_health_stream_timer);
+        window.ns_health_stream_timer = setTimeout(startHealthStream, delay);
+    }
+
+    function handleStreamFrame(frame) {
+        var event = 'message';
+        var data = '';
+        frame.split("\n").forEach(function(line) {
+            if (line.indexOf('event:') === 0) {
+                event = line.slice(6).trim();
+            } else if (line.indexOf('data:') === 0) {
+                data += line.slice(5).trim();
+            }
+        });
+        if (event === 'health' && data) {
+            try {
+                applyHealthState(JSON.parse(data));
+            } catch (e) {
+                console.error("Bad health event:", e);
+            }
+        }
+    }
+
     function archiveSubscription(id, token) {
         if (!confirm("Are you sure you want to archive this subscription?")) return;
         
@@ -264,7 +356,8 @@
             user: item.user,
             subscription_model: item.subscription_model,
             post_url: item.post_url,
-            description: "Adopted from PBX"
+            description: "Adopted from PBX",
+            pbx_subscription_id: item.pbx_subscription_id || null
         };
 
         $.ajax({
@@ -288,6 +381,7 @@
         
         // Populate fields
         $('#sub_id').val(item ? (item.id || '') : ''); 
+        $('#sub_pbx_id').val(item ? (item.pbx_subscription_id || '') : '');
         if (item) {
             $('#sub_user').val(item.user).prop('disabled', true);
             $('#sub_model').val(item.subscription_model).prop('disabled', true);
@@ -304,7 +398,9 @@
     }
 
     // DATA FETCHER & RENDERER
-    function loadSubscriptionData() {
+    // initial: first open of the tab, served by /bootstrap in one round trip
+    // cursor: append the next page of /list to what is already shown
+    function loadSubscriptionData(initial, cursor) {
         if ($('#subscription_container').is(':visible') && $('#subscription_container').children().length > 1) {
              // Already has data and visible, skip unless explicit refresh
              // (Spinner + table is more than 1 child)
@@ -318,21 +414,32 @@
         }
 
         // Show Loading
-        $('#subscription_container').html(
+        if (!cursor) $('#subscription_container').html(
             '<div style="padding: 40px; text-align: center; color: #666;">' +
             '<i class="fa fa-spinner fa-spin fa-2x fa-fw"></i>' +
             '<div style="margin-top: 10px;">Loading Subscriptions...</div>' +
             '</div>'
         );
 
+        var listUrl = apiEndpoint + "/list" + (cursor ? "?cursor=" + encodeURIComponent(cursor) : "");
+
         $.ajax({
-            url: apiEndpoint + "/list",
+            url: initial ? apiEndpoint.replace('/subscriptions', '/bootstrap') : listUrl,
             method: 'GET',
             headers: {
                 'Authorization': 'Bearer ' + token
             },
-            success: function(data) {
+            success: function(response) {
+                var page = response;
+                if (initial) {
+                    // Auth state and health arrive with the first page
+                    window.ns_auth_state = response.auth;
+                    applyHealthState(response.health);
+                    page = response.subscriptions;
+                }
+                var data = cursor ? window.ns_subs_data.concat(page.items) : page.items;
                 window.ns_subs_data = data; // Store for lookup
+                window.ns_subs_next_cursor = page.next_cursor;
                 
                 var $container = $('#subscription_container').empty();
                 var $table = $('<table class="table table-striped table-bordered table-condensed">');
@@ -390,6 +497,15 @@
                 
                 $table.append($thead, $tbody);
                 $container.append($table);
+
+                if (window.ns_subs_next_cursor) {
+                    var $more = $('<button class="btn" id="btn_more_subs">Load more</button>');
+                    $container.append($('<div style="padding: 10px; text-align: center;">').append($more));
+                    $more.on('click', function() {
+                        $(this).prop('disabled', true);
+                        loadSubscriptionData(false, window.ns_subs_next_cursor);
+                    });
+                }
                 
                 // Wire buttons
                 $('.btn-archive').on('click', function() {
@@ -484,6 +600,7 @@
                     '<div class="modal-body">' +
                         '<form class="form-horizontal" id="form_new_subscription">' +
                             '<input type="hidden" id="sub_id">' +
+                            '<input type="hidden" id="sub_pbx_id">' +
                             '<div class="control-group">' +
                                 '<label class="control-label" for="sub_user">User</label>' +
                                 '<div class="controls">' +
@@ -544,7 +661,7 @@
                 $(elementsToHide).hide();
                 $('#content_ns_subscriptions').show();
                 
-                loadSubscriptionData();
+                loadSubscriptionData(true);
             });
 
             $navContainer.find('li').not('#tab_ns_subscriptions').find('a').on('click', function() {
@@ -642,6 +759,9 @@
                     post_url: url,
                     description: desc
                 };
+                if (!id && $('#sub_pbx_id').val()) {
+                    payload.pbx_subscription_id = $('#sub_pbx_id').val();
+                }
                 
                 $(this).prop('disabled', true).text('Saving...');
                 
@@ -680,6 +800,7 @@
         }, 60000); // 60s
     }
     scheduleNextHealthCheck();
+    startHealthStream();
     
     var observer = new MutationObserver(function(mutations) {
         if (window.ns_observer_timeout) {
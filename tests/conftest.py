@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Settings are read at import time; give the required ones test values
+os.environ.setdefault("ENCRYPTION_KEY", "-sh3sNg9_-j8TwIx2MODfotQdu7u0saxPZlGzS2YT2A=")
+os.environ.setdefault("NS_API_URL", "https://pbx.example.com/ns-api/v2")
+os.environ.setdefault("ALLOWED_ORIGINS", "*")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,184 @@
+import pytest
+from pydantic import TypeAdapter
+
+import crud
+import subscription_service
+from config import settings
+from models import NSUser, Subscription
+from ns_client import CallBudget, CallBudgetExceeded, NSClient
+from schemas import BulkOperation
+
+USER = NSUser(user="100", domain="d.com")
+operations_adapter = TypeAdapter(list[BulkOperation])
+
+
+class FakeSession:
+    async def commit(self):
+        pass
+
+
+def create(user="101", model="call", url="https://example.com/hook"):
+    return {
+        "action": "create",
+        "subscription": {
+            "user": user,
+            "subscription_model": model,
+            "post_url": url,
+        },
+    }
+
+
+@pytest.fixture
+def pbx(monkeypatch):
+    # Records the operations that got as far as the PBX; each then fails
+    # there, so nothing reaches the database
+    reached = []
+
+    async def push(action, target):
+        reached.append((action, target))
+        raise RuntimeError("PBX unavailable")
+
+    async def push_create(client, domain, sub_in):
+        await push("create", (sub_in.user, sub_in.subscription_model))
+
+    async def push_update(client, sub, changes):
+        await push("update", sub.id)
+
+    async def push_delete(client, sub):
+        await push("delete", sub.id)
+
+    async def get_subscriptions_by_ids(db, api_server, domain, ids):
+        # Ids below 10 exist; odd ones have a stored PBX id
+        return {
+            i: Subscription(
+                id=i,
+                user="101",
+                domain=domain,
+                pbx_subscription_id=f"pbx-{i}" if i % 2 else None,
+            )
+            for i in ids
+            if i < 10
+        }
+
+    async def upsert_subscriptions(db, values):
+        assert values == []
+        return {}
+
+    monkeypatch.setattr(subscription_service, "push_create", push_create)
+    monkeypatch.setattr(subscription_service, "push_update", push_update)
+    monkeypatch.setattr(subscription_service, "push_delete", push_delete)
+    monkeypatch.setattr(crud, "get_subscriptions_by_ids", get_subscriptions_by_ids)
+    monkeypatch.setattr(crud, "upsert_subscriptions", upsert_subscriptions)
+    monkeypatch.setattr(NSClient, "budget", CallBudget())
+    monkeypatch.setattr(settings, "NS_API_DOMAIN_CALL_BUDGET", 0)
+    return reached
+
+
+async def apply(operations):
+    results = await subscription_service.apply_bulk_operations(
+        FakeSession(), None, USER, "pbx", operations_adapter.validate_python(operations)
+    )
+    return {r.index: r.error for r in results}
+
+
+@pytest.mark.asyncio
+async def test_invalid_operations_are_rejected_before_any_pbx_call(pbx):
+    errors = await apply(
+        [
+            create(),
+            # Same subscription key: model case does not make it distinct
+            create(model="CALL"),
+            create(url="https://example.com/other"),
+            {"action": "update", "id": 1, "changes": {"description": "x"}},
+            {"action": "delete", "id": 1},
+            {"action": "delete", "id": 99},
+        ]
+    )
+
+    assert errors[1] == "Duplicate create for subscription in this batch"
+    assert errors[4] == "Duplicate operation for subscription in this batch"
+    assert errors[5] == "Subscription not found"
+    assert sorted(pbx) == [
+        ("create", ("101", "call")),
+        ("create", ("101", "call")),
+        ("update", 1),
+    ]
+    for index in (0, 2, 3):
+        assert errors[index] == "PBX error: PBX unavailable"
+
+
+@pytest.mark.asyncio
+async def test_creates_for_different_users_are_not_duplicates(pbx):
+    errors = await apply([create(user="101"), create(user="102")])
+    assert [action for action, _ in pbx] == ["create", "create"]
+    assert all(error.startswith("PBX error") for error in errors.values())
+
+
+@pytest.mark.asyncio
+async def test_batch_over_the_call_budget_is_refused_whole(pbx, monkeypatch):
+    monkeypatch.setattr(settings, "NS_API_DOMAIN_CALL_BUDGET", 2)
+    with pytest.raises(CallBudgetExceeded):
+        await apply(
+            [
+                create(user="101"),
+                create(user="102"),
+                {"action": "delete", "id": 1},
+            ]
+        )
+    assert pbx == []
+
+
+@pytest.mark.asyncio
+async def test_rejected_operations_do_not_count_against_the_budget(pbx, monkeypatch):
+    # One create and one delete by stored id: 1 + 3 calls at worst
+    monkeypatch.setattr(settings, "NS_API_DOMAIN_CALL_BUDGET", 4)
+    errors = await apply(
+        [
+            create(),
+            create(),
+            {"action": "delete", "id": 99},
+            {"action": "delete", "id": 1},
+        ]
+    )
+    assert len(pbx) == 2
+    assert errors[1] == "Duplicate create for subscription in this batch"
+    assert errors[2] == "Subscription not found"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "operation, worst_case",
+    [
+        # Stale stored id: the failed call, a listing scan, then a retry
+        # or a re-create
+        ({"action": "update", "id": 1, "changes": {"description": "x"}}, 3),
+        ({"action": "delete", "id": 1}, 3),
+        # No stored id: the scan, then the call
+        ({"action": "update", "id": 2, "changes": {"description": "x"}}, 2),
+        ({"action": "delete", "id": 2}, 2),
+    ],
+)
+async def test_budget_covers_the_worst_case_calls(
+    pbx, monkeypatch, operation, worst_case
+):
+    monkeypatch.setattr(settings, "NS_API_DOMAIN_CALL_BUDGET", worst_case - 1)
+    with pytest.raises(CallBudgetExceeded):
+        await apply([operation])
+    assert pbx == []
+
+    monkeypatch.setattr(settings, "NS_API_DOMAIN_CALL_BUDGET", worst_case)
+    await apply([operation])
+    assert len(pbx) == 1
+
+
+@pytest.mark.asyncio
+async def test_operation_budgets_cover_retries(pbx, monkeypatch):
+    # A stale stored id may mean two update calls for one operation
+    monkeypatch.setattr(
+        settings, "NS_API_OPERATION_CALL_BUDGETS", {"update_subscription": 1}
+    )
+    with pytest.raises(CallBudgetExceeded) as excinfo:
+        await apply([{"action": "update", "id": 1, "changes": {"description": "x"}}])
+    assert excinfo.value.operation == "update_subscription"
+    await apply([{"action": "update", "id": 2, "changes": {"description": "x"}}])
+    assert pbx == [("update", 2)]
@@ -0,0 +1,132 @@
+import pytest
+
+import ns_client
+from config import settings
+from ns_client import CallBudget, CallBudgetExceeded
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ns_client.time, "monotonic", clock)
+    monkeypatch.setattr(settings, "NS_API_BUDGET_WINDOW_SECONDS", 60)
+    monkeypatch.setattr(settings, "NS_API_DOMAIN_CALL_BUDGET", 3)
+    monkeypatch.setattr(settings, "NS_API_DOMAIN_CALL_BUDGETS", {})
+    monkeypatch.setattr(settings, "NS_API_OPERATION_CALL_BUDGETS", {})
+    return clock
+
+
+def test_zero_budget_is_unlimited(clock, monkeypatch):
+    monkeypatch.setattr(settings, "NS_API_DOMAIN_CALL_BUDGET", 0)
+    budget = CallBudget()
+    for _ in range(100):
+        budget.acquire("d.com", "get_subscriptions")
+    budget.check("d.com", {"create_subscription": 1000})
+    assert budget.usage("d.com")["limit"] is None
+
+
+def test_acquire_refuses_once_the_window_is_full(clock):
+    budget = CallBudget()
+    for _ in range(3):
+        budget.acquire("d.com", "get_subscriptions")
+        clock.now += 10
+
+    with pytest.raises(CallBudgetExceeded) as excinfo:
+        budget.acquire("d.com", "get_subscriptions")
+    # The first call leaves the window 60s after it was made
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.headers["Retry-After"] == "30"
+    assert budget.rejected[("d.com", "get_subscriptions")] == 1
+    assert budget.calls[("d.com", "get_subscriptions")] == 3
+
+
+def test_window_slides(clock):
+    budget = CallBudget()
+    for _ in range(3):
+        budget.acquire("d.com", "get_subscriptions")
+    clock.now += 60
+    budget.acquire("d.com", "get_subscriptions")
+    assert budget.usage("d.com")["used"] == 1
+
+
+def test_budgets_are_per_domain(clock, monkeypatch):
+    monkeypatch.setattr(settings, "NS_API_DOMAIN_CALL_BUDGETS", {"big.com": 10})
+    budget = CallBudget()
+    for _ in range(3):
+        budget.acquire("d.com", "get_subscriptions")
+    for _ in range(10):
+        budget.acquire("big.com", "get_subscriptions")
+    with pytest.raises(CallBudgetExceeded):
+        budget.acquire("big.com", "get_subscriptions")
+    with pytest.raises(CallBudgetExceeded):
+        budget.acquire("d.com", "get_subscriptions")
+    budget.acquire("e.com", "get_subscriptions")
+
+
+def test_operation_budget_does_not_count_a_refused_call(clock, monkeypatch):
+    monkeypatch.setattr(settings, "NS_API_DOMAIN_CALL_BUDGET", 0)
+    monkeypatch.setattr(
+        settings, "NS_API_OPERATION_CALL_BUDGETS", {"create_subscription": 1}
+    )
+    budget = CallBudget()
+    budget.acquire("d.com", "create_subscription")
+    with pytest.raises(CallBudgetExceeded) as excinfo:
+        budget.acquire("d.com", "create_subscription")
+    assert excinfo.value.operation == "create_subscription"
+    budget.acquire("d.com", "get_subscriptions")
+
+    usage = budget.usage("d.com")
+    assert usage["used"] == 2
+    assert usage["operations"]["create_subscription"] == {
+        "used": 1,
+        "limit": 1,
+        "total": 1,
+        "rejected": 1,
+    }
+
+
+def test_check_refuses_a_batch_without_counting_it(clock):
+    budget = CallBudget()
+    budget.acquire("d.com", "get_subscriptions")
+    budget.check("d.com", {"create_subscription": 2})
+    with pytest.raises(CallBudgetExceeded) as excinfo:
+        budget.check("d.com", {"create_subscription": 1, "delete_subscription": 2})
+    assert excinfo.value.operation is None
+    assert budget.usage("d.com")["used"] == 1
+
+
+def test_check_retry_after_waits_for_enough_calls_to_leave(clock):
+    budget = CallBudget()
+    for _ in range(3):
+        budget.acquire("d.com", "get_subscriptions")
+        clock.now += 10
+    # Two calls must leave the window: the second was made 20s ago
+    with pytest.raises(CallBudgetExceeded) as excinfo:
+        budget.check("d.com", {"create_subscription": 2})
+    assert excinfo.value.headers["Retry-After"] == "40"
+
+
+def test_check_batch_larger_than_budget_gets_a_full_window(clock):
+    budget = CallBudget()
+    with pytest.raises(CallBudgetExceeded) as excinfo:
+        budget.check("d.com", {"create_subscription": 4})
+    assert excinfo.value.headers["Retry-After"] == "60"
+
+
+def test_check_honours_operation_budgets(clock, monkeypatch):
+    monkeypatch.setattr(
+        settings, "NS_API_OPERATION_CALL_BUDGETS", {"delete_subscription": 1}
+    )
+    budget = CallBudget()
+    budget.check("d.com", {"create_subscription": 2, "delete_subscription": 1})
+    with pytest.raises(CallBudgetExceeded) as excinfo:
+        budget.check("d.com", {"delete_subscription": 2})
+    assert excinfo.value.operation == "delete_subscription"
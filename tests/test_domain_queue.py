@@ -0,0 +1,108 @@
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+
+import pytest
+
+import maintenance_service
+from config import settings
+from maintenance_service import DomainQueue, MaintenanceCheckpoint, RunBudget
+from models import Subscription
+from renewal_policy import domain_quantum
+
+NOW = datetime.now(timezone.utc)
+OVERDUE = NOW + timedelta(hours=1)
+LATER = NOW + timedelta(days=5)
+
+
+@pytest.fixture(autouse=True)
+def shares(monkeypatch):
+    monkeypatch.setattr(settings, "MAINTENANCE_DOMAIN_MIN_SHARE", 2)
+    monkeypatch.setattr(settings, "MAINTENANCE_URGENT_DOMAIN_WEIGHT", 3)
+    monkeypatch.setattr(settings, "SUBSCRIPTION_RENEWAL_WINDOW_HOURS", 24)
+
+
+def loaded_queue(domain: str, expires_at: datetime, count: int) -> DomainQueue:
+    # A queue whose PBX listing is already in, with every row due
+    subs = [
+        Subscription(id=i, user="101", domain=domain, expires_at=expires_at)
+        for i in range(count)
+    ]
+    queue = DomainQueue(("pbx", domain), [(sub, None) for sub in subs])
+    queue.loaded = True
+    queue.due = deque((queue.urgency, sub, None, True) for sub in subs)
+    return queue
+
+
+@pytest.fixture
+def renewals(monkeypatch):
+    # Domains in the order renewals ran; stops the run after "limit" of them
+    order = []
+    budget = RunBudget()
+    limit = {"value": None}
+
+    async def renew(db, sub, ns_client, known_users, pbx_listed, early):
+        order.append(sub.domain)
+        if len(order) == limit["value"]:
+            budget.stop()
+        return True
+
+    monkeypatch.setattr(maintenance_service, "renew_subscription", renew)
+    return order, budget, limit
+
+
+def runs(order):
+    return [(domain, len(list(group))) for domain, group in groupby(order)]
+
+
+def test_quantum_weights_overdue_domains_after_the_first_round():
+    assert domain_quantum(NOW - timedelta(hours=1), NOW, first_round=True) == 2
+    assert domain_quantum(NOW - timedelta(hours=1), NOW, first_round=False) == 6
+    assert domain_quantum(NOW + timedelta(hours=1), NOW, first_round=False) == 2
+
+
+def test_quantum_never_drops_below_one(monkeypatch):
+    monkeypatch.setattr(settings, "MAINTENANCE_DOMAIN_MIN_SHARE", 0)
+    monkeypatch.setattr(settings, "MAINTENANCE_URGENT_DOMAIN_WEIGHT", 0)
+    assert domain_quantum(NOW - timedelta(hours=1), NOW, first_round=False) == 1
+
+
+@pytest.mark.asyncio
+async def test_weighted_round_robin_across_domains(renewals):
+    order, budget, _ = renewals
+    big = loaded_queue("big.com", LATER, 10)
+    urgent = loaded_queue("urgent.com", OVERDUE, 10)
+    small = loaded_queue("small.com", LATER, 1)
+
+    await maintenance_service.renew_fairly(
+        None, [big, urgent, small], set(), budget, MaintenanceCheckpoint()
+    )
+
+    assert runs(order) == [
+        # First round: the minimum share each, overdue domains first
+        ("urgent.com", 2),
+        ("big.com", 2),
+        ("small.com", 1),
+        # Then most urgent first, overdue domains at the weighted quantum
+        ("urgent.com", 6),
+        ("big.com", 2),
+        ("urgent.com", 2),
+        ("big.com", 6),
+    ]
+    assert (big.renewed, urgent.renewed, small.renewed) == (10, 10, 1)
+    assert not any(q.pending() for q in (big, urgent, small))
+
+
+@pytest.mark.asyncio
+async def test_first_round_reaches_every_domain_before_a_large_one_drains(renewals):
+    order, budget, limit = renewals
+    limit["value"] = 6
+    queues = [loaded_queue(f"d{i}.com", OVERDUE, 50) for i in range(3)]
+
+    await maintenance_service.renew_fairly(
+        None, queues, set(), budget, MaintenanceCheckpoint()
+    )
+
+    assert runs(order) == [("d0.com", 2), ("d1.com", 2), ("d2.com", 2)]
+    # Work left when the budget runs out stays queued for the next run
+    assert [len(q.due) for q in queues] == [48, 48, 48]
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import renewal_policy
+from config import settings
+from maintenance_service import plan_early_renewals
+from models import Subscription
+
+NOW = datetime.now(timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def schedule(monkeypatch):
+    monkeypatch.setattr(settings, "SUBSCRIPTION_DURATION_DAYS", 7)
+    monkeypatch.setattr(settings, "SUBSCRIPTION_RENEWAL_WINDOW_HOURS", 24)
+    monkeypatch.setattr(settings, "MAINTENANCE_INTERVAL_MINUTES", 60)
+    monkeypatch.setattr(settings, "RENEWAL_EARLY_HORIZON_HOURS", 24)
+
+
+def subscriptions(expiries):
+    return [
+        Subscription(id=i, expires_at=expires_at)
+        for i, expires_at in enumerate(expiries)
+    ]
+
+
+def test_run_target_spreads_a_cycle_over_its_runs():
+    # 7 days of hourly runs
+    assert renewal_policy.run_target(168) == 1
+    assert renewal_policy.run_target(169) == 2
+    assert renewal_policy.run_target(0) == 0
+
+
+def test_light_run_renews_the_busiest_upcoming_hour_early():
+    cohort = NOW + timedelta(hours=24 + 5, minutes=30)
+    subs = subscriptions([cohort] * 400 + [NOW + timedelta(days=6)])
+    early = plan_early_renewals(subs)
+    assert len(early) == renewal_policy.run_target(len(subs))
+    assert early <= set(range(400))
+
+
+@pytest.mark.parametrize("days, interval", [(0, 60), (0, 120), (1, 24 * 60 * 2)])
+def test_short_cycles_do_not_break_planning(monkeypatch, days, interval):
+    monkeypatch.setattr(settings, "SUBSCRIPTION_DURATION_DAYS", days)
+    monkeypatch.setattr(settings, "MAINTENANCE_INTERVAL_MINUTES", interval)
+    subs = subscriptions([NOW + timedelta(hours=h) for h in (1, 30, 40)] + [None])
+
+    # At most one run per cycle: every active subscription is that run's share
+    assert renewal_policy.run_target(len(subs)) == len(subs)
+    early = plan_early_renewals(subs)
+    assert early <= {1, 2}
+
+
+def test_projection_always_has_an_hour(monkeypatch):
+    monkeypatch.setattr(settings, "SUBSCRIPTION_DURATION_DAYS", 0)
+    assert renewal_policy.cycle_hours() == 1
+    hourly = renewal_policy.projected_histogram(
+        [None, NOW, NOW + timedelta(days=3)], NOW, 0
+    )
+    assert hourly == [2]
@@ -0,0 +1,52 @@
+import pytest
+from fastapi import Request, Response
+
+from http_cache import etag_matches, not_modified, set_validators, weak_etag
+
+
+def request_with(if_none_match=None) -> Request:
+    headers = []
+    if if_none_match is not None:
+        headers.append((b"if-none-match", if_none_match.encode()))
+    return Request({"type": "http", "method": "GET", "headers": headers})
+
+
+def test_weak_etag_is_stable_per_version():
+    etag = weak_etag("d.com", 41, "id")
+    assert etag.startswith('W/"') and etag.endswith('"')
+    assert etag == weak_etag("d.com", 41, "id")
+    assert etag != weak_etag("d.com", 42, "id")
+    assert etag != weak_etag("e.com", 41, "id")
+
+
+@pytest.mark.parametrize(
+    "header, matches",
+    [
+        (None, False),
+        ("", False),
+        ("*", True),
+        ('W/"abc"', True),
+        ('"abc"', True),
+        ('W/"other", W/"abc"', True),
+        ('"other"', False),
+        ('W/"abcd"', False),
+    ],
+)
+def test_if_none_match_uses_weak_comparison(header, matches):
+    assert etag_matches(request_with(header), 'W/"abc"') is matches
+
+
+def test_not_modified_carries_the_validators():
+    response = not_modified('W/"abc"')
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == 'W/"abc"'
+    assert response.headers["cache-control"] == "private, no-cache"
+    assert response.headers["vary"] == "Authorization"
+
+
+def test_set_validators_on_a_full_response():
+    response = Response(content=b"{}", media_type="application/json")
+    set_validators(response, 'W/"abc"')
+    assert response.headers["etag"] == 'W/"abc"'
+    assert response.headers["vary"] == "Authorization"
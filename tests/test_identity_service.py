@@ -0,0 +1,200 @@
+import base64
+import json
+import time
+
+import pytest
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from fastapi import HTTPException
+
+import identity_service
+from config import settings
+from identity_service import SigningKeys, TokenUnverifiable, verify_portal_token
+
+RSA_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+EC_KEY = ec.generate_private_key(ec.SECP256R1())
+
+
+def b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def b64int(value: int) -> str:
+    return b64(value.to_bytes((value.bit_length() + 7) // 8, "big"))
+
+
+def rsa_jwk(kid: str, key=RSA_KEY) -> dict:
+    numbers = key.public_key().public_numbers()
+    return {"kty": "RSA", "kid": kid, "n": b64int(numbers.n), "e": b64int(numbers.e)}
+
+
+def ec_jwk(kid: str) -> dict:
+    numbers = EC_KEY.public_key().public_numbers()
+    return {
+        "kty": "EC",
+        "kid": kid,
+        "crv": "P-256",
+        "x": b64(numbers.x.to_bytes(32, "big")),
+        "y": b64(numbers.y.to_bytes(32, "big")),
+    }
+
+
+def sign(claims: dict, alg: str = "RS256", kid: str = "rsa-1", key=None) -> str:
+    header = {"alg": alg, "typ": "JWT", "kid": kid}
+    signing_input = ".".join(
+        b64(json.dumps(part).encode()) for part in (header, claims)
+    )
+    if alg.startswith("RS"):
+        signature = (key or RSA_KEY).sign(
+            signing_input.encode(), padding.PKCS1v15(), hashes.SHA256()
+        )
+    else:
+        r, s = decode_dss_signature(
+            (key or EC_KEY).sign(signing_input.encode(), ec.ECDSA(hashes.SHA256()))
+        )
+        signature = r.to_bytes(32, "big") + s.to_bytes(32, "big")
+    return f"{signing_input}.{b64(signature)}"
+
+
+def claims(**overrides) -> dict:
+    return {"user": "101", "domain": "d.com", "exp": time.time() + 300, **overrides}
+
+
+@pytest.fixture
+def jwks(monkeypatch):
+    # The published key set; tests may edit it to simulate rotation
+    published = {"keys": [rsa_jwk("rsa-1"), ec_jwk("ec-1")]}
+    fetches = []
+    keys = SigningKeys()
+
+    async def fetch():
+        fetches.append(time.monotonic())
+        return published
+
+    monkeypatch.setattr(keys, "_fetch", fetch)
+    monkeypatch.setattr(identity_service, "signing_keys", keys)
+    monkeypatch.setattr(settings, "IDENTITY_JWT_ISSUER", "")
+    monkeypatch.setattr(settings, "IDENTITY_JWT_LEEWAY_SECONDS", 30)
+    return published, fetches
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("alg, kid", [("RS256", "rsa-1"), ("ES256", "ec-1")])
+async def test_valid_token_resolves_identity(jwks, alg, kid):
+    user = await verify_portal_token(sign(claims(email="a@d.com"), alg, kid))
+    assert (user.user, user.domain) == ("101", "d.com")
+
+
+@pytest.mark.asyncio
+async def test_tampered_token_is_401(jwks):
+    header, _, signature = sign(claims()).split(".")
+    forged = b64(json.dumps(claims(user="999")).encode())
+    with pytest.raises(HTTPException) as excinfo:
+        await verify_portal_token(f"{header}.{forged}.{signature}")
+    assert excinfo.value.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_signature_from_another_key_is_401(jwks):
+    other = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with pytest.raises(HTTPException) as excinfo:
+        await verify_portal_token(sign(claims(), key=other))
+    assert excinfo.value.detail == "Invalid token signature"
+
+
+@pytest.mark.asyncio
+async def test_algorithm_must_match_the_key_type(jwks):
+    # An EC signature presented against the RSA key id
+    with pytest.raises(HTTPException) as excinfo:
+        await verify_portal_token(sign(claims(), "ES256", "rsa-1"))
+    assert excinfo.value.status_code == 401
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "overrides, detail",
+    [
+        ({"exp": time.time() - 60}, "Token expired"),
+        ({"nbf": time.time() + 60}, "Token not yet valid"),
+    ],
+)
+async def test_time_claims_outside_leeway_are_401(jwks, overrides, detail):
+    with pytest.raises(HTTPException) as excinfo:
+        await verify_portal_token(sign(claims(**overrides)))
+    assert excinfo.value.detail == detail
+
+
+@pytest.mark.asyncio
+async def test_expiry_within_leeway_is_accepted(jwks):
+    user = await verify_portal_token(sign(claims(exp=time.time() - 10)))
+    assert user.user == "101"
+
+
+@pytest.mark.asyncio
+async def test_issuer_is_checked_when_configured(jwks, monkeypatch):
+    monkeypatch.setattr(settings, "IDENTITY_JWT_ISSUER", "https://pbx.example.com")
+    await verify_portal_token(sign(claims(iss="https://pbx.example.com")))
+    with pytest.raises(HTTPException) as excinfo:
+        await verify_portal_token(sign(claims(iss="https://evil.example.com")))
+    assert excinfo.value.detail == "Token issuer not accepted"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "token",
+    [
+        "opaque-access-token",
+        "a.b",
+        "!!.!!.!!",
+        sign(claims(), "HS256"),
+        sign(claims(), kid="unknown"),
+        sign({"user": "101", "domain": "d.com"}),
+        sign(claims(user="")),
+    ],
+)
+async def test_tokens_that_cannot_be_checked_fall_back_to_the_pbx(jwks, token):
+    with pytest.raises(TokenUnverifiable):
+        await verify_portal_token(token)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kid", [["rsa-1"], {"id": "rsa-1"}, 1])
+async def test_non_string_kid_falls_back_to_the_pbx(jwks, kid):
+    with pytest.raises(TokenUnverifiable):
+        await verify_portal_token(sign(claims(), kid=kid))
+
+
+@pytest.mark.asyncio
+async def test_unknown_kid_refetches_once_per_interval(jwks):
+    published, fetches = jwks
+    await verify_portal_token(sign(claims()))
+    assert len(fetches) == 1
+
+    rotated = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    token = sign(claims(), kid="rsa-2", key=rotated)
+    # Seen too soon after the last fetch: no refetch, PBX fallback
+    with pytest.raises(TokenUnverifiable):
+        await verify_portal_token(token)
+    assert len(fetches) == 1
+
+    published["keys"].append(rsa_jwk("rsa-2", rotated))
+    keys = identity_service.signing_keys
+    keys._attempted_at -= identity_service.KEY_REFETCH_MIN_SECONDS
+    user = await verify_portal_token(token)
+    assert user.user == "101"
+    assert len(fetches) == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_fetch_keeps_the_previous_keys(jwks, monkeypatch):
+    await verify_portal_token(sign(claims()))
+    keys = identity_service.signing_keys
+
+    async def unreachable():
+        raise OSError("connection refused")
+
+    monkeypatch.setattr(keys, "_fetch", unreachable)
+    await keys.refresh()
+    user = await verify_portal_token(sign(claims()))
+    assert user.domain == "d.com"
@@ -0,0 +1,69 @@
+import base64
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from subscription_service import decode_list_cursor, encode_list_cursor
+
+
+def raw_cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+def test_no_cursor_starts_at_managed_rows():
+    assert decode_list_cursor(None, "id", None) == {"s": "id", "p": "db"}
+    assert decode_list_cursor("", "-user", "db") == {"s": "-user", "p": "db"}
+
+
+def test_no_cursor_for_pbx_source_starts_at_offset_zero():
+    assert decode_list_cursor(None, "id", "pbx") == {"s": "id", "p": "pbx", "o": 0}
+
+
+@pytest.mark.parametrize(
+    "sort, position",
+    [
+        ("id", {"s": "id", "p": "db", "k": [42]}),
+        ("-user", {"s": "-user", "p": "db", "k": ["101", 7]}),
+        ("change_version", {"s": "change_version", "p": "db", "k": [9000, 3]}),
+        ("id", {"s": "id", "p": "pbx", "o": 250}),
+    ],
+)
+def test_round_trip(sort, position):
+    cursor = encode_list_cursor(position)
+    assert "=" not in cursor
+    assert decode_list_cursor(cursor, sort, None) == position
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not base64!",
+        raw_cursor(["s", "id"]),
+        raw_cursor({"p": "db"}),
+        raw_cursor({"s": "user", "p": "db"}),
+        raw_cursor({"s": "id", "p": "elsewhere"}),
+        raw_cursor({"s": "id", "p": "pbx"}),
+        raw_cursor({"s": "id", "p": "pbx", "o": -1}),
+        raw_cursor({"s": "id", "p": "pbx", "o": "10"}),
+        raw_cursor({"s": "id", "p": "pbx", "o": True}),
+        raw_cursor({"s": "id", "p": "db", "k": 42}),
+        raw_cursor({"s": "id", "p": "db", "k": [42, 1]}),
+        raw_cursor({"s": "id", "p": "db", "k": ["42"]}),
+        raw_cursor({"s": "id", "p": "db", "k": [None]}),
+    ],
+)
+def test_invalid_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        decode_list_cursor(cursor, "id", None)
+    assert excinfo.value.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "key", [["101"], [101, 7], ["101", "7"], ["101", 7, 8]]
+)
+def test_cursor_key_must_match_sort_column_and_tie_breaker(key):
+    cursor = encode_list_cursor({"s": "user", "p": "db", "k": key})
+    with pytest.raises(HTTPException) as excinfo:
+        decode_list_cursor(cursor, "user", None)
+    assert excinfo.value.status_code == 400
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+import pytest
+
+import renewal_policy
+from config import settings
+from renewal_policy import retry_delay
+
+
+@pytest.fixture(autouse=True)
+def backoff(monkeypatch):
+    monkeypatch.setattr(settings, "MAINTENANCE_RETRY_BASE_MINUTES", 15)
+    monkeypatch.setattr(settings, "MAINTENANCE_RETRY_MAX_HOURS", 6)
+
+
+@pytest.mark.parametrize(
+    "attempts, full",
+    [
+        (0, timedelta(minutes=15)),
+        (1, timedelta(minutes=15)),
+        (2, timedelta(minutes=30)),
+        (3, timedelta(hours=1)),
+        (5, timedelta(hours=4)),
+        (6, timedelta(hours=6)),
+        (1000, timedelta(hours=6)),
+    ],
+)
+def test_delay_stays_in_upper_half_of_capped_backoff(attempts, full):
+    for _ in range(200):
+        assert full / 2 <= retry_delay(attempts) <= full
+
+
+@pytest.mark.parametrize("draw, expected", [("low", 30), ("high", 60)])
+def test_jitter_spans_the_upper_half(monkeypatch, draw, expected):
+    monkeypatch.setattr(
+        renewal_policy.random,
+        "uniform",
+        lambda a, b: a if draw == "low" else b,
+    )
+    assert retry_delay(3) == timedelta(minutes=expected)
+
+
+def test_items_failing_together_spread_out():
+    delays = {retry_delay(4) for _ in range(50)}
+    assert len(delays) > 1
@@ -0,0 +1,44 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from models import Subscription
+from schemas import SubscriptionResponse
+from serialization import SUBSCRIPTION_FIELDS, FastJSONResponse, subscription_dict
+
+NOW = datetime(2026, 10, 19, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+
+def full_row() -> Subscription:
+    return Subscription(
+        id=7,
+        api_server="https://pbx.example.com/ns-api/v2",
+        domain="d.com",
+        user="101",
+        subscription_model="call",
+        post_url="https://example.com/hook",
+        description="Front desk",
+        status="active",
+        expires_at=NOW + timedelta(days=7),
+        created_at=NOW - timedelta(days=1),
+        updated_at=NOW,
+        pbx_subscription_id="pbx-7",
+        pbx_expires_at=NOW + timedelta(days=7, seconds=5),
+        maintenance_status="failed",
+        last_maintenance_attempt=NOW - timedelta(hours=1),
+        maintenance_message="PBX error: 503",
+        attempt_count=2,
+        next_attempt_at=NOW + timedelta(minutes=30),
+    )
+
+
+def test_every_response_field_is_populated():
+    row = subscription_dict(full_row())
+    assert tuple(row) == SUBSCRIPTION_FIELDS
+    assert all(value is not None for value in row.values())
+
+
+def test_matches_the_response_model():
+    sub = full_row()
+    rendered = json.loads(FastJSONResponse().render([subscription_dict(sub)]))
+    expected = SubscriptionResponse.model_validate(sub).model_dump(mode="json")
+    assert rendered == [expected]